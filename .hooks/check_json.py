@@ -1,43 +1,45 @@
-import json
+import argparse
 import os
 import sys
-from collections import Counter
-from typing import Any, Dict, List
-
-
-def check_data(data: List[Dict[str, Any]], name: str):
-    for x in data["features"]:
-        assert isinstance(
-            x["geometry"]["coordinates"][0], float
-        ), f"In {name} file did not find float for coordinates for ID = {x['properties']['id']}"
-        assert isinstance(
-            x["geometry"]["coordinates"][1], float
-        ), f"In {name} file did not find float for coordinates for ID = {x['properties']['id']}"
-
 
 root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-try:
-    with open(os.path.join(root_dir, "data", "server_locations.json"), "r") as f:
-        data = json.load(f)
+sys.path.insert(0, os.path.join(root_dir, "backend"))
+
+from pennyme.validation import MAX_ERRORS, validate_changed, validate_file  # noqa: E402
 
-    check_data(data, name="server locations")
-    id_counts = Counter([e["properties"]["id"] for e in data["features"]])
-    if not id_counts.most_common()[0][-1] == 1:
-        non_unique = [item for item, cnt in id_counts.items() if cnt > 1]
-        raise ValueError(
-            f"{len(non_unique)} duplicate entries in server_locations: {non_unique}"
-        )
+FILES = {
+    "server locations": os.path.join(root_dir, "data", "server_locations.json"),
+    "all locations": os.path.join(root_dir, "data", "all_locations.json"),
+}
 
-except Exception as e:
-    print(f"Data is corrupted: {e}")
-    sys.exit(1)
+parser = argparse.ArgumentParser(description="Validate the location data files")
+parser.add_argument(
+    "--changed",
+    action="store_true",
+    help="Only validate the features touched by the staged changes",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=os.cpu_count() or 1,
+    help="Number of processes to validate large files",
+)
 
-try:
-    with open(os.path.join(root_dir, "data", "all_locations.json"), "r") as f:
-        data = json.load(f)
-        check_data(data, name="all locations")
-except Exception as e:
-    print(f"Data is corrupted: {e}")
-    sys.exit(1)
-print("SUCCESS!")
-sys.exit(0)
+if __name__ == "__main__":
+    args = parser.parse_args()
+    validate = validate_changed if args.changed else validate_file
+    failed = False
+    for name, path in FILES.items():
+        if not os.path.exists(path):
+            continue
+        errors = validate(path, label=name, workers=args.workers)
+        for error in errors[:MAX_ERRORS]:
+            print(error)
+        if len(errors) > MAX_ERRORS:
+            print(f"... and {len(errors) - MAX_ERRORS} more errors in {name}")
+        failed |= bool(errors)
+    if failed:
+        print("Data is corrupted")
+        sys.exit(1)
+    print("SUCCESS!")
+    sys.exit(0)
@@ -1,5 +1,6 @@
 import copy
 import json
+import math
 import os
 import queue
 import random
@@ -8,13 +9,14 @@ from datetime import datetime
 from pathlib import Path
 from threading import Thread
 from time import sleep
-from typing import Any, Dict, Tuple
+from typing import Any, Callable, Dict, Mapping, Tuple
 
 import pandas as pd
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, send_file
 from googlemaps import Client as GoogleMaps
-from haversine import haversine
 from loguru import logger
+from pennyme.clusters import ServerClusters
+from pennyme.geo import haversine_distance
 from pennyme.github_update import (
     get_latest_commit_time,
     load_latest_json,
@@ -22,17 +24,42 @@ from pennyme.github_update import (
     push_newmachine_to_github,
     wait,
 )
+from pennyme.image_store import (
+    IMMUTABLE_MAX_AGE,
+    content_hash,
+    is_image_file,
+    manifest_since,
+    update_manifest,
+    url_version,
+)
+from pennyme.images import make_derivatives, process_uploaded_image
 from pennyme.locations import COUNTRIES
 from pennyme.slack import (
+    PATH_SERVER_LOCATION,
     image_slack,
     message_slack,
     message_slack_raw,
-    process_uploaded_image,
+    start_slack_sender,
+)
+from pennyme.uploads import (
+    UploadError,
+    append_chunk,
+    cleanup_stale_uploads,
+    create_upload,
+    finalize_upload,
+    get_upload,
+    get_upload_result,
+    set_upload_result,
+)
+from pennyme.utils import (
+    find_machine_in_database,
+    iter_all_locations,
+    setup_locdiffer_logger,
 )
-from pennyme.utils import find_machine_in_database, setup_locdiffer_logger
 from scripts.location_differ import location_differ
 from scripts.open_diff_pull_request import open_differ_pr
 from thefuzz import process as fuzzysearch
+from werkzeug.security import safe_join
 
 app = Flask(__name__)
 request_queue = queue.Queue()
@@ -50,6 +77,9 @@ with open("blocked_ips.json", "r") as infile:
 with open("ip_comment_dict.json", "r") as f:
     IP_COMMENT_DICT = json.load(f)
 
+# Updated from the server locations file when it changes
+CLUSTERS = ServerClusters(iter_all_locations(), PATH_SERVER_LOCATION)
+
 
 @app.route("/add_comment", methods=["GET"])
 def add_comment():
@@ -86,8 +116,6 @@ def add_comment():
 @app.route("/upload_image", methods=["POST"])
 def upload_image():
     """Receives an image and saves it to the server."""
-    machine_id = str(request.args.get("id"))
-    coin_idx_str = request.args.get("coin_idx", "-1")
     ip_address = request.remote_addr
     if ip_address in blocked_ips:
         return jsonify({"error": "User IP address is blocked"}), 403
@@ -95,6 +123,26 @@ def upload_image():
     if "image" not in request.files:
         return jsonify({"error": "No image file found"}), 400
 
+    return process_image_upload(request.args, ip_address, request.files["image"].save)
+
+
+def process_image_upload(
+    args: Mapping[str, str], ip_address: str, save_image: Callable[[str], Any]
+) -> Tuple[Response, int]:
+    """
+    Process an uploaded machine or coin image (resize, coin detection, slack, ...).
+
+    Args:
+        args: Query parameters of the upload with the machine `id` and `coin_idx`.
+        ip_address: The IP address of the user.
+        save_image: Function that stores the uploaded image at a given path.
+
+    Returns:
+        The response and status code for the user.
+    """
+    machine_id = str(args.get("id"))
+    coin_idx_str = args.get("coin_idx", "-1")
+
     try:
         coin_idx = int(coin_idx_str)
     except Exception:
@@ -116,7 +164,7 @@ def upload_image():
         msg = f"Coin {coin_idx}, machine"
 
     img_path = os.path.join(PATH_IMAGES, f"{machine_id}{fname_suffix}.jpg")
-    request.files["image"].save(img_path)
+    save_image(img_path)
     code, msg_prefix, saved_path = process_uploaded_image(img_path)
     msg = f"{msg_prefix} - {msg}"
 
@@ -131,8 +179,12 @@ def upload_image():
         # Delete image since there was an error
         sleep(1)
         Path(saved_path).unlink()
+        update_manifest([img_path, saved_path])
         return jsonify({"error": msg}), code
 
+    derivatives = make_derivatives(saved_path)
+    update_manifest([img_path, saved_path] + derivatives)
+
     # send message to slack
     image_slack(
         machine_id, ip=ip_address, fname_suffix=fname_suffix, img_slack_text=msg
@@ -141,6 +193,71 @@ def upload_image():
     return jsonify({"message": "Image uploaded successfully"}), 200
 
 
+@app.route("/images/<path:filename>", methods=["GET"])
+def serve_image(filename: str):
+    """
+    Serves a machine or coin image. Responses carry a strong ETag derived from the
+    image content such that repeated views are answered with 304, and range
+    requests are honoured. Hashed URLs (`?v=<hash>`) are cached forever.
+    """
+    img_path = safe_join(os.path.abspath(PATH_IMAGES), filename)
+    if img_path is None or not is_image_file(img_path) or not os.path.isfile(img_path):
+        return jsonify({"error": "Image not found"}), 404
+
+    digest = content_hash(img_path)
+    # Unversioned URLs may change content, so clients have to revalidate (no-cache)
+    versioned = request.args.get("v") == url_version(digest)
+    # send_file streams via wsgi.file_wrapper and handles If-None-Match and Range
+    response = send_file(
+        img_path,
+        conditional=True,
+        etag=digest,
+        max_age=IMMUTABLE_MAX_AGE if versioned else None,
+    )
+    if versioned:
+        response.cache_control.immutable = True
+    return response
+
+
+@app.route("/image_manifest", methods=["GET"])
+def image_manifest():
+    """
+    Returns all images that changed since the revision given as `since` cursor,
+    such that clients only download new or modified images.
+    """
+    since_str = request.args.get("since", "0")
+    try:
+        since = int(since_str)
+    except ValueError:
+        return jsonify({"error": f"Invalid cursor {since_str}"}), 400
+    if since < 0:
+        return jsonify({"error": f"Invalid cursor {since_str}"}), 400
+    return jsonify(manifest_since(since)), 200
+
+
+@app.route("/clusters", methods=["GET"])
+def clusters():
+    """
+    Returns the clusters of machines at zoom level `z` as geojson, optionally only
+    within a bounding box `bbox=west,south,east,north`. Every cluster counts its
+    machines by status.
+    """
+    zoom_str = request.args.get("z", "0")
+    bbox_str = request.args.get("bbox")
+    try:
+        zoom = int(zoom_str)
+        bbox = None if bbox_str is None else tuple(map(float, bbox_str.split(",")))
+    except ValueError:
+        return jsonify({"error": f"Invalid zoom {zoom_str} or bbox {bbox_str}"}), 400
+    if zoom < 0:
+        return jsonify({"error": f"Invalid zoom {zoom_str}"}), 400
+    if bbox is not None and (
+        len(bbox) != 4 or not all(map(math.isfinite, bbox)) or bbox[1] > bbox[3]
+    ):
+        return jsonify({"error": f"Invalid bbox {bbox_str}"}), 400
+    return jsonify(CLUSTERS.clusters(zoom, bbox)), 200
+
+
 def save_comment(comment: str, ip: str, machine_id: int):
     """
     Saves a comment to the json file.
@@ -197,6 +314,8 @@ def process_machine_entry(
 
         # Upload the image
         code, msg, img_path = process_uploaded_image(img_path)
+        derivatives = make_derivatives(img_path) if code == 200 else []
+        update_manifest([img_path] + derivatives)
 
         # Send message to slack
         image_slack(
@@ -249,9 +368,28 @@ def address_to_coordinates(
 @app.route("/create_machine", methods=["POST"])
 def create_machine():
     """Receives a new machine"""
-    title = str(request.args.get("title")).strip()
-    address = str(request.args.get("address")).strip()
-    area = str(request.args.get("area")).strip()
+    return process_machine_creation(
+        request.args, request.remote_addr, request.files["image"].save
+    )
+
+
+def process_machine_creation(
+    args: Mapping[str, str], ip_address: str, save_image: Callable[[str], Any]
+) -> Tuple[Response, int]:
+    """
+    Validate a new machine and queue it for being pushed to GitHub.
+
+    Args:
+        args: Query parameters with the machine information.
+        ip_address: The IP address of the user.
+        save_image: Function that stores the uploaded image at a given path.
+
+    Returns:
+        The response and status code for the user.
+    """
+    title = str(args.get("title")).strip()
+    address = str(args.get("address")).strip()
+    area = str(args.get("area")).strip()
 
     # Identify area
     area, score = fuzzysearch.extract(area, COUNTRIES, limit=1)[0]
@@ -266,15 +404,15 @@ def create_machine():
         )
 
     location = (
-        float(request.args.get("lon_coord")),
-        float(request.args.get("lat_coord")),
+        float(args.get("lon_coord")),
+        float(args.get("lat_coord")),
     )
     # Verify that address matches coordinates
     found_coords, (lat, lng) = address_to_coordinates(address, area, title)
     if not found_coords:
         return jsonify({"error": "Google Maps does not know this address"}), 400
 
-    dist = haversine((lat, lng), (location[1], location[0]))
+    dist = haversine_distance(lat, lng, location[1], location[0])
     address_okay = dist <= 1  # km
 
     # Get google maps address for the coordinates
@@ -305,14 +443,14 @@ def create_machine():
                     address += out[0]["formatted_address"]
 
     try:
-        multimachine = int(request.args.get("multimachine"))
+        multimachine = int(args.get("multimachine"))
     except ValueError:
         # just put the multimachine as a string, we need to correct it then
-        multimachine = str(request.args.get("multimachine"))
+        multimachine = str(args.get("multimachine"))
 
-    num_coins = int(request.args.get("num_coins", 4))
+    num_coins = int(args.get("num_coins", 4))
 
-    paywall = True if request.args.get("paywall") == "true" else False
+    paywall = True if args.get("paywall") == "true" else False
 
     # put properties into dictionary
     tmp_id = random.randint(-(2**16), -1)
@@ -339,10 +477,9 @@ def create_machine():
         "geometry": {"type": "Point", "coordinates": location},
         "properties": properties_dict,
     }
-    ip_address = request.remote_addr
 
     tmp_path = os.path.join(PATH_IMAGES, f"{tmp_id}.jpg")
-    request.files["image"].save(tmp_path)
+    save_image(tmp_path)
 
     message_slack_raw(text=f"New machine proposed: {title}, {address} ({area})")
     # Add to queue
@@ -361,6 +498,91 @@ def create_machine():
     return jsonify({"message": "Success!"}), 200
 
 
+@app.route("/uploads", methods=["POST"])
+def initiate_upload():
+    """
+    Initiates a chunked, resumable upload of an image (`kind=image`, with the
+    parameters of `/upload_image`) or a new machine (`kind=machine`, with the
+    parameters of `/create_machine`). The total `size` in bytes is required.
+    """
+    ip_address = request.remote_addr
+    if ip_address in blocked_ips:
+        return jsonify({"error": "User IP address is blocked"}), 403
+
+    params = request.args.to_dict()
+    kind = params.pop("kind", "image")
+    try:
+        size = int(params.pop("size", "0"))
+        cleanup_stale_uploads()
+        upload_id = create_upload(kind, size, params, ip_address)
+    except ValueError:
+        return jsonify({"error": "Upload size must be an integer"}), 400
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    return jsonify({"upload_id": upload_id, "offset": 0}), 201
+
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id: str):
+    """Returns the number of received bytes, i.e., where to resume the upload."""
+    try:
+        meta = get_upload(upload_id)
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    return jsonify({"offset": meta["offset"], "size": meta["size"]}), 200
+
+
+@app.route("/uploads/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id: str):
+    """Receives the chunk of an upload that starts at byte `offset`."""
+    offset_str = request.args.get("offset", "0")
+    try:
+        offset = append_chunk(upload_id, int(offset_str), request.stream)
+    except ValueError:
+        return jsonify({"error": f"Invalid offset {offset_str}"}), 400
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    return jsonify({"offset": offset}), 200
+
+
+@app.route("/uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_chunked_upload(upload_id: str):
+    """Completes an upload and processes it like a regular image or new machine."""
+    ip_address = request.remote_addr
+    if ip_address in blocked_ips:
+        return jsonify({"error": "User IP address is blocked"}), 403
+    # A client retrying after a lost response gets the response again
+    result = get_upload_result(upload_id)
+    if result is not None:
+        return jsonify(result[0]), result[1]
+    try:
+        meta = get_upload(upload_id)
+        if meta["offset"] != meta["size"]:
+            raise UploadError(
+                f"Upload incomplete, received {meta['offset']}/{meta['size']} bytes",
+                409,
+            )
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
+    def save_image(path: str):
+        finalize_upload(upload_id, path)
+
+    process = process_image_upload
+    if meta["kind"] == "machine":
+        process = process_machine_creation
+    try:
+        response, code = process(meta["params"], ip_address, save_image)
+    except UploadError as e:
+        # Finalized by a concurrent request in the meantime
+        result = get_upload_result(upload_id)
+        if result is not None:
+            return jsonify(result[0]), result[1]
+        return jsonify({"error": str(e)}), e.status_code
+    set_upload_result(upload_id, (response.get_json(), code))
+    return response, code
+
+
 @app.route("/change_machine", methods=["POST"])
 def change_machine():
     """
@@ -460,7 +682,7 @@ def change_machine():
         if (not found_coords) and address != old_address:
             return jsonify({"error": "Google Maps does not know this address"}), 400
 
-        dist = haversine((lat, lng), (latitude, longitude))
+        dist = haversine_distance(lat, lng, latitude, longitude)
         address_okay = dist <= 1  # km
 
         # adapt dictionary entries
@@ -551,7 +773,8 @@ def worker():
         except Exception as e:
             trace = traceback.format_exc()
             message_slack_raw(
-                f"Exception in Queue function {function} with args {args}:\n {e}\n Full traceback: {trace}"
+                f"Exception in Queue function {function} with args {args}:\n {e}\n Full traceback: {trace}",
+                digest_key="queue-exception",
             )
         finally:
             request_queue.task_done()
@@ -559,6 +782,8 @@ def worker():
 
 # Start the worker thread
 Thread(target=worker, daemon=True).start()
+# Slack messages are delivered in the background, independent of the requests
+start_slack_sender()
 
 
 def create_app():
@@ -0,0 +1,186 @@
+"""
+Benchmark of the clustering of `pennyme.clusters` on synthetic locations. For a
+few views of the map, the clusters are compared to the machines that the maps
+render without clustering. Then machines change their status, move, are added and removed,
+both directly in the index and through a server locations file. The script
+fails if the updated clusters or cluster tiles differ from a build from scratch.
+Run from the backend folder:
+
+    python -m benchmarks.clusters --size 100000 --updates 1000
+"""
+
+import copy
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import typer
+
+from benchmarks.streaming import synthetic_features
+from benchmarks.tiles import TILE_SIZE, VIEW_SIZE, VIEWS, folders_identical
+from pennyme import io
+from pennyme.clusters import BBox, ClusterIndex, ServerClusters
+from pennyme.merge import REPLACE_IN_PLACE, merge_features
+
+app = typer.Typer()
+
+STATUSES = ["available", "retired", "out-of-order"]
+
+
+def view_bbox(lng: float, lat: float, zoom: float) -> BBox:
+    """
+    Find the bounding box of a view of the map.
+
+    Args:
+        lng: Longitude of the center in degrees.
+        lat: Latitude of the center in degrees.
+        zoom: Zoom of the map.
+
+    Returns:
+        West, south, east and north bound in degrees.
+    """
+    world = TILE_SIZE * 2**zoom
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * world
+
+    def latitude(y: float) -> float:
+        y = min(max(y, 0), world)
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / world))))
+
+    half_width = VIEW_SIZE[0] / 2 / world * 360
+    return (
+        lng - half_width,
+        latitude(y + VIEW_SIZE[1] / 2),
+        lng + half_width,
+        latitude(y - VIEW_SIZE[1] / 2),
+    )
+
+
+def change(features: List[Dict[str, Any]], updates: int) -> List[Dict[str, Any]]:
+    """
+    Change the status of machines, move, remove and add machines.
+
+    Args:
+        features: The features.
+        updates: Number of changes of each kind.
+
+    Returns:
+        The changed features.
+    """
+    rng = random.Random(3)
+    features = copy.deepcopy(features)
+    for feature in rng.sample(features, updates):
+        feature["properties"]["machine_status"] = rng.choice(STATUSES)
+    for feature in rng.sample(features, updates):
+        lng, lat = feature["geometry"]["coordinates"]
+        feature["geometry"]["coordinates"] = [lng + rng.uniform(-2, 2), lat]
+    for feature in rng.sample(features, updates):
+        features.remove(feature)
+    for feature in rng.sample(features, updates):
+        feature = copy.deepcopy(feature)
+        feature["properties"]["id"] += 10 * len(features)
+        features.append(feature)
+    return features
+
+
+def all_clusters(index: ClusterIndex) -> List[List[Dict[str, Any]]]:
+    """The clusters of all zoom levels."""
+    return [index.clusters(zoom) for zoom in range(index.max_zoom + 1)]
+
+
+@app.command()
+def main(
+    size: int = typer.Option(100000, help="Number of machines"),
+    updates: int = typer.Option(1000, help="Number of changes of each kind"),
+):
+    features = list(synthetic_features(size))
+    for i, feature in enumerate(features):
+        feature["properties"]["machine_status"] = STATUSES[i % 3]
+    start = time.perf_counter()
+    index = ClusterIndex(features)
+    print(f"{size} machines clustered in {time.perf_counter() - start:.2f} s")
+    failed = False
+    for zoom, clusters in enumerate(all_clusters(index)):
+        counted = sum(c["properties"]["point_count"] for c in clusters)
+        by_status = sum(
+            sum(c["properties"]["machine_status"].values()) for c in clusters
+        )
+        failed |= counted != size or by_status != size
+
+    for (lng, lat), zoom in VIEWS:
+        west, south, east, north = bbox = view_bbox(lng, lat, zoom)
+        points = [
+            f
+            for f in features
+            if west <= f["geometry"]["coordinates"][0] <= east
+            and south <= f["geometry"]["coordinates"][1] <= north
+        ]
+        start = time.perf_counter()
+        clusters = index.clusters(int(zoom), bbox)
+        seconds = time.perf_counter() - start
+        cluster_bytes = len(json.dumps(clusters))
+        point_bytes = len(json.dumps(points))
+        print(
+            f"  view at zoom {zoom:4.1f}: {len(points):6d} machines "
+            f"({point_bytes / 2**20:6.2f} MiB) in {len(clusters):4d} clusters "
+            f"({cluster_bytes / 2**10:6.1f} KiB), query {1000 * seconds:.1f} ms"
+        )
+
+    with tempfile.TemporaryDirectory() as folder:
+        incremental = os.path.join(folder, "incremental")
+        start = time.perf_counter()
+        written = index.write_tiles(incremental)
+        print(
+            f"Cluster tiles: {written} written in {time.perf_counter() - start:.2f} s"
+        )
+
+        changed = change(features, updates)
+        start = time.perf_counter()
+        changed_ids = {f["properties"]["id"] for f in changed}
+        for machine_id in {f["properties"]["id"] for f in features} - changed_ids:
+            index.remove(machine_id)
+        for feature in changed:
+            index.update(feature)
+        seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        written = index.write_tiles(incremental)
+        print(
+            f"Updated {len(changed)} machines ({4 * updates} changes) in "
+            f"{seconds:.2f} s, {written} tiles written in "
+            f"{time.perf_counter() - start:.2f} s"
+        )
+        scratch = ClusterIndex(changed)
+        scratch.write_tiles(os.path.join(folder, "scratch"))
+        identical = all_clusters(index) == all_clusters(scratch)
+        identical &= folders_identical(incremental, os.path.join(folder, "scratch"))
+        print(f"Updated clusters identical to clusters from scratch: {identical}")
+        failed |= not identical
+
+        # Server locations replace all locations and are refreshed when changed
+        server_path = os.path.join(folder, "server_locations.json")
+        server = change(features[:updates], updates // 10)
+        io.dump_features(server, server_path)
+        live = ServerClusters(features, server_path)
+        start = time.perf_counter()
+        refreshed = live.clusters(0)["features"]
+        print(f"Server locations refreshed in {time.perf_counter() - start:.2f} s")
+        merged = list(merge_features(features, server, REPLACE_IN_PLACE))
+        identical = refreshed == ClusterIndex(merged).clusters(0)
+        io.dump_features(server[: updates // 2], server_path)
+        os.utime(server_path, ns=(0, 0))
+        live.clusters(0)
+        merged = list(
+            merge_features(features, server[: updates // 2], REPLACE_IN_PLACE)
+        )
+        identical &= all_clusters(live.index) == all_clusters(ClusterIndex(merged))
+        print(f"Server clusters identical to clusters from scratch: {identical}")
+        failed |= not identical
+    if failed:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,144 @@
+"""
+Benchmark of the geodesic kernels in `pennyme.geo` against the per-pair loop over
+`haversine.haversine` that was used before. The machine coordinates of the server
+locations are replicated with small offsets and the script fails if any distance
+or search result differs, or a jittered position is outside its radius. Run from
+the backend folder:
+
+    python -m benchmarks.geo --scale 10
+"""
+
+import json
+import time
+from pathlib import Path
+from typing import Callable, Tuple
+
+import numpy as np
+import typer
+from haversine import haversine
+
+from pennyme import geo
+
+app = typer.Typer()
+
+DATA_PATH = Path(__file__).parent.parent.parent / "data" / "server_locations.json"
+
+
+def load_coordinates(data_path: Path, scale: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the machine coordinates, replicated `scale` times.
+
+    Args:
+        data_path: Server locations file.
+        scale: Replication factor of the dataset.
+
+    Returns:
+        Latitudes and longitudes of the machines.
+    """
+    with open(data_path, "r") as f:
+        features = json.load(f)["features"]
+    lngs, lats = np.array([f["geometry"]["coordinates"] for f in features]).T
+    rng = np.random.default_rng(0)
+    offsets = [rng.uniform(-0.5, 0.5, (2, len(lats))) for _ in range(scale - 1)]
+    lats = np.concatenate([lats] + [np.clip(lats + o[0], -90, 90) for o in offsets])
+    lngs = np.concatenate([lngs] + [lngs + o[1] for o in offsets])
+    return lats, lngs
+
+
+def timed(func: Callable, repeats: int) -> Tuple[float, object]:
+    """Run a function `repeats` times and return the mean time and last result."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = func()
+    return (time.perf_counter() - start) / repeats, result
+
+
+@app.command()
+def main(
+    scale: int = typer.Option(10, help="Replication factor of the dataset"),
+    n_queries: int = typer.Option(20, help="Number of query points"),
+    radius_km: float = typer.Option(1.0, help="Radius of the radius search"),
+    k: int = typer.Option(5, help="Number of neighbours of the k-nearest search"),
+    data_path: Path = typer.Option(DATA_PATH, help="Server locations file"),
+):
+    lats, lngs = load_coordinates(data_path, scale)
+    rng = np.random.default_rng(1)
+    queries = rng.choice(len(lats), n_queries, replace=False)
+    q_lats = lats[queries] + rng.uniform(-1e-3, 1e-3, n_queries)
+    q_lngs = lngs[queries] + rng.uniform(-1e-3, 1e-3, n_queries)
+    pairs = len(lats) * n_queries
+    print(f"{len(lats)} machines, {n_queries} queries, {pairs} pairs")
+
+    # Compile the kernels outside of the timing
+    geo.distances_one_to_many(q_lats[0], q_lngs[0], lats[:2], lngs[:2])
+    geo.distances_many_to_many(q_lats[:2], q_lngs[:2], lats[:2], lngs[:2])
+
+    def loop():
+        return np.array(
+            [
+                [haversine((q_lat, q_lng), (lat, lng)) for lat, lng in zip(lats, lngs)]
+                for q_lat, q_lng in zip(q_lats, q_lngs)
+            ]
+        )
+
+    def one_to_many():
+        return np.stack(
+            [
+                geo.distances_one_to_many(q_lat, q_lng, lats, lngs)
+                for q_lat, q_lng in zip(q_lats, q_lngs)
+            ]
+        )
+
+    def many_to_many():
+        return geo.distances_many_to_many(q_lats, q_lngs, lats, lngs)
+
+    loop_time, reference = timed(loop, 1)
+    print(f"Per-pair loop: {1e9 * loop_time / pairs:8.1f} ns/pair")
+    failed = False
+    for name, func, repeats in [
+        ("One-to-many", one_to_many, 10),
+        ("Many-to-many", many_to_many, 10),
+    ]:
+        duration, result = timed(func, repeats)
+        matches = np.allclose(result, reference, rtol=1e-12, atol=0)
+        failed |= not matches
+        print(
+            f"{name}: {1e9 * duration / pairs:10.1f} ns/pair, "
+            f"speedup {loop_time / duration:.0f}x, matches loop: {matches}"
+        )
+
+    for q_lat, q_lng, dists in zip(q_lats, q_lngs, reference):
+        idxs, _ = geo.k_nearest(q_lat, q_lng, lats, lngs, k)
+        expected = np.argsort(dists, kind="stable")[:k]
+        idxs_in_radius, _ = geo.within_radius(q_lat, q_lng, lats, lngs, radius_km)
+        in_radius = np.flatnonzero(dists <= radius_km)
+        if not np.array_equal(idxs, expected) or set(idxs_in_radius) != set(in_radius):
+            print(f"Search results differ for query ({q_lat}, {q_lng})")
+            failed = True
+    search_time, _ = timed(
+        lambda: [
+            geo.within_radius(q_lat, q_lng, lats, lngs, radius_km)
+            for q_lat, q_lng in zip(q_lats, q_lngs)
+        ],
+        10,
+    )
+    print(f"Radius search: {1e6 * search_time / n_queries:.1f} us/query")
+
+    # Positions of the machines of a multimachine group
+    jitter_lngs, jitter_lats = geo.jitter_lonlats(q_lngs[0], q_lats[0], 1000, 15.0, 2)
+    jitter_dists = geo.distances_one_to_many(
+        q_lats[0], q_lngs[0], jitter_lats, jitter_lngs
+    )
+    within = bool(np.all(jitter_dists <= 0.015 + 1e-9))
+    single = geo.jitter_lonlat(q_lngs[0], q_lats[0], 15.0, 3)
+    first = geo.jitter_lonlats(q_lngs[0], q_lats[0], 1, 15.0, 3)
+    within &= single == (first[0][0], first[1][0])
+    failed |= not within
+    print(f"Jittered positions within radius: {within}")
+    if failed:
+        raise typer.Exit(code=1)
+    print("All results identical")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,139 @@
+"""
+Benchmark of the serializer in `pennyme.io` against `json.dump(data, f, indent=4,
+ensure_ascii=False)` that was used before. The server locations are replicated
+with new ids and the script fails unless every output is identical byte for byte,
+reads back to the same data and has the same canonical hash with both backends.
+The same holds for edge cases such as NaN, Infinity and integers above 64 bit.
+Run from the backend folder:
+
+    python -m benchmarks.io --scale 40
+"""
+
+import copy
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+import typer
+
+from pennyme import io
+
+app = typer.Typer()
+
+DATA_DIR = Path(__file__).parent.parent.parent / "data"
+# Values that orjson writes differently than the json module
+EDGE_CASES = [
+    {"a": float("nan")},
+    [float("inf"), -float("inf"), None],
+    {"coordinates": [1e-05, 1e16, 0.1], "id": 2**70},
+    {"features": [{"name": "Caf\u00e9 \u2603", "paywall": None}]},
+]
+
+
+def replicate(data: Dict[str, Any], scale: int) -> Dict[str, Any]:
+    """
+    Replicate the features of a feature collection with new ids.
+
+    Args:
+        data: The feature collection.
+        scale: Replication factor.
+
+    Returns:
+        The enlarged feature collection.
+    """
+    features = []
+    for i in range(scale):
+        for feature in data["features"]:
+            feature = copy.deepcopy(feature)
+            feature["properties"]["id"] += i * 100000
+            features.append(feature)
+    return dict(data, features=features)
+
+
+def timed(func: Callable, repeats: int) -> Tuple[float, Any]:
+    """Run a function `repeats` times and return the mean time and last result."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = func()
+    return (time.perf_counter() - start) / repeats, result
+
+
+def reference_hash(data: Any) -> str:
+    """The canonical hash, computed with the json module."""
+    content = json.dumps(
+        data, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+@app.command()
+def main(
+    scale: int = typer.Option(40, help="Replication factor of the server locations"),
+    repeats: int = typer.Option(3, help="Number of timed repetitions"),
+):
+    backends = ["json"] + (["orjson"] if io.orjson is not None else [])
+    orjson = io.orjson
+    failed = False
+
+    # The data files must be reproduced exactly
+    for path in sorted(DATA_DIR.glob("*.json")):
+        raw = path.read_bytes()
+        data = json.loads(raw)
+        for backend in backends:
+            io.orjson = orjson if backend == "orjson" else None
+            if io.dumps(data) != raw or io.loads(raw) != data:
+                print(f"{path.name} is not reproduced with {backend}")
+                failed = True
+
+    # Edge cases must be written like the json module and read back unchanged
+    for value in EDGE_CASES:
+        reference = json.dumps(value, indent=4, ensure_ascii=False).encode("utf-8")
+        for backend in backends:
+            io.orjson = orjson if backend == "orjson" else None
+            content = io.dumps(value)
+            if (
+                content != reference
+                or io.dumps(io.loads(content)) != content
+                or io.canonical_hash(value) != reference_hash(value)
+            ):
+                print(f"{value} is not reproduced with {backend}")
+                failed = True
+
+    with open(DATA_DIR / "server_locations.json", "r") as f:
+        data = replicate(json.load(f), scale)
+    print(f"{len(data['features'])} features")
+    old_time, reference = timed(
+        lambda: json.dumps(data, indent=4, ensure_ascii=False).encode("utf-8"),
+        repeats,
+    )
+    old_hash_time, expected_hash = timed(lambda: reference_hash(data), repeats)
+    print(f"json.dumps:       {old_time:6.3f} s ({len(reference) / 2**20:.1f} MiB)")
+    print(f"Reference hash:   {old_hash_time:6.3f} s")
+
+    for backend in backends:
+        io.orjson = orjson if backend == "orjson" else None
+        new_time, content = timed(lambda: io.dumps(data), repeats)
+        stream_time, streamed = timed(
+            lambda: io.dumps(dict(data, features=iter(data["features"]))), repeats
+        )
+        load_time, loaded = timed(lambda: io.loads(content), repeats)
+        hash_time, content_hash = timed(lambda: io.canonical_hash(data), repeats)
+        identical = content == reference and streamed == reference
+        round_trip = loaded == data and content_hash == expected_hash
+        failed |= not identical or not round_trip
+        print(
+            f"{backend}: dumps {new_time:6.3f} s ({old_time / new_time:.1f}x), "
+            f"streamed {stream_time:6.3f} s, loads {load_time:6.3f} s, "
+            f"hash {hash_time:6.3f} s ({old_hash_time / hash_time:.1f}x), "
+            f"identical: {identical}, round trip: {round_trip}"
+        )
+    io.orjson = orjson
+    if failed:
+        raise typer.Exit(code=1)
+    print("All outputs identical")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,236 @@
+"""
+Regression check and benchmark of the MachineMatcher against the previous pandas
+implementation of the duplicate detection in `location_differ`.
+
+Queries are derived from the machines without website link in the server
+locations (exact, perturbed and unrelated names, addresses and coordinates) and
+can be recorded to and replayed from a JSON file. The script fails if any
+decision differs. Run from the backend folder:
+
+    python -m benchmarks.matching --scale 10
+"""
+
+import json
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import typer
+from haversine import haversine
+from loguru import logger
+from thefuzz import process as fuzzysearch
+
+from pennyme.matching import MachineMatcher
+
+app = typer.Typer()
+
+DATA_PATH = Path(__file__).parent.parent.parent / "data" / "server_locations.json"
+
+
+def build_external(features: List[Dict[str, Any]], scale: int) -> pd.DataFrame:
+    """
+    Build the `external` frame like `location_differ`, replicated `scale` times.
+
+    Args:
+        features: Features of the server locations.
+        scale: Replication factor of the dataset.
+
+    Returns:
+        The frame with the machines without pennycollector link.
+    """
+    rng = random.Random(0)
+    entries = []
+    for copy in range(scale):
+        for i, geojson in enumerate(features):
+            if "locations.pennycollector.com" in geojson["properties"]["external_url"]:
+                continue
+            entry = {
+                k: v for k, v in geojson["properties"].items() if k not in ["logs"]
+            }
+            lng, lat = geojson["geometry"]["coordinates"]
+            if copy > 0:
+                entry["name"] = f"{entry['name']} {copy}"
+                entry["id"] = entry["id"] + copy * 100000
+                lat, lng = lat + rng.uniform(-0.5, 0.5), lng + rng.uniform(-0.5, 0.5)
+            # Device entries have no coordinates in the differ
+            entry["source"] = "Device" if i % 3 == 0 else "Server"
+            entry["data_idx"] = i
+            if entry["source"] == "Server":
+                entry["latitude"], entry["longitude"] = lat, lng
+            entries.append(entry)
+    external = pd.DataFrame(entries)
+    return external.sort_values(
+        by=["id", "source"], ascending=[True, False]
+    ).drop_duplicates(subset=["id"], keep="first")
+
+
+def make_queries(external: pd.DataFrame, n: int) -> List[Dict[str, Any]]:
+    """
+    Generate listings to match, close to and far from the known machines.
+
+    Args:
+        external: The frame with the machines without link.
+        n: Number of queries.
+
+    Returns:
+        List of queries with area, title, address and coordinates.
+    """
+    rng = random.Random(1)
+    rows = external.to_dict(orient="records")
+    queries = []
+    for _ in range(n):
+        row = rng.choice(rows)
+        other = rng.choice(rows)
+        title, address = row["name"], row["address"]
+        kind = rng.randrange(5)
+        if kind == 1:
+            # Typo in the name
+            pos = rng.randrange(len(title))
+            title = title[:pos] + title[pos + 1 :]
+        elif kind == 2:
+            title = other["name"] + " Museum"
+        elif kind == 3:
+            title, address = "Gift shop " + str(rng.randrange(1000)), other["address"]
+        elif kind == 4:
+            title, address = "Unknown place", "Nowhere street " + str(rng.random())
+        lat = row.get("latitude")
+        lng = row.get("longitude")
+        if lat is None or lat != lat:
+            lat, lng = rng.uniform(-60, 60), rng.uniform(-180, 180)
+        elif rng.random() < 0.5:
+            lat, lng = lat + rng.uniform(-3e-4, 3e-4), lng + rng.uniform(-3e-4, 3e-4)
+        queries.append(
+            {
+                "area": row["area"],
+                "title": title,
+                "address": address,
+                "lat": lat,
+                "lng": lng,
+            }
+        )
+    return queries
+
+
+def legacy_decision(
+    external: pd.DataFrame, q: Dict[str, Any]
+) -> Optional[Tuple[str, str, int]]:
+    """The matching logic as it was implemented in `location_differ`."""
+    this_title, this_address = q["title"], q["address"]
+    tdf = external[external.area == q["area"]]
+    if len(tdf) == 0:
+        return None
+    query = this_title
+    result = fuzzysearch.extract(query, list(tdf["name"]), limit=2)
+    if len(result) == 1 or result[1][1] <= 92:
+        match, score = result[0]
+    else:
+        query = this_title + this_address
+        result = fuzzysearch.extract(
+            query,
+            [n + a for n, a in zip(tdf["name"], tdf["address"])],
+            limit=2,
+        )
+        match, score = result[0]
+    if query == this_title + this_address:
+        tdf = tdf.assign(
+            name_address=[n + a for n, a in zip(tdf["name"], tdf["address"])]
+        )
+        m_idx = list(tdf.name_address).index(match)
+    elif score > 92:
+        m_idx = list(tdf["name"]).index(match)
+    if query == this_title + this_address or score > 92:
+        return "name", tdf.iloc[m_idx]["source"], int(tdf.iloc[m_idx]["data_idx"])
+
+    match, score = fuzzysearch.extract(this_address, list(tdf["address"]), limit=1)[0]
+    if score >= 92:
+        m_idx = list(tdf["address"]).index(match)
+        return "address", tdf.iloc[m_idx]["source"], int(tdf.iloc[m_idx]["data_idx"])
+
+    dists = [
+        haversine(
+            (q["lat"], q["lng"]),
+            (float(e["latitude"]), float(e["longitude"])),
+            unit="m",
+        )
+        for _, e in tdf.iterrows()
+    ]
+    if min(dists) < 100:
+        m_idx = dists.index(min(dists))
+        return "distance", tdf.iloc[m_idx]["source"], int(tdf.iloc[m_idx]["data_idx"])
+    return None
+
+
+def matcher_decision(
+    matcher: MachineMatcher, q: Dict[str, Any]
+) -> Optional[Tuple[str, str, int]]:
+    """The same decision with the MachineMatcher."""
+    block = matcher.block(q["area"])
+    if block is None:
+        return None
+    for kind, found in [
+        ("name", lambda: matcher.match_name(block, q["title"], q["address"])),
+        ("address", lambda: matcher.match_address(block, q["address"])),
+        ("distance", lambda: matcher.match_distance(block, q["lat"], q["lng"])),
+    ]:
+        match = found()
+        if match is not None:
+            return kind, block.sources[match.row], int(block.data_idxs[match.row])
+    return None
+
+
+@app.command()
+def main(
+    scale: int = typer.Option(10, help="Replication factor of the dataset"),
+    n_queries: int = typer.Option(1000, help="Number of generated queries"),
+    record: Optional[Path] = typer.Option(None, help="Save the queries to this file"),
+    replay: Optional[Path] = typer.Option(None, help="Load the queries from a file"),
+    data_path: Path = typer.Option(DATA_PATH, help="Server locations file"),
+):
+    with open(data_path, "r") as f:
+        features = json.load(f)["features"]
+    external = build_external(features, scale)
+
+    if replay is not None:
+        with open(replay, "r") as f:
+            queries = json.load(f)
+    else:
+        queries = make_queries(external, n_queries)
+    if record is not None:
+        with open(record, "w") as f:
+            json.dump(queries, f, indent=4)
+
+    # Logs of edge cases are not part of the comparison
+    logger.remove()
+
+    start = time.perf_counter()
+    legacy = [legacy_decision(external, q) for q in queries]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = MachineMatcher(external)
+    build_time = time.perf_counter() - start
+    new = [matcher_decision(matcher, q) for q in queries]
+    matcher_time = time.perf_counter() - start
+
+    mismatches = [
+        (q, old, cur) for q, old, cur in zip(queries, legacy, new) if old != cur
+    ]
+    kinds = pd.Series([d[0] if d else "new" for d in new]).value_counts().to_dict()
+    print(f"{len(external)} machines without link, {len(queries)} queries: {kinds}")
+    print(f"Legacy:  {1000 * legacy_time / len(queries):.2f} ms/query")
+    print(
+        f"Matcher: {1000 * matcher_time / len(queries):.2f} ms/query "
+        f"(incl. {build_time:.2f}s to build), "
+        f"speedup {legacy_time / matcher_time:.1f}x"
+    )
+    if mismatches:
+        for q, old, cur in mismatches[:10]:
+            print(f"Mismatch for {q}: legacy {old}, matcher {cur}")
+        raise typer.Exit(code=1)
+    print("All decisions identical")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,139 @@
+"""
+Benchmark of the merge engine in `pennyme.merge` against the merges it replaced:
+the list-based merge of `merge_jsons` (quadratic in the number of features) and
+the dictionary merge of `webmap/geojson_combiner.py`. All locations and server
+locations are synthesized in memory and the script fails if any result differs.
+Run from the backend folder:
+
+    python -m benchmarks.merge --size 100000 --updates 5000
+"""
+
+import copy
+import random
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+import typer
+
+from pennyme.merge import (
+    APPEND_UPDATES,
+    REPLACE_IN_PLACE,
+    latest_update,
+    merge_features,
+    within_grace_period,
+)
+
+app = typer.Typer()
+
+Features = List[Dict[str, Any]]
+
+
+def synthesize(
+    size: int, updates: int, overlap: float, duplicates: int
+) -> Tuple[Features, Features]:
+    """
+    Synthesize all locations and server locations.
+
+    Args:
+        size: Number of features of all locations.
+        updates: Number of features of the server locations.
+        overlap: Fraction of the server locations that update a known machine.
+        duplicates: Number of features of all locations that repeat an id.
+
+    Returns:
+        All locations and server locations.
+    """
+    rng = random.Random(0)
+
+    def feature(machine_id: int) -> Dict[str, Any]:
+        date = f"20{rng.randint(15, 23)}-{rng.randint(1, 12):02d}-01"
+        return {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [rng.random(), rng.random()]},
+            "properties": {"id": machine_id, "last_updated": date},
+        }
+
+    base = [feature(i) for i in range(size)]
+    for machine_id in rng.sample(range(size), duplicates):
+        base.insert(rng.randrange(len(base) + 1), feature(machine_id))
+    known = rng.sample(range(size), int(updates * overlap))
+    new = range(size, size + updates - len(known))
+    return base, [feature(i) for i in known + list(new)]
+
+
+def reference_merge_jsons(alll: Features, ser: Features) -> Tuple[Features, Features]:
+    """The merge of `merge_jsons` before the merge engine."""
+    youngest_all = sorted(
+        [datetime.strptime(e["properties"]["last_updated"], "%Y-%m-%d") for e in alll]
+    )[-1]
+    new_all = copy.deepcopy(ser)
+    new_all_ids = [e["properties"]["id"] for e in ser]
+    for allentry in alll[::-1]:
+        if allentry["properties"]["id"] not in new_all_ids:
+            new_all.insert(0, allentry)
+    new_server = [
+        e
+        for e in copy.deepcopy(ser)
+        if datetime.strptime(e["properties"]["last_updated"], "%Y-%m-%d")
+        >= youngest_all
+    ]
+    return new_all, new_server
+
+
+def engine_merge_jsons(alll: Features, ser: Features) -> Tuple[Features, Features]:
+    """The merge of `merge_jsons` with the merge engine."""
+    new_all = list(merge_features(alll, ser, APPEND_UPDATES))
+    return new_all, list(within_grace_period(ser, latest_update(alll)))
+
+
+def reference_combiner(geojson1: Features, geojson2: Features) -> Features:
+    """The merge of `geojson_combiner` before the merge engine."""
+    combined = {feature["properties"]["id"]: feature for feature in geojson1}
+    combined.update({feature["properties"]["id"]: feature for feature in geojson2})
+    return list(combined.values())
+
+
+def engine_combiner(geojson1: Features, geojson2: Features) -> Features:
+    """The merge of `geojson_combiner` with the merge engine."""
+    return list(merge_features(geojson1, geojson2, REPLACE_IN_PLACE))
+
+
+def timed(func: Callable, *args) -> Tuple[float, Any]:
+    """Run a function once and return the time and the result."""
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+@app.command()
+def main(
+    size: int = typer.Option(100000, help="Number of features of all locations"),
+    updates: int = typer.Option(5000, help="Number of features of server locations"),
+    overlap: float = typer.Option(
+        0.5, help="Fraction of server locations that update a known machine"
+    ),
+    duplicates: int = typer.Option(100, help="Repeated ids in all locations"),
+):
+    base, ser = synthesize(size, updates, overlap, duplicates)
+    print(f"{len(base)} features, {len(ser)} updates")
+    failed = False
+    for name, reference, engine in [
+        ("merge_jsons", reference_merge_jsons, engine_merge_jsons),
+        ("geojson_combiner", reference_combiner, engine_combiner),
+    ]:
+        old_time, expected = timed(reference, base, ser)
+        new_time, result = timed(engine, base, ser)
+        identical = result == expected
+        failed |= not identical
+        print(
+            f"{name}: before {old_time:7.3f} s, engine {new_time:7.3f} s, "
+            f"speedup {old_time / new_time:.0f}x, identical: {identical}"
+        )
+    if failed:
+        raise typer.Exit(code=1)
+    print("All results identical")
+
+
+if __name__ == "__main__":
+    app()
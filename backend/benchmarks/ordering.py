@@ -0,0 +1,121 @@
+"""
+Locality of the layouts of the data files: features sorted by latitude, as
+`sort_locations_by_latitude.py` did, against features sorted along the Hilbert
+curve of `pennyme.geo`. The synthetic features are split into ranges of equal
+size, like chunked downloads. For each layout the script reports:
+
+- the distance between features that follow each other in the file,
+- the extent of the ranges,
+- how many ranges a regional edit touches.
+
+The script fails if the Hilbert keys are not a continuous curve or the sort
+loses features. Run from the backend folder:
+
+    python -m benchmarks.ordering --size 100000 --chunk-size 1000
+"""
+
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import typer
+
+from benchmarks.streaming import synthetic_features
+from pennyme import geo, io
+
+app = typer.Typer()
+
+ORDERINGS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "latitude": lambda x: x["geometry"]["coordinates"][1],
+    "hilbert": geo.feature_key,
+}
+
+
+def curve_is_continuous(order: int) -> bool:
+    """
+    Check that the keys of all cells of a small grid are a permutation and that
+    cells with consecutive keys are neighbours.
+
+    Args:
+        order: Bits per axis of the grid.
+
+    Returns:
+        Whether the keys form a continuous curve.
+    """
+    n = 1 << order
+    centers = (np.arange(n) + 0.5) / n
+    xs, ys = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+    lngs = centers[xs.ravel()] * 360 - 180
+    lats = centers[ys.ravel()] * 180 - 90
+    keys = geo.hilbert_keys(lngs, lats, order)
+    if sorted(keys) != list(range(n * n)):
+        return False
+    by_key = np.argsort(keys)
+    steps = np.abs(np.diff(xs.ravel()[by_key])) + np.abs(np.diff(ys.ravel()[by_key]))
+    return bool(np.all(steps == 1))
+
+
+def locality(features: List[Dict[str, Any]], chunk_size: int, regions: int) -> str:
+    """
+    Measure the locality of a layout.
+
+    Args:
+        features: The features in the order of the file.
+        chunk_size: Number of features per range.
+        regions: Number of regional edits.
+
+    Returns:
+        A summary of the measures.
+    """
+    lngs, lats = np.array([f["geometry"]["coordinates"] for f in features]).T
+    steps = geo.haversine_distance(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+    extents = [
+        geo.haversine_distance(lat.min(), lng.min(), lat.max(), lng.max())
+        for lat, lng in (
+            (lats[i : i + chunk_size], lngs[i : i + chunk_size])
+            for i in range(0, len(features), chunk_size)
+        )
+    ]
+    # Regional edits: all machines within one degree of a random machine
+    rng = np.random.default_rng(0)
+    chunk_of = np.arange(len(features)) // chunk_size
+    touched = []
+    for center in rng.choice(len(features), regions, replace=False):
+        inside = (np.abs(lats - lats[center]) <= 1) & (np.abs(lngs - lngs[center]) <= 1)
+        touched.append(len(np.unique(chunk_of[inside])))
+    return (
+        f"median step {np.median(steps):8.1f} km, "
+        f"median range diagonal {np.median(extents):8.0f} km, "
+        f"ranges per regional edit {np.mean(touched):6.1f}"
+    )
+
+
+@app.command()
+def main(
+    size: int = typer.Option(100000, help="Number of features"),
+    chunk_size: int = typer.Option(1000, help="Number of features per range"),
+    regions: int = typer.Option(100, help="Number of regional edits"),
+):
+    failed = not curve_is_continuous(order=5)
+    print(f"Hilbert curve is continuous: {not failed}")
+    features = list(synthetic_features(size))
+    ranges = -(-size // chunk_size)
+    print(f"{size} features in {ranges} ranges of {chunk_size}")
+    for name, key in ORDERINGS.items():
+        start = time.perf_counter()
+        ordered = list(io.sort_features(features, key=key))
+        seconds = time.perf_counter() - start
+        keys = [key(f) for f in ordered]
+        failed |= keys != sorted(keys) or sorted(
+            f["properties"]["id"] for f in ordered
+        ) != list(range(size))
+        print(
+            f"  {name:9s} sorted in {seconds:5.2f} s, "
+            + locality(ordered, chunk_size, regions)
+        )
+    if failed:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
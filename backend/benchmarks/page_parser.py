@@ -0,0 +1,106 @@
+"""
+Golden check and throughput benchmark of the streaming parser for pennycollector
+pages (`pennyme.page_parser`) against the BeautifulSoup based helpers.
+
+The saved pages in `fixtures/pennycollector` are parsed by both implementations
+and the results are compared to the golden results in `golden.json`. The script
+fails if any result differs. Run from the backend folder:
+
+    python -m benchmarks.page_parser --repeats 20
+"""
+
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import typer
+from bs4 import BeautifulSoup
+
+from pennyme.page_parser import iter_prelim_geojsons, parse_area_list
+from pennyme.pennycollector import (
+    get_area_list_from_area_website,
+    get_location_list_from_location_website,
+    get_prelim_geojson,
+)
+
+app = typer.Typer()
+
+FIXTURES = Path(__file__).parent / "fixtures" / "pennycollector"
+GOLDEN_PATH = FIXTURES / "golden.json"
+AREA = "Fixture"
+
+
+def soup(content: bytes) -> BeautifulSoup:
+    """Parse a page like `webconfig.get_website`."""
+    return BeautifulSoup(
+        content.decode("utf8").encode("ascii", "ignore"), "html.parser"
+    )
+
+
+def bs4_result(name: str, content: bytes) -> Any:
+    """Parse a page with the BeautifulSoup based helpers."""
+    if name == "area_list.html":
+        return get_area_list_from_area_website(soup(content))
+    return [
+        get_prelim_geojson(raw_location, AREA)
+        for raw_location in get_location_list_from_location_website(soup(content))
+    ]
+
+
+def fast_result(name: str, content: bytes) -> Any:
+    """Parse a page with the streaming parser."""
+    if name == "area_list.html":
+        return parse_area_list(content)
+    return list(iter_prelim_geojsons(content, AREA))
+
+
+def pages_per_second(parse: Callable, pages: dict, repeats: int) -> float:
+    """Throughput of a parser over all pages."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for name, content in pages.items():
+            parse(name, content)
+    return repeats * len(pages) / (time.perf_counter() - start)
+
+
+@app.command()
+def main(
+    repeats: int = typer.Option(10, help="Number of passes over the pages"),
+    update_golden: bool = typer.Option(
+        False, help="Regenerate the golden results with BeautifulSoup"
+    ),
+):
+    pages = {path.name: path.read_bytes() for path in sorted(FIXTURES.glob("*.html"))}
+    if update_golden:
+        golden = {name: bs4_result(name, content) for name, content in pages.items()}
+        with open(GOLDEN_PATH, "w") as f:
+            json.dump(golden, f, indent=1, ensure_ascii=False)
+            f.write("\n")
+    with open(GOLDEN_PATH, "r") as f:
+        golden = json.load(f)
+
+    failed = False
+    for name, content in pages.items():
+        for parser, parse in [
+            ("BeautifulSoup", bs4_result),
+            ("Streaming", fast_result),
+        ]:
+            if parse(name, content) != golden[name]:
+                print(f"{parser} result for {name} differs from the golden result")
+                failed = True
+    if failed:
+        raise typer.Exit(code=1)
+    print(f"All results of {len(pages)} pages identical to the golden results")
+
+    location_pages = {k: v for k, v in pages.items() if k != "area_list.html"}
+    size = sum(len(content) for content in location_pages.values()) / 1024
+    print(f"{len(location_pages)} location pages ({size:.0f} KiB)")
+    old = pages_per_second(bs4_result, location_pages, repeats)
+    new = pages_per_second(fast_result, location_pages, repeats)
+    print(f"BeautifulSoup: {old:8.1f} pages/s")
+    print(f"Streaming:     {new:8.1f} pages/s, speedup {new / old:.1f}x")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,367 @@
+"""
+End-to-end benchmark of the nightly update pipeline (`location_differ` followed
+by `open_differ_pr`), fully offline against the stand-ins in `stub_services`.
+
+The dataset is synthesized from the server locations: every listing with a
+pennycollector link is replicated `scale` times, a fraction of the available
+listings is retired on the website and new listings are added (some of which
+cannot be geocoded). The results contain the wall time per stage, the request
+counts per service and the peak memory, and are compared to a baseline if one
+is given. Run from the backend folder (with `github_token.json` and
+`data/all_locations.json` in place, as on the server):
+
+    python -m benchmarks.pipeline --scale 20 --output pipeline.json
+"""
+
+import copy
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import typer
+
+from benchmarks import stub_services
+from pennyme.locations import COUNTRY_TO_CODE
+
+app = typer.Typer()
+
+DATA_PATH = Path(__file__).parent.parent.parent / "data"
+# Offset between the location ids of the replicas of a listing
+REPLICA_OFFSET = 10**7
+WEBSITE_STATES = {"available": "1p", "retired": "Gone", "out-of-order": "Out of Order"}
+PAGE_HEADER = """<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>Penny Collector - {area}</title></head>
+<body>
+<table border="1" cellpadding="2" cellspacing="0" class="tbllist">
+    <tr class="tbllist_header">
+      <td><b>Location</b></td>
+      <td><b>City</b></td>
+      <td align="center"><b>Status</b></td>
+      <td align="center"><b>Map</b></td>
+      <td align="center"><b>Updated</b></td>
+    </tr>
+"""
+PAGE_ROW = """    <tr>
+      <td>{name}<br /><span class="style4">{street}</span></td>
+      <td>{city}</td>
+      <td align="center">{state}</td>
+      <td align="center"><a href="Details.aspx?location={location}"><img src="Images/map.gif" border="0" alt="Map" /></a></td>
+      <td align="center">01/01/20</td>
+    </tr>
+"""
+PAGE_FOOTER = "</table>\n</body>\n</html>\n"
+
+
+def build_dataset(
+    data_path: Path, scale: int, new_fraction: float, retired_fraction: float
+) -> Tuple[Dict[str, Any], Dict[str, bytes], Dict[str, bytes]]:
+    """
+    Synthesize the data of the app and the pages of the website.
+
+    Args:
+        data_path: Data folder with server locations, problems and skip list.
+        scale: Replication factor of the dataset.
+        new_fraction: Fraction of new listings on the website.
+        retired_fraction: Fraction of available listings retired on the website.
+
+    Returns:
+        The locations of the app, the pages of the website keyed by path and
+            query and the files of the data repository keyed by path.
+    """
+    rng = random.Random(0)
+    with open(data_path / "server_locations.json", "r") as f:
+        features = json.load(f)["features"]
+
+    locations = {"type": "FeatureCollection", "features": []}
+    rows = defaultdict(list)
+    for replica in range(scale):
+        for geojson in features:
+            geojson = copy.deepcopy(geojson)
+            properties = geojson["properties"]
+            properties["id"] = len(locations["features"])
+            properties.pop("logs", None)
+            if replica > 0:
+                properties["name"] = f"{properties['name']} {replica}"
+                lng, lat = geojson["geometry"]["coordinates"]
+                geojson["geometry"]["coordinates"] = [
+                    lng + rng.uniform(-0.5, 0.5),
+                    lat + rng.uniform(-0.5, 0.5),
+                ]
+            locations["features"].append(geojson)
+            url = properties["external_url"]
+            if "locations.pennycollector.com" not in url:
+                continue
+            location = int(url.split("=")[-1]) + replica * REPLICA_OFFSET
+            properties["external_url"] = url.split("=")[0] + f"={location}"
+            state = properties["machine_status"]
+            if state == "available" and rng.random() < retired_fraction:
+                state = "retired"
+            rows[properties["area"]].append(
+                {**properties, "location": location, "state": state}
+            )
+
+    areas = sorted(area for area in rows if area in COUNTRY_TO_CODE)
+    n_listings = sum(len(rows[area]) for area in areas)
+    for i in range(int(new_fraction * n_listings)):
+        area = rng.choice(areas)
+        # Every tenth new machine cannot be geocoded and becomes a problem
+        city = stub_services.UNKNOWN_ADDRESS if i % 10 == 9 else f"City {i}"
+        rows[area].append(
+            {
+                "name": f"New machine {i}",
+                "address": f"{i} Main Street, {city}",
+                "location": (scale + 1) * REPLICA_OFFSET + i,
+                "state": "available",
+            }
+        )
+
+    pages = {}
+    for area in areas:
+        page = [PAGE_HEADER.format(area=area)]
+        for row in rows[area]:
+            street, _, city = row["address"].rpartition(", ")
+            page.append(
+                PAGE_ROW.format(
+                    name=row["name"].replace("&", "&amp;"),
+                    street=street.replace("&", "&amp;"),
+                    city=city.replace("&", "&amp;"),
+                    state=WEBSITE_STATES[row["state"]],
+                    location=row["location"],
+                )
+            )
+        page.append(PAGE_FOOTER)
+        pages[f"/Locations.aspx?area={COUNTRY_TO_CODE[area]}"] = "".join(page).encode()
+    options = "".join(
+        f'<option selected value="{COUNTRY_TO_CODE[area]}">{area}</option>\n'
+        for area in areas
+    )
+    pages["/AreaList.aspx"] = (
+        '<html><body><table id="StatesList"></table>\n<select id="ddlCountries">\n'
+        f'<option selected value="0">Countries</option>\n{options}</select>\n'
+        '<select id="ddlPrivate">\n<option selected value="0">Select One</option>\n'
+        "</select>\n</body></html>\n"
+    ).encode()
+
+    files = {
+        "data/server_locations.json": json.dumps(
+            locations, indent=4, ensure_ascii=False
+        ).encode("utf8")
+    }
+    for name in ["problems.json", "skip.json"]:
+        files[f"data/{name}"] = (data_path / name).read_bytes()
+    return locations, pages, files
+
+
+@contextmanager
+def measure(results: Dict[str, Any], stage: str, trace_memory: bool) -> Iterator:
+    """Record the wall time (and the peak traced memory) of a stage."""
+    if trace_memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    yield
+    results["stages"][stage] = time.perf_counter() - start
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        results["memory"][f"{stage}_traced_peak_mb"] = peak
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """
+    Compare the results to a baseline of the same configuration.
+
+    Args:
+        results: Results of this run.
+        baseline: Results of an earlier run.
+        tolerance: Allowed relative increase of stage times and peak memory.
+
+    Returns:
+        Descriptions of the regressions.
+    """
+    if results["config"] != baseline["config"]:
+        return [f"Configuration differs from the baseline: {baseline['config']}"]
+    regressions = []
+    for kind in ["stages", "memory"]:
+        for key, value in results[kind].items():
+            old = baseline[kind].get(key)
+            if old is not None and value > old * (1 + tolerance):
+                regressions.append(f"{kind} {key}: {old:.2f} -> {value:.2f}")
+    for service, count in results["requests"]["services"].items():
+        old = baseline["requests"]["services"].get(service, 0)
+        if count > old:
+            regressions.append(f"requests {service}: {old} -> {count}")
+    return regressions
+
+
+@app.command()
+def main(
+    scale: int = typer.Option(20, help="Replication factor of the dataset"),
+    new_fraction: float = typer.Option(0.01, help="Fraction of new listings"),
+    retired_fraction: float = typer.Option(
+        0.01, help="Fraction of available listings retired on the website"
+    ),
+    warm: bool = typer.Option(
+        False, help="Run the pipeline a second time with the state of the first run"
+    ),
+    polite: bool = typer.Option(
+        False, help="Keep the per-host request delays of the HTTP client"
+    ),
+    trace_memory: bool = typer.Option(
+        False, help="Trace the peak memory per stage (slows down the pipeline)"
+    ),
+    verbose: bool = typer.Option(False, help="Show the logs of the pipeline"),
+    output: Optional[Path] = typer.Option(None, help="JSON file for the results"),
+    baseline: Optional[Path] = typer.Option(None, help="Results to compare to"),
+    tolerance: float = typer.Option(0.25, help="Allowed relative slowdown"),
+    data_path: Path = typer.Option(DATA_PATH, help="Data folder"),
+):
+    results = {
+        "config": {
+            "scale": scale,
+            "new_fraction": new_fraction,
+            "retired_fraction": retired_fraction,
+            "warm": warm,
+            "polite": polite,
+        },
+        "stages": {},
+        "requests": {},
+        "memory": {},
+    }
+    start = time.perf_counter()
+    locations, pages, files = build_dataset(
+        data_path, scale, new_fraction, retired_fraction
+    )
+    results["stages"]["build_dataset"] = time.perf_counter() - start
+    results["dataset"] = {
+        "machines": len(locations["features"]),
+        "areas": len(pages) - 1,
+        "page_bytes": sum(len(page) for page in pages.values()),
+    }
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    server = multiprocessing.Process(
+        target=stub_services.serve, args=(pages, files, sender), daemon=True
+    )
+    server.start()
+    base_url = f"http://127.0.0.1:{receiver.recv()}"
+
+    # The pipeline reads `github_token.json` from the working directory on import
+    backend = os.getcwd()
+    sys.path.insert(0, backend)
+    workdir = tempfile.TemporaryDirectory(prefix="pipeline_benchmark_")
+    os.chdir(workdir.name)
+    with open("github_token.json", "w") as f:
+        json.dump({"owner": "o", "repo": "r", "token": "t", "token_jab": "tj"}, f)
+    os.environ.setdefault("SLACK_TOKEN", "xoxb-benchmark")
+
+    from googlemaps import Client as GoogleMaps
+    from loguru import logger
+
+    from pennyme import http_client, slack
+    from pennyme.outbox import Outbox
+    from scripts.location_differ import location_differ
+    from scripts.open_diff_pull_request import open_differ_pr
+
+    hosts = {
+        urlsplit(geojson["properties"]["external_url"]).netloc
+        for geojson in locations["features"]
+    } - {""}
+    http_client.CLIENT.host_overrides = {host: f"{base_url}/other" for host in hosts}
+    http_client.CLIENT.host_overrides.update(
+        {
+            "locations.pennycollector.com": f"{base_url}/pennycollector",
+            "api.github.com": f"{base_url}/github",
+            "raw.githubusercontent.com": f"{base_url}/raw",
+        }
+    )
+    if not polite:
+        http_client.CLIENT.policies = {}
+    slack.CLIENT.base_url = f"{base_url}/slack/"
+    slack.OUTBOX = Outbox(
+        os.path.join(workdir.name, "slack_outbox"),
+        send=slack.post_to_slack,
+        combine=slack.combine_messages,
+    )
+    # Unlimited rate, the quota of the real API is not what is measured
+    geocoder = GoogleMaps(
+        key="AIza" + "0" * 35,
+        base_url=f"{base_url}/maps",
+        queries_per_second=10**6,
+        queries_per_minute=10**8,
+    )
+
+    output_folder = os.path.join(workdir.name, "new_data")
+    device_json = os.path.join(workdir.name, "all_locations.json")
+    with open(device_json, "w") as f:
+        device = copy.deepcopy(locations)
+        for geojson in device["features"]:
+            geojson["properties"]["logs"] = []
+        json.dump(device, f)
+    joblog = os.path.join(output_folder, "cron.log")
+    # Like the cron job, the logs go to the job log
+    logger.remove()
+    logger.add(joblog, level="INFO")
+    if verbose:
+        logger.add(sys.stderr, level="INFO")
+
+    if trace_memory:
+        tracemalloc.start()
+    for prefix in ["", "warm."] if warm else [""]:
+        with measure(results, prefix + "location_differ", trace_memory):
+            timings = location_differ(
+                output_folder,
+                device_json,
+                os.path.join(output_folder, "old_server_locations.json"),
+                api_key="",
+                load_from_github=True,
+                geocoder=geocoder,
+            )
+        for stage, seconds in timings.items():
+            results["stages"][f"{prefix}location_differ.{stage}"] = seconds
+        with measure(results, prefix + "open_differ_pr", trace_memory):
+            open_differ_pr(
+                os.path.join(output_folder, "server_locations.json"),
+                os.path.join(output_folder, "problems.json"),
+            )
+        with measure(results, prefix + "slack", trace_memory):
+            slack.OUTBOX.flush()
+    if trace_memory:
+        tracemalloc.stop()
+
+    results["memory"]["peak_rss_mb"] = (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    )
+    results["requests"]["client"] = http_client.CLIENT.stats()
+    response = http_client.CLIENT.request("GET", f"{base_url}/_stats")
+    results["requests"]["services"] = response.json()
+    server.terminate()
+    os.chdir(backend)
+    workdir.cleanup()
+
+    text = json.dumps(results, indent=2)
+    if output is not None:
+        output.write_text(text + "\n")
+    print(text)
+    if baseline is not None:
+        regressions = compare(results, json.loads(baseline.read_text()), tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,177 @@
+"""
+Peak memory of the dataset scripts on synthetic all_locations.json files of
+growing size. Every script runs in its own process and reports its peak resident
+memory. The scripts stream the features, so their peak memory must stay flat
+while the file grows, unlike loading the whole file with `json.load`. Run from
+the backend folder:
+
+    python -m benchmarks.streaming --sizes 100000 --sizes 1000000
+"""
+
+import copy
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import typer
+
+from pennyme import io
+
+app = typer.Typer()
+
+BACKEND = Path(__file__).parent.parent
+DATA_PATH = BACKEND.parent / "data" / "server_locations.json"
+# Runs a script like `python script.py args` and prints its peak memory in kB
+MEASURE = """
+import resource, runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+finally:
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file=sys.stderr)
+"""
+LOAD = """
+import json, resource, sys
+json.load(open(sys.argv[1]))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file=sys.stderr)
+"""
+
+
+def synthetic_features(size: int, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    """
+    Generate features like the ones in the server locations.
+
+    Args:
+        size: Number of features.
+        seed: Random seed.
+
+    Yields:
+        Features with unique ids, some of them with multiple machines.
+    """
+    with open(DATA_PATH, "r") as f:
+        templates = json.load(f)["features"]
+    rng = random.Random(seed)
+    for i in range(size):
+        feature = copy.deepcopy(templates[i % len(templates)])
+        properties = feature["properties"]
+        properties.pop("multimachine", None)
+        properties["id"] = i
+        properties["last_updated"] = f"2023-{rng.randint(1, 12):02d}-01"
+        if rng.random() < 0.01:
+            properties["multimachine"] = str(rng.randint(2, 4))
+        lng, lat = feature["geometry"]["coordinates"]
+        feature["geometry"]["coordinates"] = [
+            lng + rng.uniform(-1, 1),
+            max(-90, min(90, lat + rng.uniform(-1, 1))),
+        ]
+        yield feature
+
+
+def peak_memory_mb(args: List[str], cwd: Path, code: str = MEASURE) -> float:
+    """
+    Run a script in a new process.
+
+    Args:
+        args: Script and its arguments.
+        cwd: Working directory.
+        code: Wrapper that runs the script and prints its peak memory.
+
+    Returns:
+        The peak resident memory of the process in MiB.
+    """
+    env = dict(os.environ, PYTHONPATH=str(BACKEND))
+    result = subprocess.run(
+        [sys.executable, "-c", code, *args],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{args[0]} failed:\n{result.stderr}")
+    return int(result.stderr.strip().splitlines()[-1]) / 1024
+
+
+@app.command()
+def main(
+    sizes: List[int] = typer.Option(
+        [100000, 1000000], help="Numbers of features of all_locations.json"
+    ),
+    baseline_max_size: int = typer.Option(
+        200000, help="Largest file that is also loaded with json.load"
+    ),
+    max_growth_mb: float = typer.Option(
+        100.0, help="Allowed growth of the peak memory from the smallest size"
+    ),
+):
+    scripts = {
+        "divide_multimachines": [str(BACKEND / "scripts" / "divide_multimachines.py")],
+        "merge_jsons": [
+            str(BACKEND / "scripts" / "merge_jsons.py"),
+            "data/all_locations.json",
+        ],
+        "sort_locations_by_latitude": [
+            str(BACKEND / "scripts" / "sort_locations_by_latitude.py"),
+            "-i",
+            "data/all_locations.json",
+            "-o",
+            "sorted.json",
+        ],
+        "geojson_combiner": [
+            str(BACKEND.parent / "webmap" / "geojson_combiner.py"),
+            "data/all_locations.json",
+            "data/server_locations.json",
+            "all.json",
+        ],
+    }
+    peaks: Dict[str, List[float]] = {name: [] for name in ["json.load", *scripts]}
+    for size in sorted(sizes):
+        with tempfile.TemporaryDirectory() as folder:
+            workdir = Path(folder)
+            (workdir / "data").mkdir()
+            all_path = workdir / "data" / "all_locations.json"
+            start = time.perf_counter()
+            io.dump_features(synthetic_features(size), all_path)
+            # The server locations only contain recent changes, they stay small
+            server = list(synthetic_features(1000, seed=1))
+            for i, feature in enumerate(server):
+                feature["properties"]["id"] = size - 500 + i
+            io.dump_features(server, workdir / "data" / "server_locations.json")
+            file_mb = all_path.stat().st_size / 2**20
+            print(
+                f"{size} features ({file_mb:.0f} MiB), "
+                f"written in {time.perf_counter() - start:.1f} s"
+            )
+
+            if size <= baseline_max_size:
+                peak = peak_memory_mb([str(all_path)], workdir, code=LOAD)
+                peaks["json.load"].append(peak)
+                print(f"  {'json.load':28s} {peak:8.1f} MiB")
+            for name, args in scripts.items():
+                start = time.perf_counter()
+                peak = peak_memory_mb(args, workdir)
+                peaks[name].append(peak)
+                print(
+                    f"  {name:28s} {peak:8.1f} MiB "
+                    f"({time.perf_counter() - start:.1f} s)"
+                )
+
+    failed = False
+    for name in scripts:
+        growth = peaks[name][-1] - peaks[name][0]
+        if growth > max_growth_mb:
+            print(f"Peak memory of {name} grew by {growth:.0f} MiB")
+            failed = True
+    if failed:
+        raise typer.Exit(code=1)
+    print(f"Peak memory of all scripts grew by less than {max_growth_mb:.0f} MiB")
+
+
+if __name__ == "__main__":
+    app()
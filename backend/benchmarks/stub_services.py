@@ -0,0 +1,224 @@
+"""
+Local stand-ins for the external services of the nightly update pipeline, served
+by one HTTP server under a path prefix per service:
+
+- `/pennycollector`: replays the area list, area and detail pages
+- `/github`, `/raw`: contents, branch and pull request API of the data repository
+- `/maps`: Google Maps geocoding with deterministic results
+- `/slack`: accepts all messages
+- `/other`: answers every other link with 200
+
+Requests are counted per service and method, the counts are served at `/_stats`.
+"""
+
+import base64
+import hashlib
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# Files above this size are served via download URL, like by the GitHub API
+MAX_INLINE_SIZE = 1024 * 1024
+# Queries containing this marker are not found by the fake geocoder
+UNKNOWN_ADDRESS = "Nowhere"
+
+
+class StubState:
+    """Content and request counts shared by the request handlers."""
+
+    def __init__(self, pages: Dict[str, bytes], files: Dict[str, bytes]):
+        """
+        Args:
+            pages: Pennycollector pages keyed by path and query, e.g.,
+                `/Locations.aspx?area=27`.
+            files: Files of the main branch of the data repository keyed by path,
+                e.g., `data/server_locations.json`.
+        """
+        self.pages = pages
+        self.branches: Dict[str, Dict[str, bytes]] = {"main": dict(files)}
+        self.pulls: Dict[int, str] = {}
+        self.counts: Counter = Counter()
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Routes the requests to the stand-in of each service."""
+
+    protocol_version = "HTTP/1.1"
+    state: StubState
+
+    def log_message(self, format: str, *args):
+        pass
+
+    def _send(
+        self,
+        status: int = 200,
+        body: Any = b"",
+        content_type: str = "application/json",
+    ):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _body(self) -> Optional[Dict[str, Any]]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _handle(self):
+        parts = urlsplit(self.path)
+        service, _, path = parts.path.lstrip("/").partition("/")
+        payload = self._body()
+        with self.state.lock:
+            if service != "_stats":
+                self.state.counts[f"{service} {self.command}"] += 1
+            status, body, content_type = self.route(
+                service, "/" + path, parts.query, payload
+            )
+        self._send(status, body, content_type)
+
+    do_GET = do_HEAD = do_POST = do_PUT = _handle
+
+    def route(
+        self, service: str, path: str, query: str, payload: Optional[Dict[str, Any]]
+    ) -> Tuple[int, Any, str]:
+        """
+        Answer a request, called with the lock of the state.
+
+        Args:
+            service: Path prefix of the service, e.g., `github`.
+            path: Path of the request within the service.
+            query: Query string of the request.
+            payload: JSON body of the request, if any.
+
+        Returns:
+            Status code, body and content type of the response.
+        """
+        if service == "_stats":
+            return 200, dict(self.state.counts), "application/json"
+        if service == "pennycollector":
+            return self.pennycollector(path, query)
+        if service == "github":
+            return self.github(path, parse_qs(query), payload)
+        if service == "raw":
+            # /<owner>/<repo>/<branch>/<path>
+            _, _, _, branch, file = path.split("/", 4)
+            content = self.state.branches[branch].get(file)
+            if content is None:
+                return 404, b"", "text/plain"
+            return 200, content, "application/json"
+        if service == "maps":
+            return 200, geocode(parse_qs(query)["address"][0]), "application/json"
+        if service == "slack":
+            return 200, {"ok": True, "ts": "0"}, "application/json"
+        return 200, b"<html></html>", "text/html"
+
+    def pennycollector(self, path: str, query: str) -> Tuple[int, Any, str]:
+        """Replay the pages, all detail pages exist."""
+        if path == "/Details.aspx":
+            return 200, b"<html><body>Details</body></html>", "text/html"
+        page = self.state.pages.get(path + ("?" + query if query else ""))
+        if page is None:
+            return 404, b"Not found", "text/html"
+        return 200, page, "text/html; charset=utf-8"
+
+    def github(
+        self, path: str, query: Dict[str, Any], payload: Optional[Dict[str, Any]]
+    ) -> Tuple[int, Any, str]:
+        """Fake the parts of the GitHub API used by `github_update`."""
+        state = self.state
+        # /repos/<owner>/<repo>/<endpoint...>
+        _, _, owner, repo, endpoint = path.split("/", 4)
+        endpoint = endpoint.rstrip("/")
+        if endpoint.startswith("branches/"):
+            exists = endpoint[len("branches/") :] in state.branches
+            return (200 if exists else 404), {}, "application/json"
+        if endpoint.startswith("commits/"):
+            date = "2024-01-01T00:00:00Z"
+            return 200, {"commit": {"author": {"date": date}}}, "application/json"
+        if endpoint.startswith("git/refs"):
+            if self.command == "POST":
+                branch = payload["ref"][len("refs/heads/") :]
+                state.branches[branch] = dict(state.branches["main"])
+                return 201, {"ref": payload["ref"]}, "application/json"
+            branch = endpoint.split("/")[-1]
+            sha = hashlib.sha1(branch.encode()).hexdigest()
+            return 200, {"object": {"sha": sha}}, "application/json"
+        if endpoint.startswith("contents/"):
+            file = endpoint[len("contents/") :].lstrip("/")
+            if self.command == "PUT":
+                branch = payload["branch"]
+                content = base64.b64decode(payload["content"])
+                state.branches[branch][file] = content
+                return 200, {"content": {"path": file}}, "application/json"
+            branch = query.get("ref", ["main"])[0]
+            content = state.branches[branch].get(file)
+            if content is None:
+                return 404, {"message": "Not Found"}, "application/json"
+            data = {
+                "sha": hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest(),
+                "download_url": f"https://raw.githubusercontent.com/{owner}/{repo}/"
+                f"{branch}/{file}",
+                "encoding": "base64",
+                "content": base64.b64encode(content).decode(),
+            }
+            if len(content) > MAX_INLINE_SIZE:
+                data.update(encoding="none", content="")
+            return 200, data, "application/json"
+        if endpoint == "pulls":
+            if self.command == "POST":
+                number = len(state.pulls) + 1
+                state.pulls[number] = payload["head"]
+                return 201, {"number": number}, "application/json"
+            pulls = [
+                {"number": number, "head": {"ref": head}}
+                for number, head in state.pulls.items()
+            ]
+            return 200, pulls, "application/json"
+        if endpoint.endswith("/labels"):
+            return 200, [], "application/json"
+        if endpoint.endswith("/requested_reviewers") or endpoint.endswith("/comments"):
+            return 201, {}, "application/json"
+        return 404, {"message": "Not Found"}, "application/json"
+
+
+def geocode(query: str) -> Dict[str, Any]:
+    """
+    Geocode a query deterministically, like the Google Maps geocoding API.
+
+    Args:
+        query: The address.
+
+    Returns:
+        The response of the API.
+    """
+    if UNKNOWN_ADDRESS in query:
+        return {"status": "ZERO_RESULTS", "results": []}
+    digest = hashlib.sha1(query.encode("utf8")).digest()
+    lat = int.from_bytes(digest[:4], "big") / 2**32 * 140 - 60
+    lng = int.from_bytes(digest[4:8], "big") / 2**32 * 360 - 180
+    location = {"lat": round(lat, 7), "lng": round(lng, 7)}
+    return {"status": "OK", "results": [{"geometry": {"location": location}}]}
+
+
+def serve(pages: Dict[str, bytes], files: Dict[str, bytes], ready):
+    """
+    Run the stand-ins until the process is terminated.
+
+    Args:
+        pages: Pennycollector pages keyed by path and query.
+        files: Files of the main branch of the data repository.
+        ready: Connection to which the port of the server is sent.
+    """
+    handler = type("Handler", (StubHandler,), {"state": StubState(pages, files)})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    ready.send(server.server_address[1])
+    server.serve_forever()
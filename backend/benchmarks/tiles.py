@@ -0,0 +1,205 @@
+"""
+Benchmark of the tiles of the web map (`pennyme.tiles`). The tiles of synthetic
+locations are built from scratch. The script compares the download of a view of
+the map with the single all.json that the map loaded before. Then a few machines
+are renamed, moved, added and removed, also in a different order, and the tiles
+are rebuilt incrementally. The script fails if the result differs from a build
+from scratch. Run from the backend folder:
+
+    python -m benchmarks.tiles --size 100000 --edits 50
+"""
+
+import copy
+import filecmp
+import math
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, List, Set
+
+import typer
+
+from benchmarks.streaming import synthetic_features
+from pennyme import io
+from pennyme.tiles import TILE_LEVELS, build_tiles
+
+app = typer.Typer()
+
+# Views of the map: center, zoom and size in pixels. The first is the default view
+VIEWS = [
+    ((10.00855, 53.59714), 6.0),
+    ((10.00855, 53.59714), 3.0),
+    ((-74.0, 40.7), 10.0),
+]
+VIEW_SIZE = (1280, 800)
+# Size of a tile in pixels in Mapbox GL
+TILE_SIZE = 512
+
+
+def view_tiles(lng: float, lat: float, zoom: float) -> Set[str]:
+    """
+    Find the tiles that the map loads for a view.
+
+    Args:
+        lng: Longitude of the center in degrees.
+        lat: Latitude of the center in degrees.
+        zoom: Zoom of the map.
+
+    Returns:
+        Names of the tiles of the closest level at or below the zoom.
+    """
+    level = max([z.zoom for z in TILE_LEVELS if z.zoom <= zoom], default=0)
+    world = TILE_SIZE * 2**zoom
+    x = (lng + 180) / 360 * world
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * world
+    tile = world / 2**level
+    xs = range(
+        int((x - VIEW_SIZE[0] / 2) // tile), int((x + VIEW_SIZE[0] / 2) // tile) + 1
+    )
+    ys = range(
+        int((y - VIEW_SIZE[1] / 2) // tile), int((y + VIEW_SIZE[1] / 2) // tile) + 1
+    )
+    return {f"{level}/{x % 2**level}/{y}" for x in xs for y in ys if 0 <= y < 2**level}
+
+
+def rename(features: List[Dict[str, Any]], edits: int) -> List[Dict[str, Any]]:
+    """
+    Rename machines.
+
+    Args:
+        features: The features.
+        edits: Number of renamed machines.
+
+    Returns:
+        The changed features.
+    """
+    rng = random.Random(1)
+    features = copy.deepcopy(features)
+    for feature in rng.sample(features, edits):
+        feature["properties"]["name"] += " (renovated)"
+    return features
+
+
+def edit(features: List[Dict[str, Any]], edits: int) -> List[Dict[str, Any]]:
+    """
+    Rename, move, remove and add machines.
+
+    Args:
+        features: The features.
+        edits: Number of changes of each kind.
+
+    Returns:
+        The changed features.
+    """
+    rng = random.Random(2)
+    features = rename(features, edits)
+    for feature in rng.sample(features, edits):
+        lng, lat = feature["geometry"]["coordinates"]
+        feature["geometry"]["coordinates"] = [lng + 0.01, lat - 0.01]
+    for feature in rng.sample(features, edits):
+        features.remove(feature)
+    for feature in rng.sample(features, edits):
+        feature = copy.deepcopy(feature)
+        feature["properties"]["id"] += len(features) + edits
+        features.append(feature)
+    return features
+
+
+def reorder(features: List[Dict[str, Any]], edits: int) -> List[Dict[str, Any]]:
+    """
+    Edit machines, see `edit`, and shuffle the order of the machines.
+
+    Args:
+        features: The features.
+        edits: Number of changes of each kind.
+
+    Returns:
+        The changed features in a new order.
+    """
+    features = edit(features, edits)
+    random.Random(3).shuffle(features)
+    return features
+
+
+def folders_identical(left: str, right: str) -> bool:
+    """Whether two folders have the same files with the same content."""
+    comparison = filecmp.dircmp(left, right)
+    if comparison.left_only or comparison.right_only or comparison.funny_files:
+        return False
+    _, mismatch, errors = filecmp.cmpfiles(
+        left, right, comparison.common_files, shallow=False
+    )
+    return (
+        not mismatch
+        and not errors
+        and all(
+            folders_identical(os.path.join(left, d), os.path.join(right, d))
+            for d in comparison.common_dirs
+        )
+    )
+
+
+@app.command()
+def main(
+    size: int = typer.Option(100000, help="Number of machines"),
+    edits: int = typer.Option(50, help="Number of changes of each kind"),
+):
+    features = list(synthetic_features(size))
+    all_bytes = len(io.dumps({"type": "FeatureCollection", "features": features}))
+    print(f"{size} machines, all.json has {all_bytes / 2**20:.1f} MiB")
+
+    with tempfile.TemporaryDirectory() as folder:
+        incremental = os.path.join(folder, "incremental")
+        start = time.perf_counter()
+        build = build_tiles(features, incremental)
+        seconds = time.perf_counter() - start
+        manifest = io.load(os.path.join(incremental, "manifest.json"))["tiles"]
+        tile_bytes = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(incremental)
+            for name in names
+            if name not in ("manifest.json", "state.json")
+        )
+        print(
+            f"Full build: {build.written} tiles ({tile_bytes / 2**20:.1f} MiB) "
+            f"in {seconds:.2f} s"
+        )
+        for (lng, lat), zoom in VIEWS:
+            names = view_tiles(lng, lat, zoom) & manifest.keys()
+            view_bytes = sum(
+                os.path.getsize(os.path.join(incremental, name + ".json"))
+                for name in names
+            )
+            print(
+                f"  view at zoom {zoom:4.1f}: {len(names):3d} tiles, "
+                f"{view_bytes / 2**20:6.2f} MiB "
+                f"({100 * view_bytes / all_bytes:5.1f}% of all.json)"
+            )
+
+        for name, change in [
+            ("Renamed", rename),
+            ("Edited", edit),
+            ("Reordered", reorder),
+        ]:
+            changed = change(features, edits)
+            start = time.perf_counter()
+            build = build_tiles(changed, incremental)
+            seconds = time.perf_counter() - start
+            print(
+                f"{name}: {build.changed} machines changed, {build.written} tiles "
+                f"written, {build.removed} removed, {build.unchanged} unchanged "
+                f"in {seconds:.2f} s"
+            )
+        scratch = os.path.join(folder, "scratch")
+        start = time.perf_counter()
+        build_tiles(changed, scratch)
+        print(f"Build from scratch: {time.perf_counter() - start:.2f} s")
+        identical = folders_identical(incremental, scratch)
+        print(f"Incremental build identical to build from scratch: {identical}")
+    if not identical:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
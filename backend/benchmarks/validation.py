@@ -0,0 +1,180 @@
+"""
+Benchmark of the validation in the pre-commit hook (`.hooks/check_json.py`). A
+synthetic all_locations.json is committed to a temporary git repository, then
+a few features are edited and staged. The previous hook (`json.load` and a type
+check of the coordinates) is compared to the full validation, in one and in
+several processes, and to the validation of the staged changes only. Corrupted
+files must be rejected by every mode. Run from the backend folder:
+
+    python -m benchmarks.validation --size 100000 --workers 4
+"""
+
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, List, Tuple
+
+import typer
+
+from benchmarks.streaming import synthetic_features
+from pennyme import io
+from pennyme.validation import validate_changed, validate_file
+
+app = typer.Typer()
+
+
+def previous_hook(path: str) -> None:
+    """The checks of the pre-commit hook before the schema validation."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    for x in data["features"]:
+        assert isinstance(x["geometry"]["coordinates"][0], float)
+        assert isinstance(x["geometry"]["coordinates"][1], float)
+    id_counts = Counter([e["properties"]["id"] for e in data["features"]])
+    if not id_counts.most_common()[0][-1] == 1:
+        raise ValueError("duplicate entries")
+
+
+def edit_line(lines: List[str], pattern: str, index: int, replace: str) -> None:
+    """
+    Edit the line of the n-th match of a pattern in place.
+
+    Args:
+        lines: Lines of the file.
+        pattern: Regular expression that matches a whole line.
+        index: Which of the matching lines to edit.
+        replace: Replacement of the matched line, can refer to groups.
+    """
+    regex = re.compile(pattern)
+    matches = (i for i, line in enumerate(lines) if regex.fullmatch(line))
+    for _ in range(index):
+        next(matches)
+    i = next(matches)
+    lines[i] = regex.sub(replace, lines[i])
+
+
+def delete_feature(lines: List[str], index: int) -> None:
+    """Delete the n-th feature of the file from its lines."""
+    starts = [i for i, line in enumerate(lines) if line == "        {"]
+    del lines[starts[index] : starts[index + 1]]
+
+
+def valid_edits(lines: List[str]) -> None:
+    """Rename some machines and delete one, like a typical data update."""
+    for index in range(0, 1000, 100):
+        edit_line(lines, r'( +"name": ").*(",?)', index, r"\1Renamed\2")
+    delete_feature(lines, 500)
+
+
+CORRUPTIONS = {
+    "unknown status": lambda lines: edit_line(
+        lines, r'( +"machine_status": ")\w+(",?)', 321, r"\1broken\2"
+    ),
+    "unknown area": lambda lines: edit_line(
+        lines, r'( +"area": ").*(",?)', 654, r"\1Atlantis\2"
+    ),
+    "latitude out of range": lambda lines: edit_line(
+        lines, r"( +)-?\d+\.\d+", 2 * 987 + 1, r"\g<1>91.5"
+    ),
+    "integer coordinate": lambda lines: edit_line(
+        lines, r"( +)-?\d+\.\d+(,?)", 2 * 987, r"\g<1>8\2"
+    ),
+    "duplicate id": lambda lines: edit_line(
+        lines, r'( +"id": )\d+(,?)', 400, r"\g<1>12\2"
+    ),
+    "missing comma": lambda lines: edit_line(
+        lines, r'( +"address": ".*"),', 111, r"\1"
+    ),
+    "invalid date": lambda lines: edit_line(
+        lines, r'( +"last_updated": "\d{4})-\d\d(-\d\d",?)', 222, r"\1-13\2"
+    ),
+    "deleted brace": lambda lines: lines.remove("        },"),
+}
+
+
+def git(folder: Path, *args: str) -> None:
+    """Run a git command in a folder."""
+    subprocess.run(["git", *args], cwd=folder, check=True, capture_output=True)
+
+
+def timed(func: Callable, *args, **kwargs) -> Tuple[float, Any]:
+    """Run a function once and return the time and the result."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+@app.command()
+def main(
+    size: int = typer.Option(100000, help="Number of features of all_locations.json"),
+    workers: int = typer.Option(
+        os.cpu_count() or 1, help="Number of processes of the full validation"
+    ),
+    max_changed_time: float = typer.Option(
+        1.0, help="Allowed time to validate the staged changes, in seconds"
+    ),
+):
+    with tempfile.TemporaryDirectory() as folder:
+        repo = Path(folder)
+        path = repo / "all_locations.json"
+        io.dump_features(synthetic_features(size), path)
+        git(repo, "init", "-q")
+        git(repo, "add", path.name)
+        git(
+            repo,
+            *["-c", "user.name=benchmark", "-c", "user.email=benchmark@localhost"],
+            *["commit", "-q", "-m", "Add locations"],
+        )
+        original = path.read_text().split("\n")
+        file_mb = path.stat().st_size / 2**20
+        print(f"{size} features ({file_mb:.0f} MiB), {workers} workers")
+
+        def stage(corrupt: Callable[[List[str]], None]) -> None:
+            lines = list(original)
+            corrupt(lines)
+            path.write_text("\n".join(lines))
+            git(repo, "add", path.name)
+
+        stage(valid_edits)
+        modes = {
+            "previous hook": lambda: previous_hook(str(path)),
+            "full, 1 process": lambda: validate_file(str(path), "all locations"),
+            f"full, {workers} processes": lambda: validate_file(
+                str(path), "all locations", workers=workers
+            ),
+            "staged changes": lambda: validate_changed(
+                str(path), "all locations", workers=workers
+            ),
+        }
+        failed = False
+        for name, mode in modes.items():
+            seconds, errors = timed(mode)
+            print(f"  {name:24s} {seconds:7.3f} s")
+            if errors:
+                print(f"  Unexpected errors: {errors[:3]}")
+                failed = True
+        changed_time, _ = timed(modes["staged changes"])
+        if changed_time > max_changed_time:
+            print(f"Validating the staged changes took {changed_time:.2f} s")
+            failed = True
+
+        for name, corrupt in CORRUPTIONS.items():
+            stage(corrupt)
+            full = validate_file(str(path), "all locations", workers=workers)
+            changed = validate_changed(str(path), "all locations")
+            caught = bool(full) and bool(changed)
+            failed |= not caught
+            print(f"  {name:24s} caught: {caught}  {(changed or full or [''])[0]}")
+
+    if failed:
+        raise typer.Exit(code=1)
+    print("All corruptions caught")
+
+
+if __name__ == "__main__":
+    app()
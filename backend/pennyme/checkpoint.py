@@ -0,0 +1,102 @@
+"""Checkpoints of the location differ to resume a run that failed midway."""
+
+import os
+import pickle
+import shutil
+import time
+from typing import Any, Dict, Optional, Tuple
+
+INPUTS_FILE = "inputs.pkl"
+STATE_FILE = "state.pkl"
+# The state holds all data of the run, it is stored at most once per interval
+# (seconds), a resumed run repeats the areas completed since
+SAVE_INTERVAL = 60.0
+
+
+class DifferCheckpoint:
+    """
+    Stores the inputs of a differ run once and its state after completed areas,
+    at most once per interval. The state is pickled as a whole, such that
+    features shared between the data and the lookup dictionaries are restored as
+    shared objects.
+    """
+
+    def __init__(self, folder: str, interval: float = SAVE_INTERVAL):
+        """
+        Args:
+            folder: Working directory of the checkpoint.
+            interval: Minimal time in seconds between two stored states. Defaults
+                to SAVE_INTERVAL.
+        """
+        self.folder = folder
+        self.interval = interval
+        self.inputs_path = os.path.join(folder, INPUTS_FILE)
+        self.state_path = os.path.join(folder, STATE_FILE)
+        self._saved: Optional[float] = None
+
+    def due(self) -> bool:
+        """
+        Check whether the state should be stored again.
+
+        Returns:
+            Whether no state was stored yet or the interval has passed since.
+        """
+        return self._saved is None or time.monotonic() - self._saved >= self.interval
+
+    def exists(self) -> bool:
+        """
+        Check whether a run can be resumed from this checkpoint.
+
+        Returns:
+            Whether inputs and state were stored.
+        """
+        return os.path.exists(self.inputs_path) and os.path.exists(self.state_path)
+
+    def _dump(self, path: str, content: Dict[str, Any]):
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # A crash while writing must not corrupt the last checkpoint
+        os.replace(tmp_path, path)
+
+    def save_inputs(self, inputs: Dict[str, Any]):
+        """
+        Store the inputs of the run, before they are modified.
+
+        Args:
+            inputs: The loaded data, e.g., server and device locations.
+        """
+        self._dump(self.inputs_path, inputs)
+
+    def save_state(self, state: Dict[str, Any]):
+        """
+        Store the state after an area was completed, see `due`.
+
+        Args:
+            state: Everything modified while processing the areas.
+        """
+        self._dump(self.state_path, state)
+        self._saved = time.monotonic()
+
+    def load(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Load the stored inputs and the state of the last completed area.
+
+        Raises:
+            FileNotFoundError: If there is no checkpoint to resume from.
+
+        Returns:
+            The inputs and the state.
+        """
+        if not self.exists():
+            raise FileNotFoundError(f"There is no checkpoint in {self.folder}")
+        with open(self.inputs_path, "rb") as f:
+            inputs = pickle.load(f)
+        with open(self.state_path, "rb") as f:
+            state = pickle.load(f)
+        return inputs, state
+
+    def clear(self):
+        """Remove the checkpoint, to be called after a successful run."""
+        shutil.rmtree(self.folder, ignore_errors=True)
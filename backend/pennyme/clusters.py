@@ -0,0 +1,322 @@
+"""
+Hierarchical grid clustering of the machines for the maps. At every zoom level
+up to MAX_ZOOM, the machines are grouped into the cells of a grid with
+2**GRID_BITS cells per tile side. Each cell of a level splits into four cells at
+the next level. A cluster counts its machines by `machine_status` and is placed
+at their mean position.
+
+The index keeps running sums per cell, such that adding, moving or removing a
+machine updates one cell per level. The clusters are served by the `/clusters`
+endpoint and written as static tiles in the layout of `pennyme.tiles`.
+"""
+
+import math
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from pennyme import io
+from pennyme.tiles import MANIFEST_FILE, save_tile, sort_tiles, tile_of
+
+MAX_ZOOM = 10
+# 8 x 8 cells per tile, i.e., cells of 64 pixels in Mapbox GL
+GRID_BITS = 3
+# Coordinates are summed as integers (1e-7 degrees), such that removing a machine
+# restores the previous sums exactly
+FIXED = 10**7
+# Digits of the cluster coordinates
+DIGITS = 6
+
+# West, south, east and north bound in degrees
+BBox = Tuple[float, float, float, float]
+
+
+class ClusterIndex:
+    """
+    Clusters of the machines at all zoom levels. Every cell holds the number of
+    machines, the sums of their coordinates and ids and the counts per status.
+    """
+
+    def __init__(
+        self, features: Iterable[Dict[str, Any]] = (), max_zoom: int = MAX_ZOOM
+    ):
+        """
+        Args:
+            features: The initial machines. Defaults to none.
+            max_zoom: The highest zoom level. Defaults to MAX_ZOOM.
+        """
+        self.max_zoom = max_zoom
+        # The record of every machine, to remove it from its cells
+        self._machines: Dict[int, Tuple[int, int, str, int, int]] = {}
+        self._cells: List[Dict[Tuple[int, int], List[Any]]] = [
+            {} for _ in range(max_zoom + 1)
+        ]
+        # Tiles with changed clusters since the last call of `write_tiles`
+        self._dirty: Set[Tuple[int, int, int]] = set()
+        self._lock = threading.RLock()
+        for feature in features:
+            self.update(feature)
+
+    def __len__(self) -> int:
+        return len(self._machines)
+
+    def _apply(
+        self, machine_id: int, record: Tuple[int, int, str, int, int], sign: int
+    ):
+        # Add (sign 1) or remove (sign -1) a machine from its cell at every level
+        lng, lat, status, x, y = record
+        for zoom, cells in enumerate(self._cells):
+            shift = self.max_zoom - zoom
+            key = (x >> shift, y >> shift)
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = [0, 0, 0, 0, {}]
+            cell[0] += sign
+            cell[1] += sign * lng
+            cell[2] += sign * lat
+            cell[3] += sign * machine_id
+            statuses = cell[4]
+            statuses[status] = statuses.get(status, 0) + sign
+            if not statuses[status]:
+                del statuses[status]
+            if not cell[0]:
+                del cells[key]
+            self._dirty.add((zoom, key[0] >> GRID_BITS, key[1] >> GRID_BITS))
+
+    def set(self, machine_id: int, lng: float, lat: float, status: str):
+        """
+        Add a machine or move it to a new position or status.
+
+        Args:
+            machine_id: The ID of the machine.
+            lng: Longitude in degrees.
+            lat: Latitude in degrees.
+            status: The `machine_status`.
+        """
+        x, y = tile_of(lng, lat, self.max_zoom + GRID_BITS)
+        record = (round(lng * FIXED), round(lat * FIXED), status, x, y)
+        with self._lock:
+            old = self._machines.get(machine_id)
+            if old == record:
+                return
+            if old is not None:
+                self._apply(machine_id, old, -1)
+            self._apply(machine_id, record, 1)
+            self._machines[machine_id] = record
+
+    def update(self, feature: Dict[str, Any]):
+        """
+        Add or update the machine of a feature.
+
+        Args:
+            feature: The geojson feature of the machine.
+        """
+        lng, lat = feature["geometry"]["coordinates"]
+        properties = feature["properties"]
+        self.set(int(properties["id"]), lng, lat, properties["machine_status"])
+
+    def remove(self, machine_id: int):
+        """
+        Remove a machine, if it is known.
+
+        Args:
+            machine_id: The ID of the machine.
+        """
+        with self._lock:
+            old = self._machines.pop(machine_id, None)
+            if old is not None:
+                self._apply(machine_id, old, -1)
+
+    def _cell_ranges(self, zoom: int, bbox: BBox) -> List[Tuple[range, range]]:
+        # Cell indices within a bounding box, split at the antimeridian
+        if not all(map(math.isfinite, bbox)):
+            raise ValueError(f"Bounding box {bbox} is not finite")
+        west, south, east, north = bbox
+        if east - west >= 360:
+            west, east = -180.0, 180.0
+        west, east = _wrap(west), _wrap(east)
+        south, north = min(max(south, -90.0), 90.0), min(max(north, -90.0), 90.0)
+        (x0, y0), (x1, y1) = (
+            tile_of(west, north, zoom + GRID_BITS),
+            tile_of(east, south, zoom + GRID_BITS),
+        )
+        ys = range(y0, y1 + 1)
+        if west <= east:
+            return [(range(x0, x1 + 1), ys)]
+        return [(range(x0, 1 << (zoom + GRID_BITS)), ys), (range(0, x1 + 1), ys)]
+
+    def clusters(self, zoom: int, bbox: Optional[BBox] = None) -> List[Dict[str, Any]]:
+        """
+        Find the clusters of a zoom level.
+
+        Args:
+            zoom: The zoom level, levels above the highest level use the highest.
+            bbox: West, south, east and north bound in degrees. Clusters whose cell
+                intersects the box are returned. Longitudes are wrapped around the
+                antimeridian and latitudes clamped. Defaults to the whole world.
+
+        Returns:
+            The clusters as geojson features, ordered by cell. Clusters of a single
+                machine carry its id.
+        """
+        zoom = min(max(zoom, 0), self.max_zoom)
+        with self._lock:
+            cells = self._cells[zoom]
+            if bbox is None:
+                keys = list(cells)
+            else:
+                keys = []
+                for xs, ys in self._cell_ranges(zoom, bbox):
+                    if len(xs) * len(ys) < len(cells):
+                        keys += [(x, y) for x in xs for y in ys if (x, y) in cells]
+                    else:
+                        keys += [(x, y) for x, y in cells if x in xs and y in ys]
+            return [_cluster_feature(cells[key]) for key in sorted(keys)]
+
+    def write_tiles(self, folder: str, full: bool = False) -> int:
+        """
+        Write the clusters as static tiles, `<folder>/<z>/<x>/<y>.json`, and a
+        manifest. Only tiles with changed clusters since the last call are
+        written, unless the folder has no manifest yet.
+
+        Args:
+            folder: The output folder.
+            full: Whether to write all tiles. Defaults to False.
+
+        Returns:
+            The number of written or removed tiles.
+        """
+        manifest_path = os.path.join(folder, MANIFEST_FILE)
+        layout = {"max_zoom": self.max_zoom, "grid_bits": GRID_BITS}
+        tiles: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(manifest_path):
+            manifest = io.load(manifest_path)
+            tiles = manifest["tiles"] if manifest["layout"] == layout else {}
+        with self._lock:
+            touched = set(self._dirty)
+            if full or not tiles:
+                touched.update(tuple(map(int, name.split("/"))) for name in tiles)
+                for zoom, cells in enumerate(self._cells):
+                    touched.update(
+                        (zoom, x >> GRID_BITS, y >> GRID_BITS) for x, y in cells
+                    )
+            size = 1 << GRID_BITS
+            changed = 0
+            for zoom, tile_x, tile_y in sorted(touched):
+                cells = self._cells[zoom]
+                keys = [
+                    (x, y)
+                    for x in range(tile_x * size, (tile_x + 1) * size)
+                    for y in range(tile_y * size, (tile_y + 1) * size)
+                    if (x, y) in cells
+                ]
+                features = [_cluster_feature(cells[key]) for key in sorted(keys)]
+                name = f"{zoom}/{tile_x}/{tile_y}"
+                changed += save_tile(folder, name, features, tiles, force=full) in (
+                    "written",
+                    "removed",
+                )
+            self._dirty.clear()
+        io.dump({"layout": layout, "tiles": sort_tiles(tiles)}, manifest_path)
+        return changed
+
+
+def _cluster_feature(cell: List[Any]) -> Dict[str, Any]:
+    # Geojson feature of a cell, like the clusters of supercluster
+    count, lng, lat, machine_id, statuses = cell
+    properties = {
+        "cluster": count > 1,
+        "point_count": count,
+        "machine_status": dict(sorted(statuses.items())),
+    }
+    if count == 1:
+        properties["id"] = machine_id
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [
+                round(lng / count / FIXED, DIGITS),
+                round(lat / count / FIXED, DIGITS),
+            ],
+        },
+        "properties": properties,
+    }
+
+
+class ServerClusters:
+    """
+    Clusters of all locations and the server locations. Like
+    `pennyme.slack.MachineNames`, the server locations file is only parsed again if
+    its modification time or size changed, and then only changed machines are
+    updated in the index.
+    """
+
+    def __init__(self, features: Iterable[Dict[str, Any]], path: str):
+        """
+        Args:
+            features: Features that are always known, i.e., all locations.
+            path: Path to the server locations file.
+        """
+        self.path = path
+        self.index = ClusterIndex()
+        # Machines of all locations, restored if they leave the server locations
+        self._base: Dict[int, Tuple[float, float, str]] = {}
+        for feature in features:
+            self._base[int(feature["properties"]["id"])] = _position(feature)
+            self.index.update(feature)
+        self._server: Dict[int, Tuple[float, float, str]] = {}
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+        server = {
+            int(feature["properties"]["id"]): _position(feature)
+            for feature in io.iter_features(self.path, encoding="latin-1")
+        }
+        for machine_id, position in server.items():
+            if self._server.get(machine_id) != position:
+                self.index.set(machine_id, *position)
+        for machine_id in self._server.keys() - server.keys():
+            if machine_id in self._base:
+                self.index.set(machine_id, *self._base[machine_id])
+            else:
+                self.index.remove(machine_id)
+        self._server, self._stamp = server, stamp
+
+    def clusters(self, zoom: int, bbox: Optional[BBox] = None) -> Dict[str, Any]:
+        """
+        Find the clusters of a zoom level, see `ClusterIndex.clusters`.
+
+        Args:
+            zoom: The zoom level.
+            bbox: West, south, east and north bound in degrees. Defaults to the
+                whole world.
+
+        Returns:
+            The clusters as geojson feature collection.
+        """
+        with self._lock:
+            self._refresh()
+        return {
+            "type": "FeatureCollection",
+            "features": self.index.clusters(zoom, bbox),
+        }
+
+
+def _wrap(lng: float) -> float:
+    # Longitude in the range of -180 to 180 degrees
+    return lng if -180.0 <= lng <= 180.0 else (lng + 180.0) % 360.0 - 180.0
+
+
+def _position(feature: Dict[str, Any]) -> Tuple[float, float, str]:
+    # Longitude, latitude and status of a machine
+    lng, lat = feature["geometry"]["coordinates"]
+    return lng, lat, feature["properties"]["machine_status"]
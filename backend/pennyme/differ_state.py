@@ -0,0 +1,310 @@
+"""Per-link and per-area state of the location differ to skip unchanged listings."""
+
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Set
+
+# Decisions that do not modify the data and can hence be reused in the next run.
+# Decisions that modify machines are re-applied in every run until the PR with
+# the changes is merged, and link problems are always re-validated.
+SKIPPABLE_DECISIONS = ["match", "untracked", "duplicate", "problem"]
+
+
+def area_fingerprint(entries: List[Dict[str, Any]]) -> str:
+    """
+    Fingerprint the machines without pennycollector link of an area, against
+    which new listings are matched.
+
+    Args:
+        entries: Properties of the machines, as in the `external` frame.
+
+    Returns:
+        The sha1 hex digest of the entries.
+    """
+    keys = ["name", "address", "latitude", "longitude", "external_url"]
+    content = [[entry.get(key) for key in keys] for entry in entries]
+    return hashlib.sha1(json.dumps(content, default=str).encode()).hexdigest()
+
+
+def listing_fingerprint(
+    link: str,
+    known_entries: List[Dict[str, Any]],
+    area_hash: str,
+    is_duplicate: bool,
+) -> str:
+    """
+    Fingerprint everything in our data that determines the decision for a listing.
+
+    Args:
+        link: URL of the listing.
+        known_entries: Server and device features with this URL.
+        area_hash: Fingerprint of the machines without link in the area.
+        is_duplicate: Whether the title of the listing is known in the area.
+
+    Returns:
+        The sha1 hex digest.
+    """
+    content = [
+        link,
+        [
+            [e["properties"]["machine_status"], e["properties"]["last_updated"]]
+            for e in known_entries
+        ],
+        area_hash,
+        is_duplicate,
+    ]
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+
+def area_data_fingerprint(
+    links: List[str],
+    known_entries: Dict[str, List[Dict[str, Any]]],
+    skip_links: Set[str],
+    area_hash: str,
+    titles: Set[str],
+) -> str:
+    """
+    Fingerprint everything in our data that determines the decisions for the
+    listings of an area, i.e., the inputs of their `listing_fingerprint` and
+    whether they are skipped.
+
+    Args:
+        links: URLs of the listings of the area.
+        known_entries: Server and device features by URL.
+        skip_links: URLs of listings that are skipped.
+        area_hash: Fingerprint of the machines without link in the area.
+        titles: Names of our machines in the area.
+
+    Returns:
+        The sha1 hex digest.
+    """
+    content = [
+        [
+            link,
+            link in skip_links,
+            [
+                [e["properties"]["machine_status"], e["properties"]["last_updated"]]
+                for e in known_entries.get(link, [])
+            ],
+        ]
+        for link in links
+    ]
+    content += [area_hash, sorted(titles)]
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+
+def load_state(path: str) -> Dict[str, Any]:
+    """
+    Read the state of the last successful run.
+
+    Args:
+        path: JSON file with the state.
+
+    Returns:
+        The entries per link (`links`) and per area (`areas`), empty if there is
+            no state yet.
+    """
+    if not os.path.exists(path):
+        return {"links": {}, "areas": {}}
+    with open(path, "r") as f:
+        state = json.load(f)
+    if "links" not in state:
+        # State of a version that only stored the links
+        return {"links": state, "areas": {}}
+    return state
+
+
+class DifferState:
+    """
+    Stores per link the state and date shown on the website, the fingerprint of
+    our data and the decision of the differ. Areas whose listings all had reusable
+    decisions are stored with the hash of their page and the fingerprint of our
+    data, such that they are skipped as a whole if neither changed. The state of
+    the previous run is only replaced once a run completed successfully.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        full: bool = False,
+        previous: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Args:
+            path: JSON file with the state of the last successful run.
+            full: If True, the previous state is ignored (but a new one is
+                written). Defaults to False.
+            previous: The state of the last run, as returned by `load_state`, e.g.,
+                from a replayed snapshot. Defaults to None, i.e., it is read from
+                the path.
+        """
+        self.path = path
+        if full:
+            previous = {"links": {}, "areas": {}}
+        elif previous is None:
+            previous = load_state(path)
+        self.previous: Dict[str, Dict[str, Any]] = previous["links"]
+        self.previous_areas: Dict[str, Dict[str, Any]] = previous["areas"]
+        self.current: Dict[str, Dict[str, Any]] = {}
+        self.current_areas: Dict[str, Dict[str, Any]] = {}
+        self.skipped = 0
+        self.skipped_areas = 0
+
+    def unchanged_page(self, area: str, page: str) -> bool:
+        """
+        Check whether the page of an area did not change since the last run and
+        the area may hence be skipped. Safe to call from any thread.
+
+        Args:
+            area: Name of the area.
+            page: The sha256 hex digest of the page.
+
+        Returns:
+            Whether the area was stored with the same page.
+        """
+        entry = self.previous_areas.get(area)
+        return entry is not None and entry["page"] == page
+
+    def lookup_area(
+        self, area: str, page: str, fingerprint: Callable[[List[str]], str]
+    ) -> Optional[List[str]]:
+        """
+        Find the listings of the previous run for an unchanged area.
+
+        Args:
+            area: Name of the area.
+            page: The sha256 hex digest of the page.
+            fingerprint: Function computing the fingerprint of our data for the
+                links of the area, see `area_data_fingerprint`.
+
+        Returns:
+            The links of the listings of the area, whose entries can all be
+                reused, None if the page or our data changed.
+        """
+        entry = self.previous_areas.get(area)
+        if (
+            entry is None
+            or entry["page"] != page
+            or entry["fingerprint"] != fingerprint(entry["links"])
+        ):
+            return None
+        return entry["links"]
+
+    def skip_area(self, area: str):
+        """
+        Carry over the entry of a skipped area to the new state, its listings are
+        carried over with `skip`.
+
+        Args:
+            area: Name of the area.
+        """
+        self.current_areas[area] = self.previous_areas[area]
+        self.skipped_areas += 1
+
+    def record_area(
+        self,
+        area: str,
+        page: str,
+        fingerprint: str,
+        links: List[str],
+        skip_links: Set[str],
+    ):
+        """
+        Record a processed area, if the decisions for all its listings can be
+        reused.
+
+        Args:
+            area: Name of the area.
+            page: The sha256 hex digest of the page.
+            fingerprint: Fingerprint of our data for the area, computed before its
+                listings were processed.
+            links: URLs of the listings of the area.
+            skip_links: URLs of listings that are skipped, they have no decision.
+        """
+        for link in links:
+            entry = self.current.get(link)
+            if link not in skip_links and (
+                entry is None or entry["decision"] not in SKIPPABLE_DECISIONS
+            ):
+                return
+        self.current_areas[area] = {
+            "page": page,
+            "fingerprint": fingerprint,
+            "links": links,
+        }
+
+    def lookup(
+        self, link: str, state: str, website_updated: str, fingerprint: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Find the decision of the previous run for an unchanged listing.
+
+        Args:
+            link: URL of the listing.
+            state: State shown on the website.
+            website_updated: Date of the last update shown on the website.
+            fingerprint: Fingerprint of our data for this listing.
+
+        Returns:
+            The previous entry with the `decision` (and the `problem` feature of
+                problem decisions) if nothing changed and the decision can be
+                reused, None otherwise.
+        """
+        entry = self.previous.get(link)
+        if (
+            entry is None
+            or entry["state"] != state
+            or entry["website_updated"] != website_updated
+            or entry["fingerprint"] != fingerprint
+            or entry["decision"] not in SKIPPABLE_DECISIONS
+        ):
+            return None
+        return entry
+
+    def skip(self, link: str, entry: Dict[str, Any]):
+        """
+        Carry over the entry of a skipped listing to the new state.
+
+        Args:
+            link: URL of the listing.
+            entry: The entry returned by `lookup`.
+        """
+        self.current[link] = entry
+        self.skipped += 1
+
+    def record(
+        self,
+        link: str,
+        state: str,
+        website_updated: str,
+        fingerprint: str,
+        decision: str,
+        problem: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Record the decision for a listing.
+
+        Args:
+            link: URL of the listing.
+            state: State shown on the website.
+            website_updated: Date of the last update shown on the website.
+            fingerprint: Fingerprint of our data for this listing.
+            decision: The decision, e.g., one of SKIPPABLE_DECISIONS or `manual`.
+            problem: Feature of a problem decision (as in `problems.json`).
+                Defaults to None.
+        """
+        self.current[link] = {
+            "state": state,
+            "website_updated": website_updated,
+            "fingerprint": fingerprint,
+            "decision": decision,
+            "problem": problem,
+        }
+
+    def save(self):
+        """Persist the state of this run, to be called after a successful run."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"links": self.current, "areas": self.current_areas}, f)
+        os.replace(tmp_path, self.path)
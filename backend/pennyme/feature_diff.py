@@ -0,0 +1,258 @@
+"""Feature-level diffs and content hashes of the GeoJSON data files."""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Tuple
+
+# Rows per table in the markdown summary, GitHub limits the size of PR bodies
+MAX_ROWS = 100
+# Number of remembered hashes of committed files
+MAX_CACHED_HASHES = 20
+# Value of fields that do not exist in one version
+_MISSING = object()
+
+
+def git_blob_sha(content: bytes) -> str:
+    """
+    Compute the sha that git (and the GitHub contents API) assigns to a file.
+
+    Args:
+        content: Raw content of the file.
+
+    Returns:
+        The sha1 hex digest of the blob.
+    """
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def _pointer(*parts: Any) -> str:
+    # JSON pointer (RFC 6901) with escaped reference tokens
+    return "".join(
+        "/" + str(part).replace("~", "~0").replace("/", "~1") for part in parts
+    )
+
+
+def _changes(old: Any, new: Any, path: Tuple = ()) -> Iterator[Tuple[Tuple, Any, Any]]:
+    # Leaf changes between two values, lists are compared as a whole
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        if old != new:
+            yield path, old, new
+        return
+    for key in old:
+        if key not in new:
+            yield path + (key,), old[key], _MISSING
+        else:
+            yield from _changes(old[key], new[key], path + (key,))
+    for key in new:
+        if key not in old:
+            yield path + (key,), _MISSING, new[key]
+
+
+def _keyed(features: List[Dict[str, Any]], key: str) -> Dict[str, int]:
+    # Maps the key of each feature to its index, repeated keys are numbered
+    keyed, seen = {}, {}
+    for i, feature in enumerate(features):
+        value = str(feature["properties"].get(key))
+        seen[value] = seen.get(value, 0) + 1
+        keyed[value if seen[value] == 1 else f"{value}#{seen[value]}"] = i
+    return keyed
+
+
+@dataclass
+class FeatureDiff:
+    """Differences between two versions of a feature collection."""
+
+    # Key used to identify features, e.g., `id`
+    key: str
+    added: List[Dict[str, Any]] = field(default_factory=list)
+    removed: List[Dict[str, Any]] = field(default_factory=list)
+    # Per changed feature, the new feature and its changed fields
+    # as (JSON pointer, old value, new value)
+    changed: List[Tuple[Dict[str, Any], List[Tuple[str, Any, Any]]]] = field(
+        default_factory=list
+    )
+    # Whether features that exist in both versions changed their order
+    reordered: bool = False
+    # JSON Patch (RFC 6902) transforming the old into the new version
+    patch: List[Dict[str, Any]] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.patch)
+
+    def summary(self) -> str:
+        """
+        Summarize the diff in one line.
+
+        Returns:
+            The counts of added, removed and changed features.
+        """
+        text = (
+            f"{len(self.added)} added, {len(self.removed)} removed, "
+            f"{len(self.changed)} changed"
+        )
+        return text + (", order changed" if self.reordered else "")
+
+    def to_markdown(self, title: str) -> str:
+        """
+        Render the diff as readable summary, e.g., for a PR body.
+
+        Args:
+            title: Heading of the summary, e.g., the file name.
+
+        Returns:
+            Markdown with one table each for added, removed and changed features.
+        """
+        lines = [f"### {title}", f"**{self.summary()}**"]
+        columns = [self.key, "name", "area", "machine_status"]
+        for heading, features in [("Added", self.added), ("Removed", self.removed)]:
+            rows = [
+                [feature["properties"].get(column) for column in columns]
+                + [feature.get("problem", "")]
+                for feature in features
+            ]
+            lines += _table(heading, columns + ["problem"], rows)
+        rows = [
+            [feature["properties"].get(self.key), feature["properties"].get("name")]
+            + [path.lstrip("/"), old, new]
+            for feature, fields in self.changed
+            for path, old, new in fields
+        ]
+        lines += _table("Changed", [self.key, "name", "field", "old", "new"], rows)
+        return "\n".join(lines) + "\n"
+
+
+def _table(heading: str, columns: List[str], rows: List[List[Any]]) -> List[str]:
+    if not rows:
+        return []
+
+    def cell(value: Any) -> str:
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False)
+        return value.replace("|", "\\|").replace("\n", " ")
+
+    lines = ["", f"#### {heading}", ""]
+    lines.append("| " + " | ".join(columns) + " |")
+    lines.append("|" + "---|" * len(columns))
+    lines += ["| " + " | ".join(cell(v) for v in row) + " |" for row in rows[:MAX_ROWS]]
+    if len(rows) > MAX_ROWS:
+        lines.append(f"\n... and {len(rows) - MAX_ROWS} more")
+    return lines
+
+
+def diff_features(
+    old: Dict[str, Any], new: Dict[str, Any], key: str = "id"
+) -> FeatureDiff:
+    """
+    Compute the feature-level diff of two feature collections.
+
+    Args:
+        old: The old feature collection.
+        new: The new feature collection.
+        key: Property identifying a feature across versions. Defaults to `id`.
+
+    Returns:
+        The added, removed and changed features and a JSON Patch.
+    """
+    diff = FeatureDiff(key=key)
+    old_features, new_features = old["features"], new["features"]
+    old_keyed, new_keyed = _keyed(old_features, key), _keyed(new_features, key)
+
+    for k, j in new_keyed.items():
+        i = old_keyed.get(k)
+        if i is None:
+            continue
+        fields = []
+        for path, o, n in _changes(old_features[i], new_features[j]):
+            op = "add" if o is _MISSING else "remove" if n is _MISSING else "replace"
+            entry = {"op": op, "path": _pointer("features", i, *path)}
+            if op != "remove":
+                entry["value"] = n
+            diff.patch.append(entry)
+            fields.append(
+                (
+                    _pointer(*path),
+                    None if o is _MISSING else o,
+                    None if n is _MISSING else n,
+                )
+            )
+        if fields:
+            diff.changed.append((new_features[j], fields))
+    removed = sorted(i for k, i in old_keyed.items() if k not in new_keyed)
+    added = sorted(j for k, j in new_keyed.items() if k not in old_keyed)
+    diff.removed = [old_features[i] for i in removed]
+    diff.added = [new_features[j] for j in added]
+    # Removing from the back keeps the indices of the earlier operations valid
+    diff.patch += [
+        {"op": "remove", "path": _pointer("features", i)} for i in reversed(removed)
+    ]
+    diff.patch += [
+        {"op": "add", "path": "/features/-", "value": new_features[j]} for j in added
+    ]
+
+    # The patch appends new features, which is only correct if the remaining
+    # features keep their order and new ones are at the end
+    kept_old = [k for k in old_keyed if k in new_keyed]
+    kept_new = [k for k in new_keyed if k in old_keyed]
+    diff.reordered = kept_old != kept_new
+    if diff.reordered or added != list(range(len(kept_new), len(new_features))):
+        diff.patch = [{"op": "replace", "path": "/features", "value": new_features}]
+    for k in sorted(old.keys() | new.keys()):
+        if k == "features" or old.get(k, _MISSING) == new.get(k, _MISSING):
+            continue
+        if k in new:
+            diff.patch.append({"op": "add", "path": _pointer(k), "value": new[k]})
+        else:
+            diff.patch.append({"op": "remove", "path": _pointer(k)})
+    return diff
+
+
+class HashCache:
+    """
+    Remembers the canonical hashes of recently committed versions of the data
+    files by their git blob sha, such that an unchanged file is detected without
+    downloading the committed version.
+    """
+
+    def __init__(self, path: str, max_entries: int = MAX_CACHED_HASHES):
+        """
+        Args:
+            path: JSON file of the cache.
+            max_entries: Number of remembered hashes. Defaults to
+                MAX_CACHED_HASHES.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hashes: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.hashes = json.load(f)
+
+    def get(self, blob_sha: str) -> str:
+        """
+        Get the canonical hash of a committed file.
+
+        Args:
+            blob_sha: The git blob sha of the file.
+
+        Returns:
+            The canonical hash, or an empty string if unknown.
+        """
+        return self.hashes.get(blob_sha, "")
+
+    def set(self, blob_sha: str, content_hash: str):
+        """
+        Remember the canonical hash of a committed file and persist the cache.
+
+        Args:
+            blob_sha: The git blob sha of the file.
+            content_hash: The canonical hash of its content.
+        """
+        self.hashes.pop(blob_sha, None)
+        self.hashes[blob_sha] = content_hash
+        self.hashes = dict(list(self.hashes.items())[-self.max_entries :])
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.hashes, f, indent=4)
+        os.replace(tmp_path, self.path)
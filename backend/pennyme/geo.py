@@ -0,0 +1,326 @@
+"""Vectorised geodesic computations on machine coordinates."""
+
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+import numpy as np
+from numba import njit, prange
+
+from pennyme import io
+
+# Mean earth radius, same as in the `haversine` package
+EARTH_RADIUS_KM = 6371.0088
+EARTH_RADIUS_M = EARTH_RADIUS_KM * 1000
+# Bits per axis of the Hilbert curve, i.e., cells of about 600 x 300 meters
+HILBERT_ORDER = 16
+
+
+@njit(cache=True)
+def haversine_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """
+    Great-circle distance between two points.
+
+    Args:
+        lat1: Latitude of the first point in degrees.
+        lng1: Longitude of the first point in degrees.
+        lat2: Latitude of the second point in degrees.
+        lng2: Longitude of the second point in degrees.
+
+    Returns:
+        The distance in kilometers.
+    """
+    lat1, lng1 = np.radians(lat1), np.radians(lng1)
+    lat2, lng2 = np.radians(lat2), np.radians(lng2)
+    d = (
+        np.sin((lat2 - lat1) * 0.5) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) * 0.5) ** 2
+    )
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(d))
+
+
+@njit(cache=True)
+def distances_one_to_many(
+    lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray
+) -> np.ndarray:
+    """
+    Distances from one point to many points.
+
+    Args:
+        lat: Latitude of the point in degrees.
+        lng: Longitude of the point in degrees.
+        lats: Latitudes of the other points in degrees.
+        lngs: Longitudes of the other points in degrees.
+
+    Returns:
+        The distances in kilometers (NaN for points without coordinates).
+    """
+    out = np.empty(lats.shape[0])
+    for i in range(lats.shape[0]):
+        out[i] = haversine_distance(lat, lng, lats[i], lngs[i])
+    return out
+
+
+@njit(cache=True, parallel=True)
+def _many_to_many(lats1, lngs1, lats2, lngs2):
+    out = np.empty((lats1.shape[0], lats2.shape[0]))
+    for i in prange(lats1.shape[0]):
+        for j in range(lats2.shape[0]):
+            out[i, j] = haversine_distance(lats1[i], lngs1[i], lats2[j], lngs2[j])
+    return out
+
+
+def distances_many_to_many(
+    lats1: np.ndarray, lngs1: np.ndarray, lats2: np.ndarray, lngs2: np.ndarray
+) -> np.ndarray:
+    """
+    Pairwise distances between two sets of points.
+
+    Args:
+        lats1: Latitudes of the first points in degrees.
+        lngs1: Longitudes of the first points in degrees.
+        lats2: Latitudes of the second points in degrees.
+        lngs2: Longitudes of the second points in degrees.
+
+    Returns:
+        Matrix of shape (len(lats1), len(lats2)) with the distances in kilometers.
+    """
+    return _many_to_many(
+        *(np.asarray(x, dtype=np.float64) for x in [lats1, lngs1, lats2, lngs2])
+    )
+
+
+def k_nearest(
+    lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the closest points. Points without coordinates (NaN) are ignored.
+
+    Args:
+        lat: Latitude of the query point in degrees.
+        lng: Longitude of the query point in degrees.
+        lats: Latitudes of the candidate points in degrees.
+        lngs: Longitudes of the candidate points in degrees.
+        k: Number of points to return.
+
+    Returns:
+        Indices of the (at most) k closest points, closest first, and their
+            distances in kilometers.
+    """
+    dists = distances_one_to_many(
+        lat, lng, np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64)
+    )
+    valid = np.flatnonzero(~np.isnan(dists))
+    k = min(k, len(valid))
+    if k == 0:
+        return valid, dists[valid]
+    kth = np.partition(dists[valid], k - 1)[k - 1]
+    # All candidates up to the k-th distance, such that ties are resolved by index
+    nearest = valid[dists[valid] <= kth]
+    nearest = nearest[np.argsort(dists[nearest], kind="stable")][:k]
+    return nearest, dists[nearest]
+
+
+def within_radius(
+    lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray, radius_km: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find all points within a radius.
+
+    Args:
+        lat: Latitude of the query point in degrees.
+        lng: Longitude of the query point in degrees.
+        lats: Latitudes of the candidate points in degrees.
+        lngs: Longitudes of the candidate points in degrees.
+        radius_km: The radius in kilometers.
+
+    Returns:
+        Indices of the points within the radius, closest first, and their
+            distances in kilometers.
+    """
+    dists = distances_one_to_many(
+        lat, lng, np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64)
+    )
+    inside = np.flatnonzero(dists <= radius_km)
+    inside = inside[np.argsort(dists[inside], kind="stable")]
+    return inside, dists[inside]
+
+
+def wrap_lon(lon_deg: float) -> float:
+    """
+    Wrap a longitude to [-180, 180).
+
+    Args:
+        lon_deg: Longitude in degrees.
+
+    Returns:
+        The wrapped longitude.
+    """
+    return ((lon_deg + 180.0) % 360.0) - 180.0
+
+
+def clamp_lat(lat_deg: float) -> float:
+    """
+    Clamp a latitude to [-90, 90].
+
+    Args:
+        lat_deg: Latitude in degrees.
+
+    Returns:
+        The clamped latitude.
+    """
+    return float(np.clip(lat_deg, -90.0, 90.0))
+
+
+def jitter_lonlats(
+    lon: float,
+    lat: float,
+    n: int,
+    radius_m: float = 20.0,
+    rng: Optional[Union[int, np.random.Generator]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sample n positions uniformly within a radius around a point, e.g., to place
+    several machines at one location next to each other.
+
+    Args:
+        lon: Longitude in degrees.
+        lat: Latitude in degrees.
+        n: Number of positions.
+        radius_m: Maximal displacement in meters. Defaults to 20.
+        rng: Seed or generator for reproducible positions, all positions are drawn
+            from it at once. Defaults to None.
+
+    Returns:
+        The longitudes and latitudes of the positions.
+    """
+    rng = np.random.default_rng(rng)
+
+    theta = rng.uniform(0.0, 2 * np.pi, n)
+    r = radius_m * np.sqrt(rng.uniform(0.0, 1.0, n))
+
+    dx = r * np.cos(theta)  # meters east
+    dy = r * np.sin(theta)  # meters north
+
+    dlat = (dy / EARTH_RADIUS_M) * (180.0 / np.pi)
+    # Guard against cos(lat)=0 near poles
+    coslat = np.cos(np.deg2rad(lat))
+    if abs(coslat) < 1e-12:
+        dlon = np.zeros(n)
+    else:
+        dlon = (dx / (EARTH_RADIUS_M * coslat)) * (180.0 / np.pi)
+
+    lons = ((lon + dlon + 180.0) % 360.0) - 180.0
+    lats = np.clip(lat + dlat, -90.0, 90.0)
+    return lons, lats
+
+
+def jitter_lonlat(
+    lon: float,
+    lat: float,
+    radius_m: float = 20.0,
+    rng: Optional[Union[int, np.random.Generator]] = None,
+) -> Tuple[float, float]:
+    """
+    Move a point to a uniformly sampled position within a radius, see
+    `jitter_lonlats` for several positions.
+
+    Args:
+        lon: Longitude in degrees.
+        lat: Latitude in degrees.
+        radius_m: Maximal displacement in meters. Defaults to 20.
+        rng: Seed or generator for reproducible positions. Defaults to None.
+
+    Returns:
+        The jittered longitude and latitude.
+    """
+    lons, lats = jitter_lonlats(lon, lat, 1, radius_m=radius_m, rng=rng)
+    return float(lons[0]), float(lats[0])
+
+
+@njit(cache=True)
+def hilbert_key(lng: float, lat: float, order: int = HILBERT_ORDER) -> int:
+    """
+    Position of a point along a Hilbert curve over the longitude/latitude grid.
+    Points with close keys are close on the map, unlike points with close
+    latitudes.
+
+    Args:
+        lng: Longitude in degrees.
+        lat: Latitude in degrees.
+        order: Bits per axis, the grid has 2**order x 2**order cells. Defaults to
+            HILBERT_ORDER.
+
+    Returns:
+        The index of the grid cell of the point along the curve, 0 for points
+            without coordinates (NaN).
+    """
+    if np.isnan(lng) or np.isnan(lat):
+        return 0
+    n = 1 << order
+    x = min(max(int((lng + 180.0) / 360.0 * n), 0), n - 1)
+    y = min(max(int((lat + 90.0) / 180.0 * n), 0), n - 1)
+    key = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        key += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant such that the curve is continuous
+        if ry == 0:
+            if rx == 1:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return key
+
+
+@njit(cache=True)
+def hilbert_keys(
+    lngs: np.ndarray, lats: np.ndarray, order: int = HILBERT_ORDER
+) -> np.ndarray:
+    """
+    Hilbert keys of many points, see `hilbert_key`.
+
+    Args:
+        lngs: Longitudes in degrees.
+        lats: Latitudes in degrees.
+        order: Bits per axis of the grid. Defaults to HILBERT_ORDER.
+
+    Returns:
+        The keys.
+    """
+    out = np.empty(lngs.shape[0], dtype=np.int64)
+    for i in range(lngs.shape[0]):
+        out[i] = hilbert_key(lngs[i], lats[i], order)
+    return out
+
+
+def feature_key(feature: Dict[str, Any]) -> int:
+    """
+    Hilbert key of a feature, the sort key of the data files.
+
+    Args:
+        feature: The feature.
+
+    Returns:
+        The key of its coordinates.
+    """
+    lng, lat = feature["geometry"]["coordinates"]
+    return hilbert_key(float(lng), float(lat))
+
+
+def spatially_sorted(
+    features: Iterable[Dict[str, Any]],
+) -> Iterator[Dict[str, Any]]:
+    """
+    Order features along the Hilbert curve, the layout of the data files. Ranges
+    of the file then cover compact regions, such that regional edits touch few
+    ranges. Machines in the same cell keep their order.
+
+    Args:
+        features: The features.
+
+    Yields:
+        The features in order of their key, see `io.sort_features`.
+    """
+    return io.sort_features(features, key=feature_key)
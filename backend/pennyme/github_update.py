@@ -5,10 +5,10 @@ import time
 from typing import Any, Dict, List, Optional, Tuple
 
 import pandas as pd
-import requests
 from loguru import logger
 
-from pennyme.slack import message_slack_raw
+from pennyme import http_client, io
+from pennyme.slack import MACHINE_NAMES, message_slack_raw
 from pennyme.utils import find_machine_in_database, get_next_free_machine_id
 
 with open("github_token.json", "r") as infile:
@@ -47,7 +47,7 @@ def check_branch_exists(branch_name: str) -> bool:
     branch_check_url = (
         f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/branches/{branch_name}"
     )
-    branch_check_response = requests.get(branch_check_url, headers=HEADERS)
+    branch_check_response = http_client.get(branch_check_url, headers=HEADERS)
     return branch_check_response.status_code == 200
 
 
@@ -95,7 +95,7 @@ def create_new_branch(branch_name: str, headers: Dict[str, Any] = HEADERS) -> bo
             "ref": f"refs/heads/{branch_name}",
             "sha": get_latest_commit_sha(BASE_BRANCH),
         }
-        response = requests.post(
+        response = http_client.post(
             f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/git/refs",
             headers=headers,
             json=payload,
@@ -134,11 +134,49 @@ def get_latest_commit_time(
     else:
         url = url_base + branch
 
-    response = requests.get(url, headers=HEADERS)
+    response = http_client.get(url, headers=HEADERS)
     date_last_updated = response.json()["commit"]["author"]["date"]
     return pd.to_datetime(date_last_updated)
 
 
+def load_latest_file_info(
+    headers: Dict[str, Any] = HEADERS, file: str = FILE_PATH
+) -> Dict[str, Any]:
+    """
+    Load the metadata of the latest version of a file from the github repository,
+    as returned by the contents API. Large files are not included and have to be
+    downloaded, see `decode_json_content`.
+
+    Args:
+        headers: Headers for the request.
+        file: Path to the file to load, e.g.,  `/data/server_locations.json`.
+
+    Returns:
+        The response of the contents API, incl. the blob `sha` of the file.
+    """
+    file_url = get_latest_branch_url(file=file)
+    response = http_client.get(file_url, headers=headers)
+    return response.json()
+
+
+def decode_json_content(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Get the content of a json file from the response of the contents API.
+
+    Args:
+        data: The response, see `load_latest_file_info`.
+
+    Returns:
+        The json file as a dictionary.
+    """
+    if data["encoding"] == "base64":
+        content = io.loads(base64.b64decode(data["content"]))
+    else:
+        response = http_client.get(data["download_url"])
+        content = io.loads(response.content)
+    return content
+
+
 def load_latest_json(
     headers: Dict[str, Any] = HEADERS, file: str = FILE_PATH
 ) -> Tuple[Dict[str, Any], str]:
@@ -156,20 +194,22 @@ def load_latest_json(
     """
 
     # Load latest version of the file
-    file_url = get_latest_branch_url(file=file)
-    response = requests.get(file_url, headers=headers)
-    data = response.json()
+    data = load_latest_file_info(headers=headers, file=file)
+    # the sha of the last commit is needed later for pushing
+    return decode_json_content(data), data["sha"]
 
-    if data["encoding"] == "base64":
-        current_content_decoded = base64.b64decode(data["content"]).decode("utf-8")
-        content = json.loads(current_content_decoded)
-    else:
-        response = requests.get(data["download_url"])
-        content = response.json()
 
-    # the sha of the last commit is needed later for pushing
-    latest_commit_sha = data["sha"]
-    return content, latest_commit_sha
+def encode_json_file(content: Dict[str, Any]) -> bytes:
+    """
+    Serialize a json file like it is stored in the repository.
+
+    Args:
+        content: The json file as a dictionary.
+
+    Returns:
+        The raw content of the file.
+    """
+    return io.dumps(content)
 
 
 def push_newmachine_to_github(
@@ -199,14 +239,15 @@ def push_newmachine_to_github(
     machine_name = machine_update_entry["properties"]["name"]
     commit_message = f"add new machine {machine_id} named {machine_name}"
 
-    commit_json_file(
+    if commit_json_file(
         server_locations,
         branch_name,
         commit_message,
         latest_commit_sha,
         body=f"New machine {machine_id} named {machine_name} submitted.",
         reviewer=TOKEN_TO_REVIEWER[HEADERS["Authorization"]],
-    )
+    ):
+        MACHINE_NAMES.update(machine_update_entry)
 
     return machine_id
 
@@ -290,14 +331,15 @@ def process_machine_change(
 
         # push to github
         commit_message = f'Change {machine_id} "{title}"' + change_message[:-1]
-        commit_json_file(
+        if commit_json_file(
             server_locations,
             DATA_BRANCH,
             commit_message.replace("\n", "\t"),
             latest_commit_sha,
             body=commit_message,
             post_comment=False,
-        )
+        ):
+            MACHINE_NAMES.update(updated_machine_entry)
 
     except Exception as e:
         message_slack_raw(
@@ -315,7 +357,7 @@ def commit_json_file(
     body: str = "Machine updates submitted for review",
     reviewer: Optional[str] = None,
     post_comment: bool = True,
-):
+) -> bool:
     """
     Commit the server locations dictionary to a branch with the desired
         commit message.
@@ -330,15 +372,18 @@ def commit_json_file(
         body: Content for commit message. Defaults to "Machine updates submitted for review".
         reviewer: GitHub username of the reviewer. Defaults to None.
         post_comment: Whether to post a comment to the existing PR. Defaults to True.
+
+    Returns:
+        Whether the file was committed.
     """
 
     # create a new branch if necessary
     did_create_new_branch = create_new_branch(branch_name, headers=headers)
 
     # Update the file on the newly created branch
-    file_content_encoded = base64.b64encode(
-        json.dumps(server_locations, indent=4, ensure_ascii=False).encode("utf-8")
-    ).decode("utf-8")
+    file_content_encoded = base64.b64encode(encode_json_file(server_locations)).decode(
+        "utf-8"
+    )
 
     payload = {
         "message": commit_message,
@@ -346,7 +391,8 @@ def commit_json_file(
         "branch": branch_name,
         "sha": latest_commit_sha,
     }
-    response = requests.put(
+    # Conditional on the sha, hence not retried (a retry of a landed commit is a 409)
+    response = http_client.put(
         f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/contents{file_path}",
         headers=headers,
         json=payload,
@@ -356,7 +402,7 @@ def commit_json_file(
         logger.error(
             f"Failed to update file with code {response.status_code}: {response.json()}"
         )
-        return
+        return False
 
     pr_id = get_pr_id(branch_name=branch_name)
     if pr_id and did_create_new_branch:
@@ -379,6 +425,7 @@ def commit_json_file(
         open_pull_request(
             commit_message, branch_name, body=body, reviewer=reviewer, headers=headers
         )
+    return True
 
 
 def request_review(
@@ -392,7 +439,7 @@ def request_review(
         reviewer: GitHub username of the reviewer.
         headers: Headers for the request.
     """
-    response = requests.post(
+    response = http_client.post(
         f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/pulls/{pr_id}/requested_reviewers",
         headers=headers,
         json={"reviewers": [reviewer]},
@@ -415,7 +462,7 @@ def add_pr_label(pr_id: int, labels: List[str], headers: Dict[str, Any] = HEADER
         headers: Headers for the request.
     """
     url = f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/issues/{pr_id}/labels"
-    response = requests.post(url, headers=headers, json={"labels": labels})
+    response = http_client.post(url, headers=headers, json={"labels": labels})
     if response.status_code == 200:
         logger.info("Labels added successfully.")
     else:
@@ -451,7 +498,7 @@ def open_pull_request(
         "head": branch_name,
         "base": BASE_BRANCH,
     }
-    response = requests.post(
+    response = http_client.post(
         f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/pulls",
         headers=headers,
         json=payload,
@@ -483,7 +530,7 @@ def get_latest_commit_sha(
         The sha of the latest commit.
     """
 
-    response = requests.get(
+    response = http_client.get(
         f"https://api.github.com/repos/{owner}/{repo}/git/refs/heads/{branch}"
     )
     return response.json()["object"]["sha"]
@@ -513,7 +560,7 @@ def post_comment_to_pr(
     payload = {
         "body": comment,
     }
-    response = requests.post(
+    response = http_client.post(
         f"https://api.github.com/repos/{owner}/{repo}/issues/{pr_id}/comments",
         headers=headers,
         json=payload,
@@ -540,7 +587,7 @@ def get_pr_id(
         The id of the pull request if it exists, None otherwise.
     """
     # Get all open PRs
-    response = requests.get(
+    response = http_client.get(
         f"https://api.github.com/repos/{owner}/{repo}/pulls",
         headers=headers,
     )
@@ -0,0 +1,298 @@
+"""Shared HTTP client with pooled sessions, timeouts, retries and per-host limits."""
+
+import random
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5, 30)
+MAX_RETRIES = 3
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Requests that only apply to a known version of the resource, e.g., GitHub content
+# updates with the blob `sha`. A repeated request fails once the first succeeded.
+CONDITIONAL_HEADERS = {"if-match", "if-unmodified-since"}
+CONDITIONAL_JSON_KEYS = {"sha"}
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+
+@dataclass
+class HostPolicy:
+    """Limits for the requests to one host."""
+
+    # Maximal number of concurrent requests
+    max_concurrency: int = 8
+    # Minimal time (seconds) between the starts of two requests
+    delay: float = 0.0
+
+
+# Policies apply to the domain and its subdomains. The differ scrapes
+# pennycollector.com thousands of times, so be polite.
+HOST_POLICIES = {
+    "pennycollector.com": HostPolicy(max_concurrency=4, delay=0.1),
+    "elongated-coin.de": HostPolicy(max_concurrency=2, delay=0.5),
+    "api.github.com": HostPolicy(max_concurrency=4),
+}
+
+
+@dataclass
+class HostStats:
+    """Request counts and latency histogram of one host."""
+
+    requests: int = 0
+    retries: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    # One count per bucket in LATENCY_BUCKETS plus one for slower requests
+    histogram: List[int] = field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1)
+    )
+
+    def record(self, latency: float):
+        self.requests += 1
+        self.total_time += latency
+        self.histogram[bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        labels = [f"<={b}s" for b in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": self.errors,
+            "mean_latency": self.total_time / self.requests if self.requests else 0.0,
+            "histogram": dict(zip(labels, self.histogram)),
+        }
+
+
+class HttpClient:
+    """
+    HTTP client that keeps one pooled session per host, such that connections are
+    reused. Idempotent requests are retried with jittered exponential backoff on
+    connection errors and on 429/5xx responses. Conditional requests are not
+    idempotent, see `is_conditional`.
+    """
+
+    def __init__(
+        self,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        max_retries: int = MAX_RETRIES,
+        policies: Optional[Dict[str, HostPolicy]] = None,
+        host_overrides: Optional[Dict[str, str]] = None,
+    ):
+        """
+        Args:
+            timeout: Default (connect, read) timeout. Defaults to DEFAULT_TIMEOUT.
+            max_retries: Retries per request. Defaults to MAX_RETRIES.
+            policies: Limits per host. Defaults to HOST_POLICIES.
+            host_overrides: Base URLs to which the requests to a host are sent
+                instead, e.g., local stand-ins of external services. Defaults to
+                None.
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.policies = HOST_POLICIES if policies is None else policies
+        self.host_overrides = host_overrides or {}
+        self._sessions: Dict[str, requests.Session] = {}
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._next_start: Dict[str, float] = {}
+        self._stats: Dict[str, HostStats] = {}
+        self._lock = threading.Lock()
+
+    def _policy(self, host: str) -> HostPolicy:
+        hostname = host.split(":")[0]
+        for domain, policy in self.policies.items():
+            if hostname == domain or hostname.endswith("." + domain):
+                return policy
+        return HostPolicy()
+
+    def _session(self, host: str) -> requests.Session:
+        with self._lock:
+            if host not in self._sessions:
+                pool_size = self._policy(host).max_concurrency
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+                self._semaphores[host] = threading.BoundedSemaphore(pool_size)
+                self._stats[host] = HostStats()
+            return self._sessions[host]
+
+    def _wait_for_slot(self, host: str):
+        # Reserve the next start time under the lock, then sleep outside of it
+        delay = self._policy(host).delay
+        if delay <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, 0.0))
+            self._next_start[host] = start + delay
+        if start > now:
+            time.sleep(start - now)
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        if response is not None and "Retry-After" in response.headers:
+            try:
+                return min(float(response.headers["Retry-After"]), BACKOFF_CAP)
+            except ValueError:
+                pass
+        # Full jitter avoids that parallel clients retry in lockstep
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        timeout: Optional[Union[float, Tuple[float, float]]] = None,
+        retries: Optional[int] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """
+        Send a request.
+
+        Args:
+            method: HTTP method, e.g., `GET`.
+            url: The URL.
+            timeout: Timeout of the request. Defaults to the client's timeout.
+            retries: Number of retries. Defaults to the client's max_retries, but
+                non-idempotent requests (e.g., POST or a PUT conditional on the
+                version of a resource) are only retried on 429.
+            **kwargs: Passed to `requests.Session.request`.
+
+        Raises:
+            requests.exceptions.RequestException: If the request failed after all
+                retries.
+
+        Returns:
+            The response.
+        """
+        method = method.upper()
+        parts = urlsplit(url)
+        host = parts.netloc
+        if host in self.host_overrides:
+            # Limits and statistics still apply to the original host
+            url = self.host_overrides[host] + urlunsplit(
+                ("", "", parts.path, parts.query, parts.fragment)
+            )
+        session = self._session(host)
+        stats = self._stats[host]
+        retries = self.max_retries if retries is None else retries
+        idempotent = method in IDEMPOTENT_METHODS and not is_conditional(kwargs)
+
+        for attempt in range(retries + 1):
+            response, error = None, None
+            with self._semaphores[host]:
+                self._wait_for_slot(host)
+                start = time.perf_counter()
+                try:
+                    response = session.request(
+                        method, url, timeout=timeout or self.timeout, **kwargs
+                    )
+                except (
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                ) as e:
+                    error = e
+                latency = time.perf_counter() - start
+            with self._lock:
+                stats.record(latency)
+                if error is not None:
+                    stats.errors += 1
+
+            if attempt == retries:
+                break
+            if error is not None and not idempotent:
+                break
+            if response is not None and (
+                response.status_code not in RETRY_STATUS_CODES
+                or (not idempotent and response.status_code != 429)
+            ):
+                break
+            with self._lock:
+                stats.retries += 1
+            backoff = self._backoff(attempt, response)
+            reason = error or f"status {response.status_code}"
+            logger.debug(f"Retrying {method} {url} in {backoff:.1f}s ({reason})")
+            time.sleep(backoff)
+
+        if error is not None:
+            raise error
+        return response
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the request statistics.
+
+        Returns:
+            Dictionary mapping hosts to request counts and latency histograms.
+        """
+        with self._lock:
+            return {host: stats.to_dict() for host, stats in self._stats.items()}
+
+    def log_stats(self):
+        """Log request counts and latency histograms per host."""
+        for host, stats in self.stats().items():
+            histogram = ", ".join(
+                f"{bucket}: {count}"
+                for bucket, count in stats["histogram"].items()
+                if count
+            )
+            logger.info(
+                f"HTTP {host}: {stats['requests']} requests, {stats['retries']} "
+                f"retries, {stats['errors']} errors, mean latency "
+                f"{stats['mean_latency']:.3f}s ({histogram})"
+            )
+
+
+def is_conditional(kwargs: Dict[str, Any]) -> bool:
+    """
+    Check whether a request only applies to a known version of the resource. If
+    such a request succeeded but its response was lost, a retry fails (e.g., with
+    409), hence it is not retried.
+
+    Args:
+        kwargs: Keyword arguments of the request, see `HttpClient.request`.
+
+    Returns:
+        Whether the request has a precondition header or a JSON body with a
+            version, like the `sha` of GitHub content updates.
+    """
+    headers = kwargs.get("headers") or {}
+    if any(key.lower() in CONDITIONAL_HEADERS for key in headers):
+        return True
+    payload = kwargs.get("json")
+    return isinstance(payload, dict) and not CONDITIONAL_JSON_KEYS.isdisjoint(payload)
+
+
+CLIENT = HttpClient()
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """Send a GET request with the shared client, see `HttpClient.request`."""
+    return CLIENT.request("GET", url, **kwargs)
+
+
+def head(url: str, **kwargs) -> requests.Response:
+    """Send a HEAD request with the shared client, see `HttpClient.request`."""
+    return CLIENT.request("HEAD", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """Send a POST request with the shared client, see `HttpClient.request`."""
+    return CLIENT.request("POST", url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    """Send a PUT request with the shared client, see `HttpClient.request`."""
+    return CLIENT.request("PUT", url, **kwargs)
@@ -0,0 +1,284 @@
+"""Utils to serve machine and coin images and to track their changes for syncing."""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+PATH_IMAGES = os.path.join("..", "..", "images")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+# One year, the maximum that is commonly honoured by browsers and proxies
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Route of the images in app.py
+IMAGE_ROUTE = "/images/"
+
+# Maps absolute path to (mtime_ns, size, sha256 hexdigest)
+_HASH_CACHE: Dict[str, Tuple[int, int, str]] = {}
+
+
+def content_hash(path: str) -> str:
+    """
+    Compute the sha256 hash of a file. The digest is cached per path and only
+    recomputed if the modification time or the size of the file changed.
+
+    Args:
+        path: Path to the file.
+
+    Returns:
+        The hex digest of the file content.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    cached = _HASH_CACHE.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    _HASH_CACHE[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def url_version(digest: str) -> str:
+    """
+    Shorten a content hash to the version tag used in hashed image URLs.
+
+    Args:
+        digest: The sha256 hex digest of the image.
+
+    Returns:
+        The version tag, i.e., the first 16 characters of the digest.
+    """
+    return digest[:16]
+
+
+def versioned_url(filename: str, digest: str, prefix: str = IMAGE_ROUTE) -> str:
+    """
+    Build the URL of an image version, which can be cached forever by clients.
+
+    Args:
+        filename: Name of the image file, e.g., `123_coin_0.png`.
+        digest: The sha256 hex digest of the image.
+        prefix: URL prefix of the image route. Defaults to IMAGE_ROUTE, i.e., a
+            URL relative to the server.
+
+    Returns:
+        The hashed URL of the image.
+    """
+    return f"{prefix}{filename}?v={url_version(digest)}"
+
+
+def hashed_image_url(
+    filename: str, prefix: str = IMAGE_ROUTE, images_dir: str = PATH_IMAGES
+) -> str:
+    """
+    Build a URL for an image that changes whenever the image content changes.
+    Such URLs can be cached forever by clients.
+
+    Args:
+        filename: Name of the image file, e.g., `123_coin_0.png`.
+        prefix: URL prefix of the image route, e.g., `http://host/images/`.
+            Defaults to IMAGE_ROUTE.
+        images_dir: Directory with the images. Defaults to PATH_IMAGES.
+
+    Raises:
+        FileNotFoundError: If the image does not exist.
+
+    Returns:
+        The hashed URL of the image.
+    """
+    digest = content_hash(os.path.join(images_dir, filename))
+    return versioned_url(filename, digest, prefix)
+
+
+def is_image_file(filename: str) -> bool:
+    """
+    Check whether a filename refers to a servable image.
+
+    Args:
+        filename: Name of the file.
+
+    Returns:
+        True if the file has one of the image extensions, False otherwise.
+    """
+    return os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+
+# ------------------------------------------------------------------
+# Image sync manifest
+# ------------------------------------------------------------------
+# The manifest lists every image with its content hash and is sharded by machine
+# ID range. Each change bumps a global revision which serves as `since` cursor.
+MANIFEST_DIR = os.path.join(PATH_IMAGES, "manifest")
+SHARD_SIZE = 1000
+IMAGE_NAME_PATTERN = re.compile(
+    r"^(?P<id>\d+)(?:_(?P<coin>coin_\d+))?(?P<derivative>_thumb)?"
+    r"\.(?:jpg|jpeg|png|webp)$",
+    re.IGNORECASE,
+)
+_MANIFEST_LOCK = threading.Lock()
+
+
+def parse_image_name(filename: str) -> Optional[Tuple[int, str]]:
+    """
+    Extract machine ID and rendition from an image filename.
+
+    Args:
+        filename: Name of the image, e.g., `123.jpg`, `123_coin_0.png` or
+            `123_thumb.jpg`.
+
+    Returns:
+        Tuple of machine ID and rendition (`machine` or `coin_<idx>`, with suffix
+            `_thumb` for thumbnails), or None if the file is not a (permanent)
+            machine or coin image.
+    """
+    match = IMAGE_NAME_PATTERN.match(filename)
+    if match is None:
+        return None
+    rendition = (match.group("coin") or "machine") + (match.group("derivative") or "")
+    return int(match.group("id")), rendition
+
+
+def _shard_path(machine_id: int, manifest_dir: str) -> str:
+    start = (machine_id // SHARD_SIZE) * SHARD_SIZE
+    return os.path.join(manifest_dir, f"shard_{start}_{start + SHARD_SIZE - 1}.json")
+
+
+def _read_json(path: str, default: Dict[str, Any]) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return default
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_json(path: str, content: Dict[str, Any]):
+    # Write to a temporary file first such that readers never see partial files
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(content, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def update_manifest(
+    filenames: Iterable[str],
+    images_dir: str = PATH_IMAGES,
+    manifest_dir: str = MANIFEST_DIR,
+) -> int:
+    """
+    Incrementally update the manifest for the given images. New or modified images
+    get a new revision, deleted images are kept as tombstones (`hash` is None) such
+    that clients learn about the deletion.
+
+    Args:
+        filenames: Names of the images that (potentially) changed.
+        images_dir: Directory with the images. Defaults to PATH_IMAGES.
+        manifest_dir: Directory with the manifest shards. Defaults to MANIFEST_DIR.
+
+    Returns:
+        The current revision of the manifest.
+    """
+    with _MANIFEST_LOCK:
+        os.makedirs(manifest_dir, exist_ok=True)
+        revision_path = os.path.join(manifest_dir, "revision.json")
+        revision = _read_json(revision_path, {"revision": 0})["revision"]
+
+        shards: Dict[str, Dict[str, Any]] = {}
+        for filename in filenames:
+            parsed = parse_image_name(os.path.basename(filename))
+            if parsed is None:
+                continue
+            machine_id, rendition = parsed
+            filename = os.path.basename(filename)
+            shard_path = _shard_path(machine_id, manifest_dir)
+            if shard_path not in shards:
+                shards[shard_path] = _read_json(shard_path, {"images": {}})
+            entries = shards[shard_path]["images"]
+
+            img_path = os.path.join(images_dir, filename)
+            if os.path.isfile(img_path):
+                digest = content_hash(img_path)
+                mtime = int(os.path.getmtime(img_path))
+            elif filename in entries:
+                digest, mtime = None, int(time.time())
+            else:
+                continue
+
+            if filename in entries and entries[filename]["hash"] == digest:
+                continue
+            revision += 1
+            entries[filename] = {
+                "id": machine_id,
+                "rendition": rendition,
+                "hash": digest,
+                "mtime": mtime,
+                "revision": revision,
+            }
+            shards[shard_path]["revision"] = revision
+
+        for shard_path, shard in shards.items():
+            _write_json(shard_path, shard)
+        _write_json(revision_path, {"revision": revision})
+    return revision
+
+
+def build_manifest(
+    images_dir: str = PATH_IMAGES, manifest_dir: str = MANIFEST_DIR
+) -> int:
+    """
+    Generate the manifest from scratch or bring it up to date with the images
+    directory, e.g., after images were changed outside of the upload pipeline.
+
+    Args:
+        images_dir: Directory with the images. Defaults to PATH_IMAGES.
+        manifest_dir: Directory with the manifest shards. Defaults to MANIFEST_DIR.
+
+    Returns:
+        The current revision of the manifest.
+    """
+    filenames = set(os.listdir(images_dir))
+    if os.path.isdir(manifest_dir):
+        # Include known images to create tombstones for deleted files
+        for shard_name in os.listdir(manifest_dir):
+            if shard_name.startswith("shard_") and shard_name.endswith(".json"):
+                shard = _read_json(os.path.join(manifest_dir, shard_name), {})
+                filenames.update(shard.get("images", {}).keys())
+    return update_manifest(sorted(filenames), images_dir, manifest_dir)
+
+
+def manifest_since(since: int = 0, manifest_dir: str = MANIFEST_DIR) -> Dict[str, Any]:
+    """
+    Collect all manifest entries that changed after a given revision.
+
+    Args:
+        since: Revision (cursor) of the last sync of the client. Defaults to 0,
+            i.e., a full sync.
+        manifest_dir: Directory with the manifest shards. Defaults to MANIFEST_DIR.
+
+    Returns:
+        Dictionary with the new `cursor` and the changed `images`, sorted by
+            revision. Images carry their hashed `url`, relative to the server.
+            Deleted images have `hash` and `url` None.
+    """
+    revision_path = os.path.join(manifest_dir, "revision.json")
+    revision = _read_json(revision_path, {"revision": 0})["revision"]
+    images = []
+    if since < revision and os.path.isdir(manifest_dir):
+        for shard_name in sorted(os.listdir(manifest_dir)):
+            if not (shard_name.startswith("shard_") and shard_name.endswith(".json")):
+                continue
+            shard = _read_json(os.path.join(manifest_dir, shard_name), {})
+            # Shards remember their latest revision, so untouched shards are skipped
+            if shard.get("revision", 0) <= since:
+                continue
+            for filename, entry in shard["images"].items():
+                if entry["revision"] > since:
+                    url = entry["hash"] and versioned_url(filename, entry["hash"])
+                    images.append({"file": filename, **entry, "url": url})
+    images.sort(key=lambda entry: entry["revision"])
+    return {"cursor": revision, "images": images}
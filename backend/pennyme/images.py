@@ -1,8 +1,30 @@
-from typing import Final
+import io
+import json
+import os
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Final, List, Optional, Tuple
 
 import cv2
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps
+from rembg import new_session, remove
+
+# Width of the thumbnails that are derived from every machine and coin image
+THUMBNAIL_WIDTH = 250
+THUMBNAIL_SUFFIX = "_thumb"
+
+# Byte budget per rendition. Lossy formats search the highest quality that fits.
+BYTE_BUDGETS = {"machine": 200_000, "coin": 150_000, "thumb": 20_000}
+MIN_QUALITY = 50
+MAX_QUALITY = 95
+# Encoder statistics of all images are appended to this file, to tune the budgets.
+# Not inside the images folder since that one is served publicly
+PATH_ENCODE_STATS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "encode_stats.jsonl"
+)
+EXIF_ORIENTATION = 0x0112
 
 
 def count_foreground_objects(
@@ -205,3 +227,195 @@ def is_coin(
         print("Max ellipse error failed:", max_error)
 
     return aspect_ok and mean_err_ok and max_err_ok
+
+
+def _save_kwargs(img: Image.Image, fmt: str) -> Dict[str, Any]:
+    """Encoder options shared by all quality levels of one image."""
+    kwargs: Dict[str, Any] = {"format": fmt}
+    if img.info.get("icc_profile"):
+        kwargs["icc_profile"] = img.info["icc_profile"]
+    # Drop all EXIF data (GPS, camera, ...) except for the orientation
+    orientation = img.getexif().get(EXIF_ORIENTATION)
+    if orientation not in (None, 1):
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+        kwargs["exif"] = exif
+    if fmt == "JPEG":
+        kwargs.update(progressive=True, optimize=True)
+    elif fmt == "WEBP":
+        kwargs["method"] = 6
+    elif fmt == "PNG":
+        kwargs["optimize"] = True
+    return kwargs
+
+
+def encode_image(
+    img: Image.Image,
+    output_path: str,
+    budget: int,
+    min_quality: int = MIN_QUALITY,
+    max_quality: int = MAX_QUALITY,
+    stats_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Save an image with the highest quality that stays within a byte budget.
+    JPEG is written progressive and WebP with the slowest (best) method. The
+    quality is found by binary search; if even `min_quality` exceeds the budget,
+    `min_quality` is used. PNG is lossless, so it is only optimized.
+    All EXIF data except the orientation is stripped.
+
+    Args:
+        img: The image to save.
+        output_path: Where to save the image, the extension decides the format.
+        budget: Maximal number of bytes of the encoded image.
+        min_quality: Lowest acceptable quality. Defaults to MIN_QUALITY.
+        max_quality: Highest quality to use. Defaults to MAX_QUALITY.
+        stats_path: File to append the encoder statistics to. Defaults to
+            PATH_ENCODE_STATS.
+
+    Returns:
+        The encoder statistics (quality, bytes, timing, ...).
+    """
+    start = time.perf_counter()
+    ext = os.path.splitext(output_path)[1].lower()
+    fmt = {".jpg": "JPEG", ".jpeg": "JPEG", ".webp": "WEBP", ".png": "PNG"}[ext]
+    if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    kwargs = _save_kwargs(img, fmt)
+
+    def encode(quality: Optional[int]) -> bytes:
+        buffer = io.BytesIO()
+        if quality is None:
+            img.save(buffer, **kwargs)
+        else:
+            img.save(buffer, quality=quality, **kwargs)
+        return buffer.getvalue()
+
+    attempts = 1
+    if fmt == "PNG":
+        quality, data = None, encode(None)
+    else:
+        quality, data = max_quality, encode(max_quality)
+        low, high = min_quality, max_quality - 1
+        best = None
+        while len(data) > budget and low <= high:
+            # Search the highest quality within the budget
+            mid = (low + high) // 2
+            candidate = encode(mid)
+            attempts += 1
+            if len(candidate) <= budget:
+                best = (mid, candidate)
+                low = mid + 1
+            else:
+                high = mid - 1
+        if len(data) > budget:
+            quality, data = (
+                best if best is not None else (min_quality, encode(min_quality))
+            )
+
+    with open(output_path, "wb") as f:
+        f.write(data)
+
+    stats = {
+        "file": os.path.basename(output_path),
+        "time": time.time(),
+        "format": fmt,
+        "width": img.size[0],
+        "height": img.size[1],
+        "budget": budget,
+        "quality": quality,
+        "bytes": len(data),
+        "attempts": attempts,
+        "seconds": round(time.perf_counter() - start, 4),
+    }
+    stats_path = stats_path or PATH_ENCODE_STATS
+    os.makedirs(os.path.dirname(os.path.abspath(stats_path)), exist_ok=True)
+    with open(stats_path, "a") as f:
+        f.write(json.dumps(stats) + "\n")
+    return stats
+
+
+@lru_cache(maxsize=1)
+def get_rembg_session():
+    """Create the background removal session once per process, it is expensive."""
+    return new_session("u2netp")
+
+
+def process_uploaded_image(
+    img_path: str,
+    basewidth: int = 1000,
+    min_area: int = 2000,
+) -> Tuple[int, str, str]:
+    """
+    Optimizes an image for size/quality and re-saves it to the server.
+
+    Args:
+        img_path: The path to save the image to.
+        basewidth: width of rescaled image, defaults to 1000. Used to be 400.
+        min_area: minimal pixel count for a connected-area to be counted in coin
+            foreground separation.
+
+    Returns:
+        String with success message
+    """
+    img = ImageOps.exif_transpose(Image.open(img_path))
+    wpercent = basewidth / float(img.size[0])
+    if wpercent <= 1:
+        hsize = int((float(img.size[1]) * float(wpercent)))
+        img = img.resize((basewidth, hsize), Image.Resampling.LANCZOS)
+
+    # If image is a coin, apply background separation and always save as PNG.
+    output_path = img_path
+    if "coin" in img_path:
+        img = remove(img, session=get_rembg_session())
+        # Coin images are saved as PNG to support transparency
+        in_path = Path(img_path)
+        out_path = in_path.with_suffix(".png")
+        output_path = str(out_path)
+
+        # Return error if more than one connected comp
+        m = (np.array(img)[:, :, 3] > 15).astype(np.uint8)
+        n, _, s, _ = cv2.connectedComponentsWithStats(m, 8)
+        keep = np.where(s[1:, 4] >= min_area)[0] + 1
+
+        if keep.size == 0:
+            return 422, "No foreground object found", img_path
+        if keep.size > 1:
+            return 409, f"Multiple foreground objects found ({keep.size})", img_path
+
+        # Crop coin out of the image
+        x, y, w, h = map(int, s[int(keep[0]), :4])
+        pad = 20
+
+        img = img.crop((max(0, x - pad), max(0, y - pad), x + w + pad, y + h + pad))
+        encode_image(img, output_path, BYTE_BUDGETS["coin"])
+        # delete original image if we wrote to a different path
+        if out_path != in_path:
+            in_path.unlink()
+        return 200, "OK", output_path
+
+    encode_image(img, output_path, BYTE_BUDGETS["machine"])
+    return 200, "OK", output_path
+
+
+def make_derivatives(img_path: str, width: int = THUMBNAIL_WIDTH) -> List[str]:
+    """
+    Create the derived renditions (currently only a thumbnail) of a processed
+    machine or coin image next to the image.
+
+    Args:
+        img_path: Path to the processed image.
+        width: Width of the thumbnail, defaults to THUMBNAIL_WIDTH.
+
+    Returns:
+        List of paths to the derivatives.
+    """
+    stem, ext = os.path.splitext(img_path)
+    thumb_path = f"{stem}{THUMBNAIL_SUFFIX}{ext}"
+    with Image.open(img_path) as img:
+        # Never upscale small images
+        width = min(width, img.size[0])
+        hsize = max(1, int(img.size[1] * width / float(img.size[0])))
+        thumb = img.resize((width, hsize), Image.Resampling.LANCZOS)
+    encode_image(thumb, thumb_path, BYTE_BUDGETS["thumb"])
+    return [thumb_path]
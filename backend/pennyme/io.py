@@ -0,0 +1,406 @@
+"""
+Reading and writing the JSON data files in the format of the repository, i.e., like
+`json.dump(data, f, indent=4, ensure_ascii=False)`. The output is identical byte
+for byte, such that rewriting an unchanged file does not produce a diff.
+
+Feature collections can also be read and written one feature at a time, see
+`iter_features` and `dump_features`, such that the memory of a script does not
+grow with the size of the data files.
+
+orjson is used when it is installed (`pip install pennyme[fast]`). It writes floats
+below 1e-4 or above 1e16 differently than the json module and NaN and Infinity as
+null, values that contain such floats are written with the json module instead.
+"""
+
+import hashlib
+import heapq
+import json
+import os
+import re
+import tempfile
+from itertools import islice
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+BACKEND = "json" if orjson is None else "orjson"
+INDENT = b"    "
+# Number of features encoded at once when writing a stream of features
+BATCH_SIZE = 1000
+# Floats that orjson formats differently, e.g., 0.00001 instead of 1e-05 and 1e16
+# instead of 1e+16, are matched if preceded by a non-digit resp. a digit. Strings
+# that match merely fall back to the json module.
+_SMALL_FLOAT = re.compile(rb"0\.0000")
+_EXPONENT = re.compile(rb"e[-0-9]")
+_DIGITS = b"0123456789"
+# orjson reads integers above 64 bit, which have at least 20 digits, as floats.
+# Digits are mapped to 0 and other bytes to spaces to find runs of 20 digits.
+_DIGIT_RUNS = bytes(48 if i in _DIGITS else 32 for i in range(256))
+_LONG_NUMBER = b"0" * 20
+# Closing bracket of a list nested in the top level object
+_LIST_END = b"\n" + INDENT + b"]"
+# Number of characters read at once when streaming features
+CHUNK_SIZE = 1 << 16
+# Number of features sorted in memory at once, see `sort_features`
+SORT_BATCH_SIZE = 20000
+# Key and feature of the pairs sorted by `sort_features`
+_first, _second = itemgetter(0), itemgetter(1)
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _orjson_differs(content: bytes) -> bool:
+    # Searching the literal prefixes is much faster than one regex with lookbehind
+    for match in _SMALL_FLOAT.finditer(content):
+        if match.start() == 0 or content[match.start() - 1] not in _DIGITS:
+            return True
+    for match in _EXPONENT.finditer(content):
+        if match.start() > 0 and content[match.start() - 1] in _DIGITS:
+            return True
+    return False
+
+
+def _orjson_dumps(value: Any, option: int) -> Optional[bytes]:
+    # Encode with orjson, or None if the json module would write something else
+    try:
+        content = orjson.dumps(value, option=option)
+    except orjson.JSONEncodeError:
+        # E.g., integers above 64 bit or keys that are not strings
+        return None
+    if _orjson_differs(content):
+        return None
+    # NaN and Infinity become null, which then does not read back to the value
+    if b"null" in content and orjson.loads(content) != value:
+        return None
+    return content
+
+
+def _reindent(content: bytes) -> bytes:
+    # Turn the two-space indentation of orjson into four spaces. Raw newlines and
+    # tabs only occur in the indentation, since strings are escaped.
+    content = content.replace(b"\n  ", b"\n\t")
+    while b"\t  " in content:
+        content = content.replace(b"\t  ", b"\t\t")
+    return content.replace(b"\t", INDENT)
+
+
+def _encode(value: Any, level: int = 0) -> bytes:
+    # Encode a value as if it were nested `level` levels deep in a document
+    content = None
+    if orjson is not None:
+        content = _orjson_dumps(value, orjson.OPT_INDENT_2)
+        content = None if content is None else _reindent(content)
+    if content is None:
+        content = json.dumps(value, indent=4, ensure_ascii=False).encode("utf-8")
+    if level:
+        content = content.replace(b"\n", b"\n" + INDENT * level)
+    return content
+
+
+def iter_encode(data: Dict[str, Any]) -> Iterator[bytes]:
+    """
+    Serialize a json file in chunks. The `features` of a feature collection can be
+    any iterable, e.g., a generator, and are then encoded in batches, such that
+    they never need to be in memory at once.
+
+    Args:
+        data: The content of the file.
+
+    Yields:
+        The raw content of the file, in chunks.
+    """
+    features = data.get("features") if isinstance(data, dict) else None
+    if features is None or isinstance(features, (list, tuple, dict)):
+        yield _encode(data)
+        return
+    yield b"{"
+    for i, (key, value) in enumerate(data.items()):
+        yield b"," if i else b""
+        yield b"\n" + INDENT + _encode(key) + b": "
+        if key != "features":
+            yield _encode(value, level=1)
+            continue
+        # Encode the features in batches, as list without the brackets
+        features, empty = iter(value), True
+        while batch := list(islice(features, BATCH_SIZE)):
+            content = _encode(batch, level=1)
+            yield (b"[" if empty else b",") + content[1 : -len(_LIST_END)]
+            empty = False
+        yield b"[]" if empty else _LIST_END
+    yield b"\n}"
+
+
+def dumps(data: Any) -> bytes:
+    """
+    Serialize a json file like it is stored in the repository.
+
+    Args:
+        data: The content of the file.
+
+    Returns:
+        The raw content of the file.
+    """
+    return b"".join(iter_encode(data))
+
+
+def dump(data: Any, path: Union[str, os.PathLike]):
+    """
+    Write a json file like it is stored in the repository. Features are written
+    as they are encoded, see `iter_encode`. The file is only replaced once it was
+    written completely.
+
+    Args:
+        data: The content of the file.
+        path: Path to the file.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in iter_encode(data):
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def dump_features(features: Iterable[Dict[str, Any]], path: Union[str, os.PathLike]):
+    """
+    Write a feature collection while the features are produced, e.g., by a
+    generator.
+
+    Args:
+        features: The features.
+        path: Path to the file.
+    """
+    dump({"type": "FeatureCollection", "features": features}, path)
+
+
+def dumps_compact(data: Any) -> bytes:
+    """
+    Serialize JSON data without whitespace, e.g., for files downloaded by the web
+    map. Unlike `dumps`, the output may depend on the backend.
+
+    Args:
+        data: JSON serializable data.
+
+    Returns:
+        The serialized data.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(content: Union[str, bytes]) -> Any:
+    """
+    Parse the content of a json file.
+
+    Args:
+        content: The raw content.
+
+    Returns:
+        The parsed content.
+    """
+    if orjson is not None:
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        if _LONG_NUMBER not in content.translate(_DIGIT_RUNS):
+            try:
+                return orjson.loads(content)
+            except orjson.JSONDecodeError:
+                # E.g., NaN or Infinity
+                pass
+    return json.loads(content)
+
+
+def load(path: Union[str, os.PathLike]) -> Any:
+    """
+    Read a json file.
+
+    Args:
+        path: Path to the file.
+
+    Returns:
+        The parsed content.
+    """
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def canonical_hash(data: Any) -> str:
+    """
+    Hash JSON data independently of its formatting and key order, i.e., data that
+    compares equal has the same hash.
+
+    Args:
+        data: JSON serializable data.
+
+    Returns:
+        The sha256 hex digest of the canonical serialization.
+    """
+    # The hash must not depend on the backend
+    content = None if orjson is None else _orjson_dumps(data, orjson.OPT_SORT_KEYS)
+    if content is None:
+        content = json.dumps(
+            data, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+        ).encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+class _Reader:
+    """Incremental decoding of JSON values from a text file."""
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read(self) -> bool:
+        # Drop the consumed part and append the next chunk
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return not self.eof
+
+    def _error(self, message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, self.buffer, self.pos)
+
+    def next_char(self) -> str:
+        """Consume the next character that is not whitespace."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                self.pos += 1
+                return self.buffer[self.pos - 1]
+            if not self._read():
+                raise self._error("Unexpected end of file")
+
+    def expect(self, chars: str) -> str:
+        """Consume the next character, which must be one of `chars`."""
+        char = self.next_char()
+        if char not in chars:
+            self.pos -= 1
+            raise self._error(f"Expecting one of {chars!r}")
+        return char
+
+    def peek(self) -> str:
+        """Return the next character that is not whitespace without consuming it."""
+        char = self.next_char()
+        self.pos -= 1
+        return char
+
+    def value(self) -> Any:
+        """Consume the next value, reading until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end < len(self.buffer) or not self._read():
+                self.pos = end
+                return value
+
+
+def iter_features(
+    path: Union[str, os.PathLike],
+    encoding: str = "utf-8",
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Read the features of a feature collection one at a time, without loading the
+    whole file.
+
+    Args:
+        path: Path to the file.
+        encoding: Encoding of the file. Defaults to utf-8.
+        chunk_size: Number of characters read at once. Defaults to CHUNK_SIZE.
+
+    Raises:
+        json.JSONDecodeError: If the file is not a valid JSON object.
+
+    Yields:
+        The features in the order of the file.
+    """
+    with open(path, "r", encoding=encoding) as f:
+        reader = _Reader(f, chunk_size)
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            if key != "features":
+                reader.value()
+            else:
+                reader.expect("[")
+                if reader.peek() == "]":
+                    reader.next_char()
+                else:
+                    while True:
+                        yield reader.value()
+                        if reader.expect(",]") == "]":
+                            break
+            if reader.expect(",}") == "}":
+                return
+
+
+def sort_features(
+    features: Iterable[Dict[str, Any]],
+    key: Callable[[Dict[str, Any]], Any],
+    batch_size: int = SORT_BATCH_SIZE,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Sort features like `sorted`, but with at most `batch_size` features in memory.
+    Larger inputs are sorted in batches which are stored in temporary files and
+    merged.
+
+    Args:
+        features: The features.
+        key: Sort key of a feature. It is computed once per feature and must be
+            JSON serializable, since it is stored with the batches.
+        batch_size: Number of features sorted in memory at once. Defaults to
+            SORT_BATCH_SIZE.
+
+    Yields:
+        The features in stable sorted order.
+    """
+    features = iter(features)
+    batch = sorted(((key(f), f) for f in islice(features, batch_size)), key=_first)
+    if len(batch) < batch_size:
+        yield from map(_second, batch)
+        return
+    with tempfile.TemporaryDirectory() as folder:
+        runs: List[str] = []
+        while batch:
+            runs.append(os.path.join(folder, f"{len(runs)}.jsonl"))
+            with open(runs[-1], "w", encoding="utf-8") as f:
+                for keyed in batch:
+                    f.write(json.dumps(keyed, ensure_ascii=False) + "\n")
+            batch = sorted(
+                ((key(f), f) for f in islice(features, batch_size)), key=_first
+            )
+
+        def read_run(path: str) -> Iterator[List[Any]]:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    yield loads(line)
+
+        # The merge is stable, i.e., ties are taken from earlier runs first
+        yield from map(_second, heapq.merge(*map(read_run, runs), key=_first))
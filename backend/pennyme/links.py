@@ -0,0 +1,166 @@
+"""Concurrent validation of machine links with a persistent result cache."""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterable, Optional
+
+import requests
+from loguru import logger
+
+from pennyme import http_client
+
+MAX_WORKERS = 8
+# Working links are rechecked after a week, broken ones in the next nightly run
+OK_TTL = 7 * 24 * 60 * 60
+ERROR_TTL = 12 * 60 * 60
+# Status codes for which servers commonly refuse HEAD although GET works
+HEAD_UNSUPPORTED = {403, 405, 501}
+
+
+@dataclass
+class LinkStatus:
+    """Result of a link check, mimicking the relevant part of a response."""
+
+    status_code: int
+    reason: str
+    checked_at: float
+
+    def __bool__(self) -> bool:
+        # Same semantics as `requests.Response.ok`
+        return self.status_code < 400
+
+
+class LinkValidator:
+    """
+    Checks links concurrently. Every link is checked at most once per run and
+    results are cached on disk, such that recently verified links are skipped
+    across runs.
+    """
+
+    def __init__(
+        self,
+        cache_path: Optional[str] = None,
+        max_workers: int = MAX_WORKERS,
+        ok_ttl: float = OK_TTL,
+        error_ttl: float = ERROR_TTL,
+        fetch: Optional[Callable[[str], Optional[LinkStatus]]] = None,
+    ):
+        """
+        Args:
+            cache_path: JSON file to persist the results. Defaults to None, i.e.,
+                results are only kept in memory.
+            max_workers: Number of concurrent checks. Defaults to MAX_WORKERS.
+            ok_ttl: Seconds a working link stays valid. Defaults to OK_TTL.
+            error_ttl: Seconds a broken link stays cached. Defaults to ERROR_TTL.
+            fetch: Function to check a link that is not cached, e.g., to replay
+                stored results. Defaults to None, i.e., the link is requested.
+        """
+        self.cache_path = cache_path
+        self.ok_ttl = ok_ttl
+        self.error_ttl = error_ttl
+        self.cache: Dict[str, LinkStatus] = {}
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, "r") as f:
+                self.cache = {
+                    url: LinkStatus(**status) for url, status in json.load(f).items()
+                }
+        self._fetch_link = fetch or self._fetch
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+
+    def _fresh(self, url: str) -> Optional[LinkStatus]:
+        status = self.cache.get(url)
+        if status is None:
+            return None
+        ttl = self.ok_ttl if status else self.error_ttl
+        return status if time.time() - status.checked_at < ttl else None
+
+    def _fetch(self, url: str) -> Optional[LinkStatus]:
+        try:
+            resp = http_client.head(url, allow_redirects=True)
+            if resp.status_code in HEAD_UNSUPPORTED or not resp:
+                # Only trust negative results of a full request
+                resp = http_client.get(url)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Exception encountered when testing link '{url}': {e}")
+            return None
+        status = LinkStatus(resp.status_code, resp.reason, time.time())
+        with self._lock:
+            self.cache[url] = status
+        return status
+
+    def _submit(self, url: str) -> Future:
+        with self._lock:
+            if url not in self._futures:
+                status = self._fresh(url)
+                if status is not None:
+                    self.cache_hits += 1
+                    future = Future()
+                    future.set_result(status)
+                else:
+                    future = self._executor.submit(self._fetch_link, url)
+                self._futures[url] = future
+            return self._futures[url]
+
+    def prefetch(self, urls: Iterable[str]):
+        """
+        Start checking links in the background.
+
+        Args:
+            urls: The links to check.
+        """
+        for url in urls:
+            self._submit(url)
+
+    def check(self, url: str) -> Optional[LinkStatus]:
+        """
+        Check a link (or wait for the result of a previous check).
+
+        Args:
+            url: The link to check.
+
+        Returns:
+            The status of the link, or None if the link could not be reached.
+        """
+        return self._submit(url).result()
+
+    def check_many(self, urls: Iterable[str]) -> Dict[str, Optional[LinkStatus]]:
+        """
+        Check links concurrently.
+
+        Args:
+            urls: The links to check.
+
+        Returns:
+            Dictionary mapping each link to its status (None if unreachable).
+        """
+        futures = {url: self._submit(url) for url in urls}
+        return {url: future.result() for url, future in futures.items()}
+
+    def results(self) -> Dict[str, Optional[LinkStatus]]:
+        """
+        Get the results of all links checked in this run (incl. cached ones).
+
+        Returns:
+            Dictionary mapping each link to its status (None if unreachable).
+        """
+        with self._lock:
+            futures = dict(self._futures)
+        return {url: future.result() for url, future in futures.items()}
+
+    def save(self):
+        """Persist the cached results."""
+        if self.cache_path is None:
+            return
+        with self._lock:
+            content = {url: asdict(status) for url, status in self.cache.items()}
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(content, f)
+        os.replace(tmp_path, self.cache_path)
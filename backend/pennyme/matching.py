@@ -0,0 +1,199 @@
+"""Indexed matching of website listings against machines without website link."""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from rapidfuzz import fuzz
+from rapidfuzz import process as rprocess
+from thefuzz.utils import full_process
+
+from pennyme.geo import distances_one_to_many
+
+# Minimal similarity (0-100) of names or addresses to be considered the same machine
+MATCH_THRESHOLD = 92
+# Maximal distance (meters) to be considered the same machine
+DISTANCE_THRESHOLD = 100
+
+
+def _process(text: str) -> str:
+    # Same preprocessing as thefuzz applies before scoring with WRatio
+    return full_process(text, force_ascii=True)
+
+
+@dataclass
+class _Choices:
+    """Candidate strings, pre-processed once for repeated fuzzy searches."""
+
+    raw: List[str]
+    processed: List[str] = field(init=False)
+    first_index: Dict[str, int] = field(init=False)
+
+    def __post_init__(self):
+        self.processed = [_process(choice) for choice in self.raw]
+        self.first_index = {}
+        for i, choice in enumerate(self.raw):
+            self.first_index.setdefault(choice, i)
+
+    def extract(self, query: str, limit: int) -> List[tuple]:
+        """
+        Find the most similar choices, identical to `thefuzz.process.extract`.
+
+        Args:
+            query: The query string.
+            limit: Maximal number of results.
+
+        Returns:
+            List of (choice, score) tuples, best first.
+        """
+        # thefuzz processes the query twice (once by itself, once like the choices)
+        query = _process(full_process(query))
+        results = rprocess.extract(
+            query, self.processed, scorer=fuzz.WRatio, processor=None, limit=limit
+        )
+        return [(self.raw[idx], int(round(score))) for _, score, idx in results]
+
+
+class AreaBlock:
+    """Machines without website link within one area."""
+
+    def __init__(self, frame: pd.DataFrame):
+        """
+        Args:
+            frame: Rows of the `external` frame of one area.
+        """
+        self.sources = list(frame["source"])
+        self.data_idxs = list(frame["data_idx"])
+        self.names = _Choices(list(frame["name"]))
+        self.addresses = _Choices(list(frame["address"]))
+        self.name_addresses = _Choices(
+            [n + a for n, a in zip(frame["name"], frame["address"])]
+        )
+        # Only machines from the server have coordinates, others are NaN
+        nan = [float("nan")] * len(frame)
+        latitudes = frame["latitude"] if "latitude" in frame else nan
+        longitudes = frame["longitude"] if "longitude" in frame else nan
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+
+class Match(NamedTuple):
+    """A machine without link that matches a listing."""
+
+    # Position of the machine within the area block
+    row: int
+    # The matched name, address or name+address
+    match: str
+    # Similarity score or distance in meters
+    score: float
+
+
+class MachineMatcher:
+    """
+    Matches website listings against the machines without website link. The
+    machines are blocked by area once and their names and addresses are
+    pre-processed, such that each listing only scores the machines in its area.
+    """
+
+    def __init__(self, external: pd.DataFrame):
+        """
+        Args:
+            external: Frame with the properties of all machines without website
+                link, with columns `source` and `data_idx` pointing to the data.
+        """
+        self.blocks: Dict[str, AreaBlock] = {
+            area: AreaBlock(frame) for area, frame in external.groupby("area")
+        }
+
+    def block(self, area: str) -> Optional[AreaBlock]:
+        """
+        Get the machines of an area.
+
+        Args:
+            area: Name of the area.
+
+        Returns:
+            The block of the area or None if there are no machines without link.
+        """
+        return self.blocks.get(area)
+
+    def match_name(self, block: AreaBlock, title: str, address: str) -> Optional[Match]:
+        """
+        Find a machine with (almost) the same name. If several machines have
+        similar names, the name and address are compared.
+
+        Args:
+            block: Machines of the area.
+            title: Name of the listing.
+            address: Address of the listing.
+
+        Returns:
+            The match or None.
+        """
+        query = title
+        result = block.names.extract(query, limit=2)
+        if len(result) == 1 or result[1][1] <= MATCH_THRESHOLD:
+            # regular case
+            match, score = result[0]
+        else:
+            logger.info(f"Edge case, potentially multiple matches for {title}")
+            query = title + address
+            result = block.name_addresses.extract(query, limit=2)
+            if result[1][1] > MATCH_THRESHOLD:
+                logger.info(
+                    f"After comparing title ({title}) and address ({address}) there are still multiple matches, taking first one"
+                )
+            match, score = result[0]
+
+        if query == title + address:
+            return Match(block.name_addresses.first_index[match], match, score)
+        elif score > MATCH_THRESHOLD:
+            return Match(block.names.first_index[match], match, score)
+        return None
+
+    def match_address(self, block: AreaBlock, address: str) -> Optional[Match]:
+        """
+        Find a machine with (almost) the same address.
+
+        Args:
+            block: Machines of the area.
+            address: Address of the listing.
+
+        Returns:
+            The match or None.
+        """
+        match, score = block.addresses.extract(address, limit=1)[0]
+        if score >= MATCH_THRESHOLD:
+            return Match(block.addresses.first_index[match], match, score)
+        return None
+
+    def match_distance(
+        self, block: AreaBlock, lat: float, lng: float
+    ) -> Optional[Match]:
+        """
+        Find a machine close to the coordinates of the listing.
+
+        Args:
+            block: Machines of the area.
+            lat: Latitude of the listing.
+            lng: Longitude of the listing.
+
+        Returns:
+            The match (with the distance in meters as score) or None.
+        """
+        dists = (
+            distances_one_to_many(lat, lng, block.latitudes, block.longitudes) * 1000
+        )
+        # Same semantics as the builtin min over the distances: a machine without
+        # coordinates (NaN) in the first row never matches, later ones are ignored
+        if np.isnan(dists[0]):
+            return None
+        row = int(np.nanargmin(dists))
+        if dists[row] < DISTANCE_THRESHOLD:
+            return Match(row, block.names.raw[row], float(dists[row]))
+        return None
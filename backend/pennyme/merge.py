@@ -0,0 +1,159 @@
+"""
+Merging of feature collections by machine id, e.g., of the server locations into
+all locations. The updates are indexed by id and the base is streamed, such that a
+merge takes linear time and only the updates are kept in memory (and the base, if
+its ids are made unique).
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+@dataclass
+class MergePolicy:
+    """How features of the base and the updates with the same id are combined."""
+
+    # Whether the update replaces the base feature, otherwise the update is dropped
+    prefer_updates: bool = True
+    # Whether a replaced feature keeps the position of the base feature, otherwise
+    # the base features come first and all updates are appended in their order
+    in_place: bool = True
+    # Whether repeated ids of the base are combined, like in a dictionary keyed by
+    # id: the last feature is used at the position of the first
+    unique: bool = False
+
+
+# Server locations replace all locations and are appended (merge_jsons)
+APPEND_UPDATES = MergePolicy(in_place=False)
+# The web map shows every machine once, at its position in all locations
+REPLACE_IN_PLACE = MergePolicy(unique=True)
+
+
+@dataclass
+class MergeStats:
+    """Feature counts of a merge, complete once the merged features are consumed."""
+
+    base: int = 0
+    updates: int = 0
+    # Base features with the id of an update
+    overlapping: int = 0
+    merged: int = 0
+
+
+def merge_features(
+    base: Iterable[Dict[str, Any]],
+    updates: Iterable[Dict[str, Any]],
+    policy: MergePolicy = REPLACE_IN_PLACE,
+    stats: Optional[MergeStats] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Merge two sequences of features by their id.
+
+    Args:
+        base: The features to merge into, e.g., streamed from all locations. If
+            the policy makes ids unique, repeated ids are combined like those of
+            the updates.
+        updates: The newer features, e.g., the server locations. If ids repeat
+            and updates are merged in place, the last feature is used at the
+            position of the first.
+        policy: How features with the same id are combined. Defaults to
+            REPLACE_IN_PLACE.
+        stats: Counts that are updated while the merged features are consumed.
+            Defaults to None.
+
+    Yields:
+        The merged features. Features that only exist in one of the inputs keep
+            their order.
+    """
+    stats = stats or MergeStats()
+    updates = list(updates)
+    stats.updates = len(updates)
+    by_id = {feature["properties"]["id"]: feature for feature in updates}
+    # Updates without a base feature of the same id are appended at the end
+    pending = dict(by_id)
+    base = _counted(base, stats)
+    if policy.unique:
+        base = {feature["properties"]["id"]: feature for feature in base}.values()
+    for feature in base:
+        machine_id = feature["properties"]["id"]
+        if machine_id in by_id:
+            stats.overlapping += 1
+            update = pending.pop(machine_id, None)
+            if policy.prefer_updates:
+                if not policy.in_place or update is None:
+                    continue
+                feature = update
+        stats.merged += 1
+        yield feature
+    appended = pending.values()
+    if policy.prefer_updates and not policy.in_place:
+        appended = updates
+    for feature in appended:
+        stats.merged += 1
+        yield feature
+
+
+def _counted(
+    features: Iterable[Dict[str, Any]], stats: MergeStats
+) -> Iterator[Dict[str, Any]]:
+    # Count the base features while they are consumed
+    for feature in features:
+        stats.base += 1
+        yield feature
+
+
+def parse_date(feature: Dict[str, Any]) -> datetime:
+    """
+    Parse the date of the last update of a feature.
+
+    Args:
+        feature: The feature.
+
+    Returns:
+        The date in `last_updated`.
+    """
+    return _parse_date(feature["properties"]["last_updated"])
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(text: str) -> datetime:
+    # Many machines share a date and strptime is slow
+    return datetime.strptime(text, DATE_FORMAT)
+
+
+def latest_update(features: Iterable[Dict[str, Any]]) -> Optional[datetime]:
+    """
+    Find the most recent update, without sorting.
+
+    Args:
+        features: The features.
+
+    Returns:
+        The latest `last_updated` date or None if there are no features.
+    """
+    return max(map(parse_date, features), default=None)
+
+
+def within_grace_period(
+    updates: Iterable[Dict[str, Any]], since: Optional[datetime]
+) -> Iterator[Dict[str, Any]]:
+    """
+    Keep the updates that are not older than the data shipped with the app. This
+    gives users a grace period to update the app, until then they still see the
+    machines from the server.
+
+    Args:
+        updates: The features, e.g., the server locations.
+        since: The latest update of the shipped data, e.g., all locations. None
+            keeps all updates.
+
+    Yields:
+        The updates from `since` on.
+    """
+    for feature in updates:
+        if since is None or parse_date(feature) >= since:
+            yield feature
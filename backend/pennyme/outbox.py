@@ -0,0 +1,245 @@
+"""Persisted outbox to deliver notifications from a background thread."""
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# Messages with the same digest key are collected for this many seconds
+DIGEST_WINDOW = 30.0
+POLL_INTERVAL = 1.0
+MAX_ATTEMPTS = 5
+# Delivery lags above this threshold (seconds) are logged as warnings
+LAG_WARNING = 60.0
+
+
+class RetryLater(Exception):
+    """Raised by a send function if the receiver asks to retry after some time."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Outbox:
+    """
+    Directory based outbox. Every message is stored as one JSON file, such that
+    pending messages survive restarts, and is removed once it was delivered.
+    Messages sharing a digest key are combined into a single message.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        send: Callable[[Dict[str, Any]], None],
+        combine: Callable[[List[Dict[str, Any]]], Dict[str, Any]],
+        digest_window: float = DIGEST_WINDOW,
+        poll_interval: float = POLL_INTERVAL,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        """
+        Args:
+            path: Folder to persist the messages in.
+            send: Function delivering one payload. Raises RetryLater if the
+                receiver is rate limited, any other exception counts as failure.
+            combine: Function merging the payloads of a digest into one payload.
+            digest_window: Seconds to collect messages with the same digest key
+                before they are sent. Defaults to DIGEST_WINDOW.
+            poll_interval: Seconds between checks for new messages. Defaults to
+                POLL_INTERVAL.
+            max_attempts: Failed deliveries before a message is moved to the
+                `failed` subfolder. Defaults to MAX_ATTEMPTS.
+        """
+        self.path = path
+        self.failed_path = os.path.join(path, "failed")
+        self.send = send
+        self.combine = combine
+        self.digest_window = digest_window
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lags: List[float] = []
+        self._blocked_until = 0.0
+        self.delivered = 0
+
+    def put(self, payload: Dict[str, Any], digest_key: Optional[str] = None) -> str:
+        """
+        Persist a message for delivery.
+
+        Args:
+            payload: The message, passed to the send function.
+            digest_key: Messages with the same key that arrive within the digest
+                window are delivered as one digest. Defaults to None (no digest).
+
+        Returns:
+            Path of the persisted message.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        message = {
+            "created": time.time(),
+            "digest_key": digest_key,
+            "attempts": 0,
+            "retry_at": 0.0,
+            "payload": payload,
+        }
+        # File names sort by creation time, which defines the delivery order
+        name = f"{time.time_ns()}_{uuid.uuid4().hex[:8]}.json"
+        path = os.path.join(self.path, name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(message, f)
+        os.replace(path + ".tmp", path)
+        self._wakeup.set()
+        return path
+
+    def pending(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Load all messages that were not delivered yet.
+
+        Returns:
+            List of tuples with path and content of the message, oldest first.
+        """
+        if not os.path.isdir(self.path):
+            return []
+        messages = []
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                with open(path, "r") as f:
+                    messages.append((path, json.load(f)))
+            except (OSError, json.JSONDecodeError):
+                logger.exception(f"Could not read outbox message {path}")
+        return messages
+
+    def _batches(
+        self, messages: List[Tuple[str, Dict[str, Any]]]
+    ) -> List[List[Tuple[str, Dict[str, Any]]]]:
+        # Digests are delivered at the position of their first message
+        batches, digests = [], {}
+        for path, message in messages:
+            key = message["digest_key"]
+            if key is None:
+                batches.append([(path, message)])
+            elif key in digests:
+                digests[key].append((path, message))
+            else:
+                digests[key] = [(path, message)]
+                batches.append(digests[key])
+        return batches
+
+    def _failed(self, batch: List[Tuple[str, Dict[str, Any]]], error: Exception):
+        for path, message in batch:
+            message["attempts"] += 1
+            # Exponential backoff between attempts
+            message["retry_at"] = (
+                time.time() + self.poll_interval * 2 ** message["attempts"]
+            )
+            if message["attempts"] >= self.max_attempts:
+                os.makedirs(self.failed_path, exist_ok=True)
+                os.replace(path, os.path.join(self.failed_path, os.path.basename(path)))
+                logger.error(f"Giving up on outbox message {path}: {error}")
+            else:
+                with open(path, "w") as f:
+                    json.dump(message, f)
+
+    def deliver_pending(self, force: bool = False) -> float:
+        """
+        Deliver all pending messages.
+
+        Args:
+            force: If True, digests are sent without waiting for the end of the
+                digest window. Defaults to False.
+
+        Returns:
+            Seconds to wait before the next delivery attempt.
+        """
+        now = time.time()
+        if now < self._blocked_until:
+            # New messages wake up the sender, but Retry-After is still honoured
+            return self._blocked_until - now
+        wait_time = self.poll_interval
+        for batch in self._batches(self.pending()):
+            created = batch[0][1]["created"]
+            is_digest = batch[0][1]["digest_key"] is not None
+            if is_digest and not force and now - created < self.digest_window:
+                wait_time = min(wait_time, self.digest_window - (now - created))
+                continue
+            if max(message.get("retry_at", 0.0) for _, message in batch) > now:
+                continue
+
+            payloads = [message["payload"] for _, message in batch]
+            try:
+                self.send(payloads[0] if len(payloads) == 1 else self.combine(payloads))
+            except RetryLater as e:
+                logger.warning(
+                    f"Outbox delivery rate limited, retry in {e.retry_after}s"
+                )
+                self._blocked_until = time.time() + e.retry_after
+                return e.retry_after
+            except Exception as e:
+                logger.error(f"Outbox delivery failed: {type(e).__name__}: {e}")
+                self._failed(batch, e)
+                continue
+
+            delivered_at = time.time()
+            for path, message in batch:
+                os.remove(path)
+                self._lags.append(delivered_at - message["created"])
+            self._lags = self._lags[-1000:]
+            self.delivered += len(batch)
+            lag = delivered_at - created
+            log = logger.warning if lag > LAG_WARNING else logger.info
+            log(f"Delivered {len(batch)} outbox message(s), lag {lag:.1f}s")
+        return max(wait_time, 0.0)
+
+    def flush(self):
+        """Deliver all pending messages now, e.g., before a script exits."""
+        self.deliver_pending(force=True)
+
+    def _run(self):
+        while True:
+            try:
+                wait_time = self.deliver_pending()
+            except Exception:
+                logger.exception("Error in outbox sender")
+                wait_time = self.poll_interval
+            self._wakeup.wait(wait_time)
+            self._wakeup.clear()
+
+    def start(self) -> threading.Thread:
+        """
+        Start the background sender (once).
+
+        Returns:
+            The sender thread.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report the state of the outbox.
+
+        Returns:
+            Dictionary with the number of delivered, pending and failed messages
+                and the mean and maximum delivery lag (seconds) of recent messages.
+        """
+        failed = (
+            len(os.listdir(self.failed_path)) if os.path.isdir(self.failed_path) else 0
+        )
+        return {
+            "delivered": self.delivered,
+            "pending": len(self.pending()),
+            "failed": failed,
+            "mean_lag": sum(self._lags) / len(self._lags) if self._lags else 0.0,
+            "max_lag": max(self._lags, default=0.0),
+        }
@@ -0,0 +1,358 @@
+"""
+Fast extraction of the area list and the location tables of pennycollector.com.
+
+The raw pages are tokenized with the streaming parser of the standard library,
+without building a document tree. Only the elements read by `pennycollector` are
+serialized, exactly like `str()` of the corresponding BeautifulSoup (html.parser)
+tags, such that the helpers in `pennycollector` yield identical results.
+"""
+
+import re
+from abc import ABC, abstractmethod
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from bs4.builder import HTMLParserTreeBuilder
+from bs4.dammit import EntitySubstitution
+
+from pennyme.pennycollector import (
+    get_area_list_from_markup,
+    get_prelim_geojson,
+    group_location_cells,
+)
+
+# Tree building conventions of BeautifulSoup
+_BUILDER = HTMLParserTreeBuilder()
+VOID_ELEMENTS = _BUILDER.empty_element_tags
+LIST_ATTRIBUTES = _BUILDER.DEFAULT_CDATA_LIST_ATTRIBUTES
+PRESERVE_WHITESPACE_TAGS = _BUILDER.DEFAULT_PRESERVE_WHITESPACE_TAGS
+CDATA_TAGS = {"script", "style"}
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+# Pages are fed in chunks, such that parsing stops once the wanted table was read
+CHUNK_SIZE = 64 * 1024
+
+# Numeric character references are dereferenced like in BeautifulSoup: the digits
+# up to the first other character are the reference, the rest is text
+DECIMAL_REFERENCE = re.compile("^([0-9]+)(.*)")
+HEX_REFERENCE = re.compile("^([0-9a-f]+)(.*)")
+# C1 controls that are windows-1252 characters, as in the HTML spec
+WINDOWS_1252 = {}
+for _code in range(0x80, 0xA0):
+    try:
+        WINDOWS_1252[_code] = bytes([_code]).decode("cp1252")
+    except UnicodeDecodeError:
+        pass
+
+
+def dereference_charref(name: str) -> str:
+    """
+    Convert a numeric character reference into text, like BeautifulSoup.
+
+    Args:
+        name: The reference as passed to `HTMLParser.handle_charref`, e.g., `x41`.
+
+    Returns:
+        The character and any text that followed the reference without a
+            semicolon.
+    """
+    base, pattern, extra = 10, DECIMAL_REFERENCE, ""
+    if name.startswith(("x", "X")):
+        name, base, pattern = name[1:], 16, HEX_REFERENCE
+    try:
+        code = int(name, base)
+    except ValueError:
+        match = pattern.search(name)
+        if match is None:
+            return name
+        code, extra = int(match.group(1), base), match.group(2)
+    if not 0 < code <= 0x10FFFF or 0xD800 <= code <= 0xDFFF:
+        return "\ufffd" + extra
+    return WINDOWS_1252.get(code, chr(code)) + extra
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _quote(value: str) -> str:
+    value = _escape(value)
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    return '"' + value.replace('"', "&quot;") + '"'
+
+
+class _Element:
+    """An open element, with the buffer of its HTML if it is extracted."""
+
+    __slots__ = ["name", "buffer", "index", "target"]
+
+    def __init__(
+        self, name: str, buffer: Optional[List[str]], index: int, target: bool
+    ):
+        self.name = name
+        self.buffer = buffer
+        self.index = index
+        self.target = target
+
+
+class ElementExtractor(HTMLParser, ABC):
+    """
+    Streaming parser that extracts the HTML of selected elements. Open elements
+    are tracked like in BeautifulSoup, i.e., an end tag closes all elements up to
+    the most recent one with its name and stray end tags are ignored.
+
+    Subclasses decide which elements to extract in `select`. The extracted
+    elements are collected in the order of their start tags, like in the results
+    of `find_all`.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.done = False
+        # Name and HTML of the extracted elements
+        self.elements: List[Tuple[str, str]] = []
+        self._stack: List[_Element] = []
+        self._buffers: List[List[str]] = []
+        self._data: List[str] = []
+        self._preserve_whitespace = 0
+        # Void elements whose end tag is still expected, e.g., <br></br>
+        self._closed_void: List[str] = []
+
+    @abstractmethod
+    def select(self, name: str, attrs: Dict[str, str]) -> Tuple[bool, bool]:
+        """
+        Decide whether an element is extracted.
+
+        Args:
+            name: Name of the tag.
+            attrs: Attributes of the tag.
+
+        Returns:
+            Whether the element is extracted and whether it is a target whose
+                end finishes the parsing.
+        """
+
+    def parse(self, content: bytes):
+        """
+        Parse a page until all targets were found.
+
+        Args:
+            content: Raw content of the page.
+        """
+        # Same decoding as `webconfig.get_website`
+        text = content.decode("utf8").encode("ascii", "ignore").decode("ascii")
+        for start in range(0, len(text), CHUNK_SIZE):
+            self.feed(text[start : start + CHUNK_SIZE])
+            if self.done:
+                return
+        self.close()
+
+    def close(self):
+        super().close()
+        self._flush()
+        while self._stack:
+            self._pop()
+
+    def _emit(self, html: str):
+        for buffer in self._buffers:
+            buffer.append(html)
+
+    def _flush(self):
+        if not self._data:
+            return
+        data = "".join(self._data)
+        self._data = []
+        if not self._preserve_whitespace and not data.strip(ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+        if not self._stack or self._stack[-1].name not in CDATA_TAGS:
+            data = _escape(data)
+        self._emit(data)
+
+    def _attributes(
+        self, name: str, attrs: List[Tuple[str, Optional[str]]]
+    ) -> Dict[str, str]:
+        attributes = {}
+        list_attributes = LIST_ATTRIBUTES.get(name, ())
+        for key, value in attrs:
+            value = "" if value is None else value
+            if key in LIST_ATTRIBUTES["*"] or key in list_attributes:
+                value = " ".join(value.split())
+            attributes[key] = value
+        return attributes
+
+    def _pop(self):
+        element = self._stack.pop()
+        if element.name in PRESERVE_WHITESPACE_TAGS:
+            self._preserve_whitespace -= 1
+        self._emit(f"</{element.name}>")
+        if element.buffer is not None:
+            self._buffers.pop()
+            self.elements[element.index] = (element.name, "".join(element.buffer))
+        if element.target:
+            self.done = True
+
+    def _start(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        self._flush()
+        attributes = self._attributes(tag, attrs)
+        extract, target = self.select(tag, attributes)
+        buffer = [] if extract else None
+        if buffer is not None:
+            self._buffers.append(buffer)
+            self.elements.append((tag, ""))
+        if self._buffers:
+            html = "".join(f" {k}={_quote(v)}" for k, v in sorted(attributes.items()))
+            void = "/" if tag in VOID_ELEMENTS else ""
+            self._emit(f"<{tag}{html}{void}>")
+        if tag in VOID_ELEMENTS:
+            if buffer is not None:
+                self._buffers.pop()
+                self.elements[-1] = (tag, "".join(buffer))
+            return
+        if tag in PRESERVE_WHITESPACE_TAGS:
+            self._preserve_whitespace += 1
+        self._stack.append(_Element(tag, buffer, len(self.elements) - 1, target))
+
+    def _end(self, tag: str):
+        self._flush()
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i].name == tag:
+                while len(self._stack) > i:
+                    self._pop()
+                return
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        self._start(tag, attrs)
+        if tag in VOID_ELEMENTS:
+            self._closed_void.append(tag)
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        self._start(tag, attrs)
+        self._end(tag)
+
+    def handle_endtag(self, tag: str):
+        if tag in self._closed_void:
+            # Not even the current text ends here, like in BeautifulSoup
+            self._closed_void.remove(tag)
+        else:
+            self._end(tag)
+
+    def handle_data(self, data: str):
+        if self._buffers:
+            self._data.append(data)
+
+    def handle_entityref(self, name: str):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.handle_data(character if character is not None else "&" + name)
+
+    def handle_charref(self, name: str):
+        self.handle_data(dereference_charref(name))
+
+    def handle_comment(self, data: str):
+        self._flush()
+        self._emit(f"<!--{data}-->")
+
+    def handle_decl(self, decl: str):
+        self._flush()
+        # Declarations are output as doctype, like in BeautifulSoup
+        self._emit(f"<!DOCTYPE {decl[len('DOCTYPE ') :]}>\n")
+
+    def unknown_decl(self, data: str):
+        self._flush()
+        if data.upper().startswith("CDATA["):
+            self._emit(f"<![CDATA[{data[len('CDATA[') :]}]]>")
+        else:
+            self._emit(f"<?{data}?>")
+
+    def handle_pi(self, data: str):
+        self._flush()
+        self._emit(f"<?{data}>")
+
+
+class LocationTableParser(ElementExtractor):
+    """Extracts the cells of the location table (the first table with border 1)."""
+
+    def __init__(self):
+        super().__init__()
+        self.found_table = False
+
+    def select(self, name: str, attrs: Dict[str, str]) -> Tuple[bool, bool]:
+        if not self.found_table:
+            self.found_table = name == "table" and attrs.get("border") == "1"
+            return False, self.found_table
+        return name == "td" and not self.done, False
+
+
+class AreaListParser(ElementExtractor):
+    """Extracts the table with the US states and the selected options."""
+
+    def __init__(self):
+        super().__init__()
+        self.found_table = False
+
+    def select(self, name: str, attrs: Dict[str, str]) -> Tuple[bool, bool]:
+        if name == "table" and not self.found_table:
+            self.found_table = attrs.get("id") == "StatesList"
+            return self.found_table, False
+        return name == "option" and attrs.get("selected") == "", False
+
+
+def parse_area_list(content: bytes) -> List[str]:
+    """
+    Get the list of areas from the raw area website (AREA_SITE), like
+    `get_area_list_from_area_website`.
+
+    Args:
+        content: Raw content of the website.
+
+    Returns:
+        List: A list of areas.
+    """
+    parser = AreaListParser()
+    parser.parse(content)
+    states_table = [html for name, html in parser.elements if name == "table"]
+    options = [html for name, html in parser.elements if name == "option"]
+    # Like `str()` of the result of `find` if there is no such table
+    return get_area_list_from_markup(
+        states_table[0] if states_table else "None", options
+    )
+
+
+def parse_location_list(content: bytes) -> List[List[str]]:
+    """
+    Get the locations from the raw website of an area, like
+    `get_location_list_from_location_website`.
+
+    Args:
+        content: Raw content of the website.
+
+    Returns:
+        List of locations, each represented as a list of strings,
+            one per column.
+    """
+    parser = LocationTableParser()
+    parser.parse(content)
+    if not parser.found_table:
+        raise ValueError("The page contains no location table")
+    # Skip the first 5 cells (they contain design issues)
+    return group_location_cells([html for _, html in parser.elements[5:]])
+
+
+def iter_prelim_geojsons(
+    content: bytes, area: str, add_date: bool = False
+) -> Iterator[Dict[str, Any]]:
+    """
+    Convert the locations on the raw website of an area to preliminary geojsons.
+
+    Args:
+        content: Raw content of the website.
+        area: Name of the area.
+        add_date: Whether the date will be added as last_changed.
+            Defaults to False.
+
+    Yields:
+        The preliminary geojson of each location, as from `get_prelim_geojson`.
+    """
+    for raw_location in parse_location_list(content):
+        yield get_prelim_geojson(raw_location, area, add_date=add_date)
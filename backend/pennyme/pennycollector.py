@@ -37,12 +37,28 @@ def get_area_list_from_area_website(website) -> List[str]:
     """
 
     unparsed_locs = website.find("table", id="StatesList")
-    us_locs = [loc.split("\t")[-1] for loc in str(unparsed_locs).split("</a>")][:-1]
-
     non_us_unparsed = website.findAll("option", attrs={"selected": ""})
+    return get_area_list_from_markup(
+        str(unparsed_locs), [str(can) for can in non_us_unparsed]
+    )
+
+
+def get_area_list_from_markup(states_table: str, options: List[str]) -> List[str]:
+    """
+    Get a list with areas from the relevant HTML elements of the area website.
+
+    Args:
+        states_table: HTML of the table with the US states.
+        options: HTML of the selected options, containing the other areas.
+
+    Returns:
+        List: A list of areas.
+    """
+    us_locs = [loc.split("\t")[-1] for loc in states_table.split("</a>")][:-1]
+
     non_us_locations = []
-    for can in non_us_unparsed[1:]:
-        loc = str(can).split("</option>")[0].split(">")[-1]
+    for can in options[1:]:
+        loc = can.split("</option>")[0].split(">")[-1]
         if loc == "Select One":
             break
         non_us_locations.append(loc)
@@ -99,12 +115,24 @@ def get_location_list_from_location_website(
             one per column.
     """
     raw_locations = get_raw_locations_from_location_website(website)
+    return group_location_cells([str(content) for content in raw_locations])
+
+
+def group_location_cells(cells: List[str]) -> List[List[str]]:
+    """
+    Group the HTML of the table cells of a location website into locations.
+
+    Args:
+        cells: HTML of the cells after the header.
 
+    Returns:
+        List of locations, each represented as a list of strings,
+            one per column.
+    """
     # 5 Tags always make up one location
     location_list = []
     location = []  # Initialize the location list outside the loop
-    for ind, content in enumerate(raw_locations):
-        content = str(content)
+    for ind, content in enumerate(cells):
         location.append(content)
         if (ind + 1) % 5 == 0:  # Check if 5 tags have been added
             location_list.append(location)
@@ -144,8 +172,8 @@ def get_prelim_geojson(
         state = "available"
     link = WEBSITE_ROOT + raw_location[3].split('href="')[1].split('"><')[0]
 
-    # NOTE: This refers to the last update on the website. We dont exploit this
-    # information atm, but it could be used to make inference faster.
+    # NOTE: This refers to the last update on the website. The differ uses it to
+    # skip listings that did not change since its last run.
     updated = raw_location[4].split('center">')[1].split("</td>")[0]
     month, day, year = updated.split("/")
     geojson = {
@@ -1,109 +1,124 @@
-import json
 import os
-from pathlib import Path
-from typing import Dict, Optional, Tuple
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
-import cv2
-import numpy as np
 from loguru import logger
-from PIL import Image, ImageOps
-from rembg import new_session, remove
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
-from pennyme.utils import ALL_LOCATIONS
+from pennyme import io
+from pennyme.image_store import hashed_image_url
+from pennyme.outbox import Outbox, RetryLater
+from pennyme.utils import iter_all_locations
 
 CLIENT = WebClient(token=os.environ["SLACK_TOKEN"])
-IMG_PORT = "http://37.120.179.15:8000/"
+# Image route of app.py, which serves hashed URLs with immutable cache headers
+IMAGE_URL = "http://37.120.179.15:6006/images/"
 THIS_PATH = os.path.abspath(__file__)
 # Construct paths based on the location of the current script
 PATH_SERVER_LOCATION = os.path.join(
     os.path.dirname(THIS_PATH), "..", "..", "..", "images", "server_locations.json"
 )
+# Not inside the images folder since that one is served publicly
+PATH_OUTBOX = os.path.join(os.path.dirname(THIS_PATH), "..", "..", "..", "slack_outbox")
+SLACK_CHANNEL = "#pennyme_uploads"
+# Slack truncates messages longer than 40k characters
+MAX_TEXT_LENGTH = 39000
 
-MACHINE_NAMES = {
-    elem["properties"][
-        "id"
-    ]: f"{elem['properties']['name']} ({elem['properties']['area']}) "
-    + f"Status={elem['properties']['machine_status']} at: {elem['properties']['external_url']}"
-    for elem in ALL_LOCATIONS["features"]
-}
 
-
-def reload_server_data() -> Dict[str, str]:
+def format_machine_name(properties: Dict[str, Any]) -> str:
     """
-    Reloads the server data from the json file and extracts specific information, e.g.,
-    to display in Slack.
+    Format the name of a machine as displayed in Slack.
+
+    Args:
+        properties: The properties of the machine's geojson feature.
 
     Returns:
-        Dictionary with machine IDs as keys and machine names as values.
+        Name, area, status and URL of the machine.
     """
-    # add server location IDs
-    with open(PATH_SERVER_LOCATION, "r", encoding="latin-1") as infile:
-        d = json.load(infile)
-    for elem in d["features"]:
-        MACHINE_NAMES[elem["properties"]["id"]] = (
-            f"{elem['properties']['name']} ({elem['properties']['area']})"
-            + f"Status={elem['properties']['machine_status']} at: {elem['properties']['external_url']}"
-        )
-    return MACHINE_NAMES
-
-
-def process_uploaded_image(
-    img_path: str,
-    basewidth: int = 1000,
-    min_area: int = 2000,
-) -> Tuple[int, str, str]:
-    """
-    Optimizes an image for size/quality and re-saves it to the server.
+    return (
+        f"{properties['name']} ({properties['area']}) "
+        + f"Status={properties['machine_status']} at: {properties['external_url']}"
+    )
 
-    Args:
-        img_path: The path to save the image to.
-        basewidth: width of rescaled image, defaults to 1000. Used to be 400.
-        min_area: minimal pixel count for a connected-area to be counted in coin
-            foreground separation.
 
-    Returns:
-        String with success message
+class MachineNames:
+    """
+    In-memory lookup of formatted machine names. The server locations file is only
+    parsed again if its modification time or size changed, or if the data was
+    invalidated explicitly.
     """
-    img = ImageOps.exif_transpose(Image.open(img_path))
-    wpercent = basewidth / float(img.size[0])
-    if wpercent <= 1:
-        hsize = int((float(img.size[1]) * float(wpercent)))
-        img = img.resize((basewidth, hsize), Image.Resampling.LANCZOS)
-
-    # If image is a coin, apply background separation and always save as PNG.
-    output_path = img_path
-    if "coin" in img_path:
-        img = remove(img, session=new_session("u2netp"))
-        # Coin images are saved as PNG to support transparency
-        in_path = Path(img_path)
-        out_path = in_path.with_suffix(".png")
-        output_path = str(out_path)
-
-        # Return error if more than one connected comp
-        m = (np.array(img)[:, :, 3] > 15).astype(np.uint8)
-        n, _, s, _ = cv2.connectedComponentsWithStats(m, 8)
-        keep = np.where(s[1:, 4] >= min_area)[0] + 1
-
-        if keep.size == 0:
-            return 422, "No foreground object found", img_path
-        if keep.size > 1:
-            return 409, f"Multiple foreground objects found ({keep.size})", img_path
-
-        # Crop coin out of the image
-        x, y, w, h = map(int, s[int(keep[0]), :4])
-        pad = 20
-
-        img = img.crop((max(0, x - pad), max(0, y - pad), x + w + pad, y + h + pad))
-        img.save(output_path, quality=95)
-        # delete original image if we wrote to a different path
-        if out_path != in_path:
-            in_path.unlink()
-        return 200, "OK", output_path
-
-    img.save(output_path, quality=95)
-    return 200, "OK", output_path
+
+    def __init__(self, features: Iterable[Dict[str, Any]], path: str):
+        """
+        Args:
+            features: Features that are always known, i.e., all locations.
+            path: Path to the server locations file.
+        """
+        self.path = path
+        self._base = {
+            feature["properties"]["id"]: format_machine_name(feature["properties"])
+            for feature in features
+        }
+        self._names = dict(self._base)
+        # Entries changed by commits which may not have reached the file yet
+        self._overrides: Dict[int, str] = {}
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+        names = dict(self._base)
+        for elem in io.iter_features(self.path, encoding="latin-1"):
+            names[elem["properties"]["id"]] = format_machine_name(elem["properties"])
+        # Overrides are obsolete once the file contains the same entry
+        self._overrides = {
+            machine_id: name
+            for machine_id, name in self._overrides.items()
+            if names.get(machine_id) != name
+        }
+        names.update(self._overrides)
+        self._names, self._stamp = names, stamp
+
+    def get(self, machine_id: int) -> Optional[str]:
+        """
+        Look up the formatted name of a machine.
+
+        Args:
+            machine_id: The ID of the machine.
+
+        Returns:
+            The formatted name or None if the machine is unknown.
+        """
+        with self._lock:
+            self._refresh()
+            return self._names.get(int(machine_id))
+
+    def update(self, feature: Dict[str, Any]):
+        """
+        Update a single machine, e.g., after a change was committed.
+
+        Args:
+            feature: The geojson feature of the machine.
+        """
+        name = format_machine_name(feature["properties"])
+        with self._lock:
+            self._overrides[feature["properties"]["id"]] = name
+            self._names[feature["properties"]["id"]] = name
+
+    def invalidate(self):
+        """Force a reload of the server locations file on the next lookup."""
+        with self._lock:
+            self._stamp = None
+
+
+MACHINE_NAMES = MachineNames(iter_all_locations(), PATH_SERVER_LOCATION)
 
 
 def image_slack(
@@ -123,25 +138,26 @@ def image_slack(
         fname_suffix: The suffix of the filename ("" or "_coin_x"). Defaults to "".
         m_name: The name of the machine. Defaults to None.
         img_slack_text: The text to display in the Slack message. Defaults to "Image uploaded for machine".
-
-    Raises:
-        e: SlackApiError
     """
     if m_name is None:
-        MACHINE_NAMES = reload_server_data()
-        if int(machine_id) not in MACHINE_NAMES.keys():
+        m_name = MACHINE_NAMES.get(machine_id)
+        if m_name is None:
             logger.error(f"Posting image, but ID {machine_id} not found in server data")
             return
-        m_name = MACHINE_NAMES[int(machine_id)]
     text = f"{img_slack_text} {machine_id} - {m_name} (from {ip})"
     if not filetype:
         filetype = "png" if "coin" in fname_suffix else "jpg"
+    filename = f"{machine_id}{fname_suffix}.{filetype}"
     try:
-        CLIENT.chat_postMessage(
-            channel="#pennyme_uploads",
-            text=text,
-            username="PennyMe",
-            blocks=[
+        image_url = hashed_image_url(filename, IMAGE_URL)
+    except FileNotFoundError:
+        image_url = f"{IMAGE_URL}{filename}"
+    OUTBOX.put(
+        {
+            "channel": SLACK_CHANNEL,
+            "text": text,
+            "username": "PennyMe",
+            "blocks": [
                 {
                     "type": "image",
                     "title": {
@@ -149,16 +165,12 @@ def image_slack(
                         "text": text,
                         "emoji": True,
                     },
-                    "image_url": f"{IMG_PORT}{machine_id}{fname_suffix}.{filetype}",
+                    "image_url": image_url,
                     "alt_text": text,
                 }
             ],
-        )
-    except SlackApiError as e:
-        print("Error sending message: ", e)
-        assert e.response["ok"] is False
-        assert e.response["error"]
-        raise e
+        }
+    )
 
 
 def message_slack(machine_id: str, comment_text: str, ip: str):
@@ -169,34 +181,75 @@ def message_slack(machine_id: str, comment_text: str, ip: str):
         machine_id: The ID of the machine, given as a string.
         comment_text: The comment to send.
         ip: The IP address of the user.
-
-    Raises:
-        e: SlackApiError, if the message could not be sent.
     """
-    MACHINE_NAMES = reload_server_data()
-    if int(machine_id) not in MACHINE_NAMES.keys():
+    m_name = MACHINE_NAMES.get(machine_id)
+    if m_name is None:
         logger.error(f"Messaging slack: {comment_text} but ID {machine_id} not found.")
-
-    m_name = MACHINE_NAMES[int(machine_id)]
+        m_name = "Unknown machine Status=unknown"
     prefix = m_name.split("Status=")[0]
     postfix = "Status=" + m_name.split("Status=")[-1]
     text = f"New comment for machine {machine_id} - {prefix}: {comment_text} (from {ip}. Machine: {postfix}"
 
-    message_slack_raw(text)
+    # Repeated comments on one machine are collapsed into a digest
+    message_slack_raw(text, digest_key=f"comment-{machine_id}")
 
 
-def message_slack_raw(text: str, *args, **kwargs):
+def message_slack_raw(text: str, *args, digest_key: Optional[str] = None, **kwargs):
     """
-    Send a message to Slack, unspecific to a machine.
+    Send a message to Slack, unspecific to a machine. The message is put into the
+    outbox and delivered by the background sender.
 
     Args:
         text: The message to send.
+        digest_key: Messages with the same key that are sent in short succession
+            are combined into one digest message. Defaults to None (no digest).
+    """
+    OUTBOX.put(
+        {"channel": SLACK_CHANNEL, "text": text, "username": "PennyMe"},
+        digest_key=digest_key,
+    )
+
+
+def post_to_slack(payload: Dict[str, Any]):
+    """
+    Deliver one outbox message to Slack.
+
+    Args:
+        payload: Keyword arguments for `chat_postMessage`.
+
+    Raises:
+        RetryLater: If Slack rate limits the client (HTTP 429).
+        SlackApiError: If the message could not be sent.
     """
     try:
-        CLIENT.chat_postMessage(
-            channel="#pennyme_uploads", text=text, username="PennyMe"
-        )
+        CLIENT.chat_postMessage(**payload)
     except SlackApiError as e:
-        assert e.response["ok"] is False
-        assert e.response["error"]
+        if e.response.status_code == 429:
+            raise RetryLater(float(e.response.headers.get("Retry-After", 1)))
         raise e
+
+
+def combine_messages(payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine several text messages into one digest message.
+
+    Args:
+        payloads: The messages to combine.
+
+    Returns:
+        The digest message.
+    """
+    text = f"Digest of {len(payloads)} messages:\n" + "\n".join(
+        f"• {payload['text']}" for payload in payloads
+    )
+    if len(text) > MAX_TEXT_LENGTH:
+        text = text[:MAX_TEXT_LENGTH] + "\n... (truncated)"
+    return {**payloads[0], "text": text}
+
+
+def start_slack_sender():
+    """Start the background thread that delivers the Slack outbox."""
+    OUTBOX.start()
+
+
+OUTBOX = Outbox(PATH_OUTBOX, send=post_to_slack, combine=combine_messages)
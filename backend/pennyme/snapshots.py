@@ -0,0 +1,307 @@
+"""Compressed snapshots of everything a location differ run reads from the web."""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from googlemaps import Client as GoogleMaps
+from loguru import logger
+
+from pennyme.links import LinkStatus
+
+# Number of runs that are kept, blobs only referenced by older runs are removed
+KEEP_RUNS = 30
+# Link checks and geocodes are carried over to the next runs until they were not
+# looked up in this many runs
+CARRY_RUNS = KEEP_RUNS
+CARRIED_KINDS = ["links", "geocodes"]
+
+
+class SnapshotStore:
+    """
+    Stores the raw pennycollector pages, the loaded data files and the results of
+    link checks and geocoding of each differ run. Pages and files are compressed
+    and stored once per content hash, each run has an index keyed by URL. A
+    stored run can be replayed offline.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        replay: Optional[str] = None,
+        reuse_parsed: bool = True,
+        keep_runs: int = KEEP_RUNS,
+    ):
+        """
+        Args:
+            root: Folder of the store.
+            replay: ID of the run to replay (or `latest`). Defaults to None, i.e.,
+                pages are fetched and a new run is recorded.
+            reuse_parsed: Whether pages that were parsed before are not parsed
+                again. Defaults to True.
+            keep_runs: Number of runs to keep. Defaults to KEEP_RUNS.
+        """
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.run_dir = os.path.join(root, "runs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.reuse_parsed = reuse_parsed
+        self.keep_runs = keep_runs
+
+        runs = self.runs()
+        self.previous = self._load_run(runs[-1]) if runs else None
+        self.replayed = None
+        if replay is not None:
+            if replay == "latest":
+                if not runs:
+                    raise ValueError(f"There are no runs in {root} to replay")
+                replay = runs[-1]
+            self.replayed = self._load_run(replay)
+            logger.info(f"Replaying snapshot {replay}")
+
+        self.run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.index: Dict[str, Dict[str, Any]] = {
+            "pages": {},
+            "files": {},
+            "links": {},
+            "geocodes": {},
+            # Number of runs since the carried over entries were last looked up
+            "carried": {kind: {} for kind in CARRIED_KINDS},
+        }
+        # Link checks and geocodes of earlier runs are carried over, since a
+        # replay may need results of listings that the recorded run skipped.
+        # Entries that are not looked up again expire after CARRY_RUNS runs.
+        source = self.replayed or self.previous
+        if source is not None:
+            for kind in CARRIED_KINDS:
+                ages = source.get("carried", {}).get(kind, {})
+                for key, value in source[kind].items():
+                    age = ages.get(key, 0) + 1
+                    if age <= CARRY_RUNS:
+                        self.index[kind][key] = value
+                        self.index["carried"][kind][key] = age
+        self.unchanged_pages = 0
+        self.parses_reused = 0
+        self._lock = threading.Lock()
+
+    def runs(self) -> List[str]:
+        """
+        Get the IDs of the stored runs.
+
+        Returns:
+            The run IDs, oldest first.
+        """
+        return sorted(
+            name[: -len(".json")]
+            for name in os.listdir(self.run_dir)
+            if name.endswith(".json")
+        )
+
+    def _load_run(self, run_id: str) -> Dict[str, Dict[str, Any]]:
+        with open(os.path.join(self.run_dir, run_id + ".json"), "r") as f:
+            return json.load(f)
+
+    def _blob_path(self, sha: str, suffix: str = ".gz") -> str:
+        return os.path.join(self.blob_dir, sha[:2], sha + suffix)
+
+    def _write_blob(self, sha: str, content: bytes, suffix: str = ".gz"):
+        path = self._blob_path(sha, suffix)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(gzip.compress(content))
+        os.replace(tmp_path, path)
+
+    def _read_blob(self, sha: str, suffix: str = ".gz") -> bytes:
+        with open(self._blob_path(sha, suffix), "rb") as f:
+            return gzip.decompress(f.read())
+
+    def _replayed(self, kind: str, key: str) -> Any:
+        try:
+            return self.replayed[kind][key]
+        except KeyError:
+            raise KeyError(f"The replayed snapshot contains no {kind} entry for {key}")
+
+    def fetch_page(self, url: str, fetch: Callable[[str], bytes]) -> bytes:
+        """
+        Get a page and store it in this run.
+
+        Args:
+            url: URL of the page.
+            fetch: Function to download the page, not used when replaying.
+
+        Returns:
+            The raw content of the page.
+        """
+        if self.replayed is not None:
+            content = self._read_blob(self._replayed("pages", url))
+        else:
+            content = fetch(url)
+        sha = hashlib.sha256(content).hexdigest()
+        self._write_blob(sha, content)
+        with self._lock:
+            self.index["pages"][url] = sha
+            if self.previous is not None and self.previous["pages"].get(url) == sha:
+                self.unchanged_pages += 1
+        return content
+
+    def parsed(self, content: bytes, parse: Callable[[bytes], Any]) -> Any:
+        """
+        Parse a page. The result is stored with the content hash, such that a page
+        that did not change is not parsed again.
+
+        Args:
+            content: Raw content of the page.
+            parse: Function converting the page into JSON serializable data.
+
+        Returns:
+            The result of the parse function.
+        """
+        sha = hashlib.sha256(content).hexdigest()
+        suffix = f".{parse.__name__}.json.gz"
+        if self.reuse_parsed and os.path.exists(self._blob_path(sha, suffix)):
+            with self._lock:
+                self.parses_reused += 1
+            return json.loads(self._read_blob(sha, suffix))
+        result = parse(content)
+        self._write_blob(sha, json.dumps(result).encode(), suffix)
+        return result
+
+    def load_file(
+        self, name: str, load: Callable[[], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Load a JSON data file and store it in this run.
+
+        Args:
+            name: Name of the file within the run, e.g., `server_locations`.
+            load: Function to load the data, not used when replaying.
+
+        Returns:
+            The loaded data.
+        """
+        if self.replayed is not None:
+            content = self._read_blob(self._replayed("files", name))
+        else:
+            content = json.dumps(load(), ensure_ascii=False).encode("utf8")
+        sha = hashlib.sha256(content).hexdigest()
+        self._write_blob(sha, content)
+        self.index["files"][name] = sha
+        return json.loads(content)
+
+    def geocode(
+        self, query: str, geocode: Optional[Callable[[str], List[Dict[str, Any]]]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Geocode a query and store the result in this run.
+
+        Args:
+            query: The query, e.g., an address.
+            geocode: Geocoding function, not used when replaying.
+
+        Returns:
+            The geocoding results.
+        """
+        if self.replayed is not None:
+            result = self._replayed("geocodes", query)
+        else:
+            result = geocode(query)
+        with self._lock:
+            self.index["geocodes"][query] = result
+            self.index["carried"]["geocodes"].pop(query, None)
+        return result
+
+    def replayed_link(self, url: str) -> Optional[LinkStatus]:
+        """
+        Get the result of a link check of the replayed run.
+
+        Args:
+            url: The checked link.
+
+        Returns:
+            The status of the link, or None if the link could not be reached.
+        """
+        status = self._replayed("links", url)
+        return None if status is None else LinkStatus(*status)
+
+    def record_links(self, results: Dict[str, Optional[LinkStatus]]):
+        """
+        Store the results of the link checks of this run.
+
+        Args:
+            results: Dictionary mapping each link to its status.
+        """
+        self.index["links"].update(
+            {
+                url: None
+                if status is None
+                else [status.status_code, status.reason, status.checked_at]
+                for url, status in results.items()
+            }
+        )
+        for url in results:
+            self.index["carried"]["links"].pop(url, None)
+
+    def save(self):
+        """
+        Persist the index of this run, to be called after a successful run, and
+        remove the runs (and their blobs) exceeding `keep_runs`. Replays are not
+        stored.
+        """
+        if self.replayed is not None:
+            return
+        tmp_path = os.path.join(self.run_dir, self.run_id + ".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, os.path.join(self.run_dir, self.run_id + ".json"))
+
+        runs = self.runs()
+        if len(runs) <= self.keep_runs:
+            return
+        for run_id in runs[: -self.keep_runs]:
+            os.remove(os.path.join(self.run_dir, run_id + ".json"))
+        referenced = set()
+        for run_id in runs[-self.keep_runs :]:
+            run = self._load_run(run_id)
+            referenced.update(run["pages"].values())
+            referenced.update(run["files"].values())
+        for folder, _, files in os.walk(self.blob_dir):
+            for name in files:
+                if name.split(".")[0] not in referenced:
+                    os.remove(os.path.join(folder, name))
+
+
+class SnapshotGeocoder:
+    """Geocoder with the interface of the Google Maps client used by the differ."""
+
+    def __init__(self, store: SnapshotStore, client: Optional[GoogleMaps] = None):
+        """
+        Args:
+            store: Store in which the results are recorded or from which they are
+                replayed.
+            client: Google Maps client. Defaults to None, only possible when
+                replaying.
+        """
+        self.store = store
+        self.client = client
+
+    def geocode(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Geocode a query.
+
+        Args:
+            query: The query, e.g., an address.
+
+        Returns:
+            The geocoding results, as from the Google Maps client.
+        """
+        return self.store.geocode(
+            query, None if self.client is None else self.client.geocode
+        )
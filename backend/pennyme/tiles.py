@@ -0,0 +1,320 @@
+"""
+Export of the machines into GeoJSON tiles for the web map. Every zoom level in
+TILE_LEVELS has one file per non-empty tile, `<folder>/<z>/<x>/<y>.json`, in the
+Web Mercator tiling of Mapbox. A tile only holds the properties the map needs at
+its zoom, e.g., the status for the color of the pin but not the address.
+
+The manifest (`manifest.json`) lists the levels and every tile with its number of
+features and hash, such that the map only downloads tiles that exist and caches
+them until they change. A build also stores the hash and tile of every machine
+(`state.json`), the next build then only rewrites the tiles of changed machines.
+"""
+
+import hashlib
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from pennyme import io
+
+MANIFEST_FILE = "manifest.json"
+STATE_FILE = "state.json"
+# Latitude limit of the Web Mercator projection
+MAX_LATITUDE = 85.0511287798
+
+
+@dataclass
+class TileLevel:
+    """Content of the tiles of one zoom level."""
+
+    zoom: int
+    # Properties of the features, if present
+    properties: Tuple[str, ...]
+    # Decimal places of the coordinates
+    digits: int
+
+
+# The map uses the closest level at or below its zoom. Pins are only clicked at
+# the highest level, which has all properties shown in the popup.
+TILE_LEVELS = [
+    TileLevel(2, ("id", "machine_status"), digits=3),
+    TileLevel(5, ("id", "machine_status", "name"), digits=4),
+    TileLevel(
+        8,
+        (
+            "id",
+            "name",
+            "area",
+            "address",
+            "machine_status",
+            "last_updated",
+            "external_url",
+            "multimachine",
+            "paywall",
+        ),
+        digits=6,
+    ),
+]
+
+
+@dataclass
+class TileBuild:
+    """Result of a build of the tiles."""
+
+    features: int = 0
+    # Machines that were added, changed or removed since the last build
+    changed: int = 0
+    written: int = 0
+    removed: int = 0
+    # Tiles of changed machines whose content did not change
+    unchanged: int = 0
+
+
+def tile_of(lng: float, lat: float, zoom: int) -> Tuple[int, int]:
+    """
+    Find the tile of a point.
+
+    Args:
+        lng: Longitude in degrees.
+        lat: Latitude in degrees, clamped to the limits of Web Mercator.
+        zoom: The zoom level.
+
+    Returns:
+        The x and y index of the tile.
+    """
+    n = 1 << zoom
+    lat = math.radians(min(max(lat, -MAX_LATITUDE), MAX_LATITUDE))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """
+    Find the area covered by a tile.
+
+    Args:
+        zoom: The zoom level.
+        x: The x index of the tile.
+        y: The y index of the tile.
+
+    Returns:
+        West, south, east and north bound in degrees.
+    """
+    n = 1 << zoom
+
+    def latitude(y: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return (
+        x / n * 360.0 - 180.0,
+        latitude(y + 1),
+        (x + 1) / n * 360.0 - 180.0,
+        latitude(y),
+    )
+
+
+def project(feature: Dict[str, Any], level: TileLevel) -> Dict[str, Any]:
+    """
+    Reduce a feature to the content of the tiles of a level.
+
+    Args:
+        feature: The feature.
+        level: The level.
+
+    Returns:
+        A point with the properties of the level.
+    """
+    lng, lat = feature["geometry"]["coordinates"]
+    properties = feature["properties"]
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [round(lng, level.digits), round(lat, level.digits)],
+        },
+        "properties": {k: properties[k] for k in level.properties if k in properties},
+    }
+
+
+def _digest(data: Any) -> str:
+    # Short and stable digest, e.g., of a projected feature
+    return hashlib.blake2b(repr(data).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _tile_path(folder: str, name: str) -> str:
+    return os.path.join(folder, *name.split("/")) + ".json"
+
+
+def _write(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _remove_tile(folder: str, path: str):
+    # Remove the file and the folders that became empty
+    if os.path.exists(path):
+        os.remove(path)
+    path = os.path.dirname(path)
+    while path != folder and os.path.isdir(path) and not os.listdir(path):
+        os.rmdir(path)
+        path = os.path.dirname(path)
+
+
+def save_tile(
+    folder: str,
+    name: str,
+    features: List[Dict[str, Any]],
+    tiles: Dict[str, Dict[str, Any]],
+    force: bool = False,
+) -> str:
+    """
+    Write the file of a tile unless its content did not change, or remove it if
+    it has no features.
+
+    Args:
+        folder: The output folder.
+        name: Name of the tile, `<z>/<x>/<y>`.
+        features: The features of the tile.
+        tiles: The tiles of the manifest, updated in place.
+        force: Whether to write the file even if its content did not change.
+            Defaults to False.
+
+    Returns:
+        "written", "unchanged", "removed" or "" if an empty tile did not exist.
+    """
+    path = _tile_path(folder, name)
+    if not features:
+        _remove_tile(folder, path)
+        return "removed" if tiles.pop(name, None) else ""
+    content = io.dumps_compact({"type": "FeatureCollection", "features": features})
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    unchanged = tiles.get(name, {}).get("hash") == digest
+    if unchanged and not force and os.path.exists(path):
+        return "unchanged"
+    _write(path, content)
+    tiles[name] = {"count": len(features), "hash": digest}
+    return "written"
+
+
+def sort_tiles(tiles: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Sort the tiles of a manifest by zoom, x and y.
+
+    Args:
+        tiles: The tiles by name.
+
+    Returns:
+        The sorted tiles.
+    """
+    return dict(sorted(tiles.items(), key=lambda x: tuple(map(int, x[0].split("/")))))
+
+
+def build_tiles(
+    features: Iterable[Dict[str, Any]],
+    folder: str,
+    levels: Optional[List[TileLevel]] = None,
+    full: bool = False,
+) -> TileBuild:
+    """
+    Build the tiles of all machines. If the folder contains a previous build, only
+    the tiles whose content depends on an added, changed or removed machine are
+    written, e.g., a new address only changes a tile of the highest level.
+
+    Args:
+        features: The features, e.g., streamed from the combined locations. The
+            features of a tile are ordered by id, such that the tiles do not depend
+            on this order.
+        folder: The output folder.
+        levels: The zoom levels. Defaults to TILE_LEVELS.
+        full: Whether to rewrite all tiles, even if a previous build exists.
+            Defaults to False.
+
+    Returns:
+        The counts of the build.
+    """
+    levels = levels or TILE_LEVELS
+    max_zoom = max(level.zoom for level in levels)
+    manifest_path = os.path.join(folder, MANIFEST_FILE)
+    state_path = os.path.join(folder, STATE_FILE)
+    layout = {
+        "zooms": [level.zoom for level in levels],
+        "properties": {str(level.zoom): list(level.properties) for level in levels},
+        "digits": {str(level.zoom): level.digits for level in levels},
+    }
+    tiles: Dict[str, Dict[str, Any]] = {}
+    previous: Dict[str, List[Any]] = {}
+    if os.path.exists(manifest_path):
+        manifest = io.load(manifest_path)
+        tiles = manifest["tiles"]
+        # A build with other levels can not be updated
+        if not full and os.path.exists(state_path) and manifest["layout"] == layout:
+            previous = io.load(state_path)["features"]
+
+    # The state of a machine is the hash of its feature, its tile at the highest
+    # zoom (which determines the tiles at lower zooms) and the digest of its
+    # content at every level. It is only computed for changed features.
+    build, state, entries = TileBuild(), {}, []
+    for feature in features:
+        build.features += 1
+        machine_id = str(feature["properties"]["id"])
+        digest = io.canonical_hash(feature)[:16]
+        old = previous.get(machine_id)
+        if old is None or old[0] != digest:
+            x, y = tile_of(*feature["geometry"]["coordinates"], max_zoom)
+            projections = [_digest(project(feature, level)) for level in levels]
+            state[machine_id] = [digest, x, y, projections]
+        else:
+            state[machine_id] = old
+        entries.append(
+            (
+                state[machine_id][1],
+                state[machine_id][2],
+                feature["properties"]["id"],
+                feature,
+            )
+        )
+
+    touched: Set[Tuple[int, int, int]] = set()
+    for machine_id in state.keys() | previous.keys():
+        new, old = state.get(machine_id), previous.get(machine_id)
+        if new == old:
+            continue
+        build.changed += 1
+        for i, level in enumerate(levels):
+            shift = max_zoom - level.zoom
+            new_tile = new and (level.zoom, new[1] >> shift, new[2] >> shift)
+            old_tile = old and (level.zoom, old[1] >> shift, old[2] >> shift)
+            if new_tile == old_tile and new[3][i] == old[3][i]:
+                continue
+            touched.update(filter(None, [new_tile, old_tile]))
+    if not previous:
+        # Also remove the tiles of a previous build that are empty now
+        touched.update(tuple(map(int, name.split("/"))) for name in tiles)
+
+    groups: Dict[Tuple[int, int, int], List[Tuple[Any, Dict[str, Any]]]] = {
+        tile: [] for tile in touched
+    }
+    for x, y, feature_id, feature in entries:
+        for level in levels:
+            shift = max_zoom - level.zoom
+            group = groups.get((level.zoom, x >> shift, y >> shift))
+            if group is not None:
+                group.append((feature_id, project(feature, level)))
+
+    for (zoom, x, y), group in sorted(groups.items()):
+        group.sort(key=lambda item: item[0])
+        projections = [projection for _, projection in group]
+        result = save_tile(folder, f"{zoom}/{x}/{y}", projections, tiles, force=full)
+        build.written += result == "written"
+        build.unchanged += result == "unchanged"
+        build.removed += result == "removed"
+
+    tiles = sort_tiles(tiles)
+    # The state is written last, an interrupted build is repeated by the next one
+    io.dump({"layout": layout, "tiles": tiles}, manifest_path)
+    state = dict(sorted(state.items()))
+    _write(state_path, io.dumps_compact({"features": state}))
+    return build
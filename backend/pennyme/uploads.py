@@ -0,0 +1,289 @@
+"""Spooling of chunked, resumable uploads to disk."""
+
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+PATH_UPLOADS = os.path.join("..", "..", "images", "uploads")
+UPLOAD_KINDS = ["image", "machine"]
+# Uploads are images, anything larger is rejected
+MAX_UPLOAD_SIZE = 30 * 1024 * 1024
+# Unfinished uploads are deleted after one day
+UPLOAD_TTL = 24 * 60 * 60
+CHUNK_READ_SIZE = 64 * 1024
+
+_UPLOAD_LOCKS: Dict[str, threading.Lock] = {}
+_LOCKS_LOCK = threading.Lock()
+# Finalized uploads with the time of finalization and the result of their
+# processing, such that a client retrying the finalize gets the same result
+_FINALIZED: Dict[str, Tuple[float, Optional[Any]]] = {}
+
+
+class UploadError(Exception):
+    """Raised for invalid upload requests, carries the HTTP status code."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _lock(upload_id: str) -> threading.Lock:
+    with _LOCKS_LOCK:
+        return _UPLOAD_LOCKS.setdefault(upload_id, threading.Lock())
+
+
+def _paths(upload_id: str, uploads_dir: str) -> Tuple[str, str]:
+    # IDs are hex strings, everything else could escape the upload folder
+    if not upload_id.isalnum():
+        raise UploadError(f"Unknown upload {upload_id}", 404)
+    meta_path = os.path.join(uploads_dir, f"{upload_id}.json")
+    if not os.path.exists(meta_path):
+        if upload_id in _FINALIZED:
+            raise UploadError(f"Upload {upload_id} was already finalized", 409)
+        raise UploadError(f"Unknown upload {upload_id}", 404)
+    return meta_path, os.path.join(uploads_dir, f"{upload_id}.part")
+
+
+@contextmanager
+def _locked(upload_id: str, uploads_dir: str) -> Iterator[None]:
+    # Only existing uploads get a lock, it is dropped once the upload is gone
+    meta_path, _ = _paths(upload_id, uploads_dir)
+    try:
+        with _lock(upload_id):
+            yield
+    finally:
+        if not os.path.exists(meta_path):
+            with _LOCKS_LOCK:
+                _UPLOAD_LOCKS.pop(upload_id, None)
+
+
+def create_upload(
+    kind: str,
+    size: int,
+    params: Dict[str, str],
+    ip: str,
+    uploads_dir: str = PATH_UPLOADS,
+) -> str:
+    """
+    Initiate a chunked upload.
+
+    Args:
+        kind: What is uploaded, `image` (for `/upload_image`) or `machine` (for
+            `/create_machine`).
+        size: Total size of the upload in bytes.
+        params: Query parameters of the request that is finalized with the upload.
+        ip: The IP address of the user.
+        uploads_dir: Folder to spool the uploads to. Defaults to PATH_UPLOADS.
+
+    Raises:
+        UploadError: If the kind or size are invalid.
+
+    Returns:
+        ID of the upload.
+    """
+    if kind not in UPLOAD_KINDS:
+        raise UploadError(f"Unknown upload kind {kind}, choose from {UPLOAD_KINDS}")
+    if size <= 0 or size > MAX_UPLOAD_SIZE:
+        raise UploadError(f"Upload size must be between 1 and {MAX_UPLOAD_SIZE}")
+
+    os.makedirs(uploads_dir, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    meta = {
+        "kind": kind,
+        "size": size,
+        "params": params,
+        "ip": ip,
+        "created": time.time(),
+    }
+    # Create the (empty) data file first, the metadata marks the upload as valid
+    open(os.path.join(uploads_dir, f"{upload_id}.part"), "wb").close()
+    with open(os.path.join(uploads_dir, f"{upload_id}.json"), "w") as f:
+        json.dump(meta, f, indent=4)
+    return upload_id
+
+
+def get_upload(upload_id: str, uploads_dir: str = PATH_UPLOADS) -> Dict[str, Any]:
+    """
+    Get the metadata and the number of received bytes of an upload. Clients use
+    the offset to resume an interrupted upload.
+
+    Args:
+        upload_id: ID of the upload.
+        uploads_dir: Folder with the uploads. Defaults to PATH_UPLOADS.
+
+    Raises:
+        UploadError: If the upload does not exist.
+
+    Returns:
+        The metadata of the upload with the current `offset`.
+    """
+    meta_path, part_path = _paths(upload_id, uploads_dir)
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    meta["offset"] = os.path.getsize(part_path)
+    return meta
+
+
+def append_chunk(
+    upload_id: str, offset: int, stream: BinaryIO, uploads_dir: str = PATH_UPLOADS
+) -> int:
+    """
+    Append a chunk to an upload. The chunk has to start exactly at the number of
+    bytes received so far, such that retried or reordered chunks are detected.
+
+    Args:
+        upload_id: ID of the upload.
+        offset: Position of the chunk within the upload.
+        stream: Stream with the content of the chunk.
+        uploads_dir: Folder with the uploads. Defaults to PATH_UPLOADS.
+
+    Raises:
+        UploadError: If the upload does not exist (404), the offset does not
+            match (409) or the chunk exceeds the announced size (413).
+
+    Returns:
+        The new offset, i.e., the number of bytes received so far.
+    """
+    with _locked(upload_id, uploads_dir):
+        meta = get_upload(upload_id, uploads_dir)
+        if offset != meta["offset"]:
+            raise UploadError(
+                f"Chunk offset {offset} does not match received bytes {meta['offset']}",
+                409,
+            )
+        _, part_path = _paths(upload_id, uploads_dir)
+        received = meta["offset"]
+        with open(part_path, "ab") as f:
+            for data in iter(lambda: stream.read(CHUNK_READ_SIZE), b""):
+                received += len(data)
+                if received > meta["size"]:
+                    # Drop the incomplete chunk such that it can be resent
+                    f.truncate(offset)
+                    raise UploadError("Chunk exceeds the announced upload size", 413)
+                f.write(data)
+        return received
+
+
+def finalize_upload(
+    upload_id: str, target_path: str, uploads_dir: str = PATH_UPLOADS
+) -> Dict[str, Any]:
+    """
+    Complete an upload by moving the spooled file to its target location. The
+    upload is remembered as finalized, see `set_upload_result`.
+
+    Args:
+        upload_id: ID of the upload.
+        target_path: Where the uploaded file should be stored.
+        uploads_dir: Folder with the uploads. Defaults to PATH_UPLOADS.
+
+    Raises:
+        UploadError: If the upload does not exist (404), is incomplete or was
+            already finalized (409).
+
+    Returns:
+        The metadata of the upload.
+    """
+    with _locked(upload_id, uploads_dir):
+        meta = get_upload(upload_id, uploads_dir)
+        if meta["offset"] != meta["size"]:
+            raise UploadError(
+                f"Upload incomplete, received {meta['offset']}/{meta['size']} bytes",
+                409,
+            )
+        meta_path, part_path = _paths(upload_id, uploads_dir)
+        shutil.move(part_path, target_path)
+        with _LOCKS_LOCK:
+            _FINALIZED[upload_id] = (time.time(), None)
+        os.remove(meta_path)
+    return meta
+
+
+def set_upload_result(upload_id: str, result: Any):
+    """
+    Store the result of processing a finalized upload, e.g., the response.
+
+    Args:
+        upload_id: ID of the upload, results of uploads that were not finalized
+            are ignored.
+        result: The result.
+    """
+    with _LOCKS_LOCK:
+        if upload_id in _FINALIZED:
+            _FINALIZED[upload_id] = (_FINALIZED[upload_id][0], result)
+
+
+def get_upload_result(upload_id: str) -> Optional[Any]:
+    """
+    Get the result of a finalized upload, it is kept for the time to live of
+    uploads.
+
+    Args:
+        upload_id: ID of the upload.
+
+    Returns:
+        The result stored with `set_upload_result`, None if there is none (yet).
+    """
+    with _LOCKS_LOCK:
+        return _FINALIZED.get(upload_id, (0.0, None))[1]
+
+
+def _last_modified(paths: List[str]) -> Optional[float]:
+    # Newest modification time of the files of an upload, None if all are gone
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.path.getmtime(path))
+        except FileNotFoundError:
+            pass
+    return max(mtimes, default=None)
+
+
+def cleanup_stale_uploads(uploads_dir: str = PATH_UPLOADS, ttl: int = UPLOAD_TTL):
+    """
+    Delete uploads that were not finalized within the time to live. An upload
+    expires once neither its metadata nor its data were modified within the time
+    to live, such that a resumed upload keeps its metadata while chunks arrive.
+    Uploads that are currently written to are skipped.
+
+    Args:
+        uploads_dir: Folder with the uploads. Defaults to PATH_UPLOADS.
+        ttl: Time to live in seconds. Defaults to UPLOAD_TTL.
+    """
+    with _LOCKS_LOCK:
+        for upload_id, (finalized, _) in list(_FINALIZED.items()):
+            if time.time() - finalized > ttl:
+                del _FINALIZED[upload_id]
+    if not os.path.isdir(uploads_dir):
+        return
+    uploads: Dict[str, List[str]] = {}
+    for name in os.listdir(uploads_dir):
+        upload_id = os.path.splitext(name)[0]
+        uploads.setdefault(upload_id, []).append(os.path.join(uploads_dir, name))
+    now = time.time()
+    for upload_id, paths in uploads.items():
+        modified = _last_modified(paths)
+        if modified is None or now - modified <= ttl:
+            continue
+        lock = _lock(upload_id)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            # A chunk may have arrived since the folder was listed
+            modified = _last_modified(paths)
+            if modified is not None and time.time() - modified <= ttl:
+                continue
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Removed by a concurrent cleanup
+                    pass
+        finally:
+            lock.release()
+        with _LOCKS_LOCK:
+            _UPLOAD_LOCKS.pop(upload_id, None)
@@ -1,14 +1,17 @@
-import json
 import os
+import re
 import sys
+import threading
 from contextlib import contextmanager
 from copy import deepcopy
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
-import requests
 from loguru import logger
 
+from pennyme import io
+from pennyme.links import LinkValidator
 from pennyme.pennycollector import DAY, MONTH, YEAR
+from pennyme.validation import FOOTER, HEADER, ID_LINE
 
 PATH_IMAGES = os.path.join("..", "..", "images")
 TODAY = f"{YEAR}-{MONTH}-{DAY}"
@@ -17,8 +20,99 @@ THIS_PATH = os.path.abspath(__file__)
 PATH_MACHINES = os.path.join(
     os.path.dirname(THIS_PATH), "..", "..", "data", "all_locations.json"
 )
-with open(PATH_MACHINES, "r", encoding="latin-1") as infile:
-    ALL_LOCATIONS = json.load(infile)
+# First line of a feature in the format of the repository
+_FEATURE_LINE = re.compile(rb"\n        \{\n")
+
+
+def iter_all_locations(path: str = PATH_MACHINES) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the features of all_locations.json, which is too large to be kept in
+    memory by every process.
+
+    Args:
+        path: Path to the file. Defaults to PATH_MACHINES.
+
+    Yields:
+        The features in the order of the file.
+    """
+    yield from io.iter_features(path, encoding="latin-1")
+
+
+def feature_spans(content: bytes) -> Optional[Dict[int, Tuple[int, int]]]:
+    """
+    Find the byte range of every feature of a file in the format of the
+    repository (see `pennyme.io`).
+
+    Args:
+        content: The raw content of the file.
+
+    Returns:
+        The start and end of every feature by ID, the first one for duplicate IDs.
+            None if the file is not in the format of the repository.
+    """
+    if not content.startswith(HEADER) or not content.endswith(FOOTER):
+        return None
+    # A feature starts after the newline of the match and ends before its comma
+    starts = [m.start() + 1 for m in _FEATURE_LINE.finditer(content)]
+    ends = [start - 2 for start in starts[1:]] + [len(content) - len(FOOTER)]
+    spans: Dict[int, Tuple[int, int]] = {}
+    for start, end in zip(starts, ends):
+        match = ID_LINE.search(content, start, end)
+        if match is None:
+            return None
+        spans.setdefault(int(match.group(1)), (start, end))
+    return spans
+
+
+class LocationIndex:
+    """
+    Lookup of the machines in all_locations.json by ID, without keeping the
+    features in memory. The byte range of every feature is indexed, and like
+    `pennyme.slack.MachineNames`, the index is only built again if the modification
+    time or size of the file changed.
+    """
+
+    def __init__(self, path: str = PATH_MACHINES):
+        """
+        Args:
+            path: Path to the file. Defaults to PATH_MACHINES.
+        """
+        self.path = path
+        self._spans: Optional[Dict[int, Tuple[int, int]]] = None
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    def get(self, machine_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Look up a machine.
+
+        Args:
+            machine_id: The ID of the machine.
+
+        Returns:
+            The feature of the machine or None if the machine is unknown.
+        """
+        # The file is read through one handle, such that a replaced file is
+        # never read with the index of its predecessor
+        with self._lock, open(self.path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if stamp != self._stamp:
+                self._spans, self._stamp = feature_spans(f.read()), stamp
+            if self._spans is None:
+                # Not in the format of the repository, search all features
+                for feature in iter_all_locations(self.path):
+                    if feature["properties"]["id"] == machine_id:
+                        return feature
+                return None
+            span = self._spans.get(machine_id)
+            if span is None:
+                return None
+            f.seek(span[0])
+            return io.loads(f.read(span[1] - span[0]).decode("latin-1"))
+
+
+ALL_LOCATIONS = LocationIndex()
 
 
 def find_machine_in_database(
@@ -47,10 +141,7 @@ def find_machine_in_database(
             break
     # search in all_locations
     if index_in_server_locations < 0:
-        for machine_entry in ALL_LOCATIONS["features"]:
-            if machine_entry["properties"]["id"] == machine_id:
-                existing_machine_entry = machine_entry
-                break
+        existing_machine_entry = ALL_LOCATIONS.get(machine_id)
     return existing_machine_entry, index_in_server_locations
 
 
@@ -67,11 +158,8 @@ def get_next_free_machine_id(
     Returns:
         ID of next available machine.
     """
-    with open(all_locations_path, "r") as infile:
-        all_locations = json.load(infile)
-
     # Identify IDs in existing data
-    all_ids = [i["properties"]["id"] for i in all_locations["features"]]
+    all_ids = [i["properties"]["id"] for i in io.iter_features(all_locations_path)]
     server_ids = [i["properties"]["id"] for i in server_locations]
 
     # identify picture IDs (ignore coin IDs)
@@ -94,7 +182,8 @@ def get_next_free_machine_id(
 def verify_remaining_machines(
     server_data: Dict[str, Any],
     device_data: Dict[str, Any],
-    validated_links: List[str],
+    validated_links: Set[str],
+    validator: Optional[LinkValidator] = None,
 ) -> Dict[str, Any]:
     """
     Takes the final data of all machines and verifies that all links are sane.
@@ -103,6 +192,8 @@ def verify_remaining_machines(
         server_data: Compiled data to be stored on server
         device_data: Compiled data to be stored on device
         validated_links: Links that have already be verified (to save time).
+        validator: Validator to check the links with. Defaults to None, i.e., a
+            new validator without persistent cache.
 
     Returns:
         Updated problem dictionary.
@@ -115,6 +206,17 @@ def verify_remaining_machines(
         machine["properties"]["source"] = "Server"
         id_to_entry[machine["properties"]["id"]] = machine
 
+    # Check all remaining links concurrently before evaluating them
+    validator = validator or LinkValidator()
+    validator.prefetch(
+        {
+            machine["properties"]["external_url"]
+            for machine in id_to_entry.values()
+            if machine["properties"]["external_url"] != "null"
+        }
+        - validated_links
+    )
+
     for mid, machine in id_to_entry.items():
         url = machine["properties"]["external_url"]
         source = machine["properties"]["source"]
@@ -122,7 +224,10 @@ def verify_remaining_machines(
         if url == "null":
             continue
         if url not in validated_links:
-            resp = requests.get(url)
+            resp = validator.check(url)
+            if resp is None:
+                # Log message already captured in the validator
+                continue
             if resp.reason != "OK":
                 title = machine["properties"]["name"]
                 area = machine["properties"]["area"]
@@ -142,7 +247,7 @@ def verify_remaining_machines(
                             server_machine["properties"]["last_updated"] = TODAY
                             server_data["features"].append(server_machine)
             else:
-                validated_links.append(url)
+                validated_links.add(url)
     return server_data
 
 
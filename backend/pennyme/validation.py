@@ -0,0 +1,370 @@
+"""
+Validation of the location data files, used by the pre-commit hook. Features are
+checked against a schema that is compiled once into per-field checks, and ids must
+be unique within each file.
+
+Files in the format of the repository (see `pennyme.io`) can be validated without
+parsing them as a whole: either only the features touched by the staged changes,
+or in parallel chunks split at feature boundaries.
+"""
+
+import os
+import re
+import subprocess
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from pennyme import io
+from pennyme.locations import AREAS, COUNTRIES, COUNTRY_TO_CODE
+
+MACHINE_STATUSES = {"available", "retired", "out-of-order"}
+AREA_VOCABULARY = set(AREAS) | set(COUNTRIES) | set(COUNTRY_TO_CODE)
+# Files below this size are validated in the main process
+MIN_PARALLEL_SIZE = 4 * 2**20
+# Validate everything if the staged changes touch more features than this fraction
+MAX_CHANGED_FRACTION = 0.2
+# Reported errors per file
+MAX_ERRORS = 50
+
+# Lines of the repository format, see `pennyme.io`
+HEADER = b'{\n    "type": "FeatureCollection",\n    "features": [\n'
+FOOTER = b"\n    ]\n}"
+FEATURE_START = b"        {"
+FEATURE_ENDS = (b"        },", b"        }")
+FEATURES_START = b'    "features": ['
+FEATURES_END = b"    ]"
+_SEPARATOR = b"\n        },\n        {\n"
+# Starts with a literal to be fast on large files
+ID_LINE = re.compile(rb'\n                "id": (-?\d+)')
+_HUNK = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@", re.MULTILINE)
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+@dataclass
+class Field:
+    """Schema of one property of a feature."""
+
+    # Allowed types, compared exactly such that, e.g., bools are no ints
+    types: Tuple[type, ...]
+    required: bool = True
+    # Allowed values
+    choices: Optional[Set[Any]] = None
+    # Additional check that returns an error message or an empty string
+    check: Optional[Callable[[Any], str]] = None
+
+
+@lru_cache(maxsize=4096)
+def check_date(value: str) -> str:
+    """
+    Check a date like `2024-01-31`.
+
+    Args:
+        value: The date.
+
+    Returns:
+        An error message, empty if the date is valid.
+    """
+    if not _DATE.fullmatch(value):
+        return f"date {value!r} is not formatted as YYYY-MM-DD"
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return f"date {value!r} does not exist"
+    return ""
+
+
+PROPERTIES = {
+    "id": Field((int,)),
+    "name": Field((str,)),
+    "area": Field((str,), choices=AREA_VOCABULARY),
+    "address": Field((str,)),
+    "external_url": Field((str,)),
+    "internal_url": Field((str,)),
+    "machine_status": Field((str,), choices=MACHINE_STATUSES),
+    "last_updated": Field((str,), check=check_date),
+    "paywall": Field((bool,), required=False),
+    "num_coins": Field((int,), required=False),
+    "multimachine": Field((int, str), required=False),
+    "logs": Field((dict,), required=False),
+}
+
+
+def compile_schema(
+    properties: Dict[str, Field],
+) -> Callable[[Dict[str, Any]], List[str]]:
+    """
+    Compile a schema into a function that validates a feature.
+
+    Args:
+        properties: Schema of the properties. Other properties are allowed.
+
+    Returns:
+        A function that returns the errors of a feature.
+    """
+    required = {key for key, field in properties.items() if field.required}
+    checks = []
+    for key, field in properties.items():
+        type_names = "/".join(t.__name__ for t in field.types)
+
+        def check(value, key=key, field=field, type_names=type_names) -> str:
+            if type(value) not in field.types:
+                return f"{key} is {type(value).__name__}, expected {type_names}"
+            if field.choices is not None and value not in field.choices:
+                return f"{key} {value!r} is not one of the known values"
+            return field.check(value) if field.check else ""
+
+        checks.append((key, check))
+
+    def validate(feature: Dict[str, Any]) -> List[str]:
+        if not isinstance(feature, dict) or feature.get("type") != "Feature":
+            return ["not a feature"]
+        errors = []
+        geometry = feature.get("geometry")
+        coordinates = geometry.get("coordinates") if type(geometry) is dict else None
+        if type(geometry) is not dict or geometry.get("type") != "Point":
+            errors.append("geometry is not a point")
+        elif (
+            type(coordinates) is not list
+            or len(coordinates) != 2
+            or type(coordinates[0]) is not float
+            or type(coordinates[1]) is not float
+        ):
+            errors.append(f"coordinates {coordinates!r} are not two floats")
+        elif not (-180 <= coordinates[0] <= 180 and -90 <= coordinates[1] <= 90):
+            errors.append(f"coordinates {coordinates!r} are out of range")
+        props = feature.get("properties")
+        if type(props) is not dict:
+            return errors + ["properties are missing"]
+        missing = required - props.keys()
+        if missing:
+            errors.append(f"missing properties {sorted(missing)}")
+        for key, check in checks:
+            if key in props:
+                error = check(props[key])
+                if error:
+                    errors.append(error)
+        return errors
+
+    return validate
+
+
+validate_feature = compile_schema(PROPERTIES)
+
+
+def validate_features(
+    features: List[Dict[str, Any]], label: str
+) -> Tuple[List[str], List[Any]]:
+    """
+    Validate features against the schema.
+
+    Args:
+        features: The features.
+        label: Name of the file in the error messages.
+
+    Returns:
+        The errors and the ids of the features.
+    """
+    errors, ids = [], []
+    for feature in features:
+        feature_errors = validate_feature(feature)
+        machine_id = None
+        if isinstance(feature, dict) and isinstance(feature.get("properties"), dict):
+            machine_id = feature["properties"].get("id")
+        ids.append(machine_id)
+        errors += [f"In {label}, ID = {machine_id}: {e}" for e in feature_errors]
+    return errors, ids
+
+
+def duplicate_id_errors(ids: List[Any], label: str) -> List[str]:
+    """
+    Check that ids are unique.
+
+    Args:
+        ids: The ids of all features of a file.
+        label: Name of the file in the error messages.
+
+    Returns:
+        One error listing the duplicates, if any.
+    """
+    if len(set(ids)) == len(ids):
+        return []
+    non_unique = [i for i, count in Counter(ids).items() if count > 1]
+    return [f"{len(non_unique)} duplicate entries in {label}: {non_unique}"]
+
+
+def _validate_chunk(
+    path: str, start: int, end: int, label: str
+) -> Tuple[List[str], List[Any]]:
+    # Validate the features between two offsets, e.g., in a worker process
+    with open(path, "rb") as f:
+        f.seek(start)
+        content = f.read(end - start)
+    try:
+        features = io.loads(b"[" + content + b"]")
+    except ValueError as e:
+        return [f"In {label}: invalid JSON in bytes {start}-{end}: {e}"], []
+    return validate_features(features, label)
+
+
+def validate_file(path: str, label: str, workers: int = 1) -> List[str]:
+    """
+    Validate all features of a file.
+
+    Args:
+        path: Path to the file.
+        label: Name of the file in the error messages.
+        workers: Number of processes. Files in the repository format that are
+            larger than MIN_PARALLEL_SIZE are split into one chunk per process.
+            Defaults to 1.
+
+    Returns:
+        The errors.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    chunks = []
+    if (
+        workers > 1
+        and len(content) > MIN_PARALLEL_SIZE
+        and content.startswith(HEADER)
+        and content.endswith(FOOTER)
+    ):
+        # Split the list of features at feature boundaries
+        start, stop = len(HEADER), len(content) - len(FOOTER)
+        step = (stop - start) // workers
+        while start < stop:
+            end = content.find(_SEPARATOR, start + step, stop)
+            end = stop if end < 0 else end + len("\n        }")
+            chunks.append((start, end))
+            start = end + 2
+    if len(chunks) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [
+                pool.submit(_validate_chunk, path, start, end, label)
+                for start, end in chunks
+            ]
+            results = [future.result() for future in futures]
+    else:
+        try:
+            data = io.loads(content)
+        except ValueError as e:
+            return [f"In {label}: invalid JSON: {e}"]
+        if not isinstance(data, dict) or not isinstance(data.get("features"), list):
+            return [f"In {label}: not a feature collection"]
+        results = [validate_features(data["features"], label)]
+    errors = [e for chunk_errors, _ in results for e in chunk_errors]
+    ids = [i for _, chunk_ids in results for i in chunk_ids]
+    return errors + duplicate_id_errors(ids, label)
+
+
+def staged_changes(path: str) -> Optional[List[Tuple[int, int]]]:
+    """
+    Find the lines of a file that are changed in the git index compared to HEAD.
+
+    Args:
+        path: Path to the file.
+
+    Returns:
+        Ranges (first line, number of lines) in the staged file, 0-based. Pure
+            deletions have zero lines. None if git fails, e.g., outside of a
+            repository.
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    result = subprocess.run(
+        ["git", "diff", "--cached", "-U0", "--no-color", "--no-ext-diff", "--", name],
+        cwd=folder,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return None
+    return [
+        (int(first) - 1 if count != "0" else int(first), int(count or 1))
+        for first, count in _HUNK.findall(result.stdout)
+    ]
+
+
+def _feature_span(lines: List[bytes], line: int) -> Optional[Tuple[int, int]]:
+    # First and last line of the feature containing a line, None if the line is
+    # not part of a feature in the repository format
+    if not 0 <= line < len(lines):
+        return None
+    start = line
+    if lines[start] in FEATURE_ENDS:
+        start -= 1
+    while start >= 0 and lines[start] != FEATURE_START:
+        if lines[start] in FEATURE_ENDS or not lines[start].startswith(b"         "):
+            return None
+        start -= 1
+    end = max(line, start + 1)
+    while end < len(lines) and lines[end] not in FEATURE_ENDS:
+        if lines[end] == FEATURE_START or not lines[end].startswith(b"         "):
+            return None
+        end += 1
+    if start < 0 or end >= len(lines):
+        return None
+    return start, end
+
+
+def validate_changed(path: str, label: str, workers: int = 1) -> List[str]:
+    """
+    Validate the features touched by the staged changes of a file, and the ids of
+    all features. Falls back to `validate_file` if the changes are not limited to
+    features in the repository format.
+
+    Args:
+        path: Path to the file.
+        label: Name of the file in the error messages.
+        workers: Number of processes in case of a fallback. Defaults to 1.
+
+    Returns:
+        The errors.
+    """
+    changes = staged_changes(path)
+    if changes is None:
+        return validate_file(path, label, workers)
+    if not changes:
+        return []
+    with open(path, "rb") as f:
+        content = f.read()
+    lines = content.split(b"\n")
+    if not content.startswith(HEADER) or not content.endswith(FOOTER):
+        return validate_file(path, label, workers)
+
+    touched = set()
+    for first, count in changes:
+        # The lines around a deletion must still connect two features
+        touched.update(range(first, first + count) if count else [first - 1, first])
+    if len(touched) > MAX_CHANGED_FRACTION * len(lines):
+        return validate_file(path, label, workers)
+    spans = set()
+    for line in sorted(touched):
+        if any(start <= line <= end for start, end in spans):
+            continue
+        span = _feature_span(lines, line)
+        if span is None:
+            return validate_file(path, label, workers)
+        spans.add(span)
+
+    errors, features = [], []
+    for start, end in sorted(spans):
+        # A feature is preceded by the list start or a feature with a comma and
+        # followed by the next feature or the list end
+        before, after = lines[start - 1], lines[end + 1]
+        if before not in (FEATURES_START, FEATURE_ENDS[0]) or (
+            after != (FEATURE_START if lines[end] == FEATURE_ENDS[0] else FEATURES_END)
+        ):
+            errors.append(f"In {label}: broken list of features around line {start}")
+            continue
+        block = b"\n".join(lines[start : end + 1]).rstrip(b",")
+        try:
+            features.append(io.loads(block))
+        except ValueError as e:
+            errors.append(f"In {label}: invalid JSON in line {start + 1}: {e}")
+    feature_errors, _ = validate_features(features, label)
+    ids = list(map(int, ID_LINE.findall(content)))
+    return errors + feature_errors + duplicate_id_errors(ids, label)
@@ -5,6 +5,8 @@ import requests
 from bs4 import BeautifulSoup
 from loguru import logger
 
+from pennyme import http_client
+
 
 def get_website(url: str) -> BeautifulSoup:
     """
@@ -17,13 +19,26 @@ def get_website(url: str) -> BeautifulSoup:
         The website as a BeautifulSoup object.
     """
 
-    mhtml = requests.get(url).content
+    mhtml = http_client.get(url).content
     unicode_str = mhtml.decode("utf8")
     encoded_str = unicode_str.encode("ascii", "ignore")
     website = BeautifulSoup(encoded_str, "html.parser")
     return website
 
 
+def get_website_content(url: str) -> bytes:
+    """
+    Get the raw content of a url, e.g., for `pennyme.page_parser`.
+
+    Args:
+        url: URL to get the website from.
+
+    Returns:
+        The content of the website.
+    """
+    return http_client.get(url).content
+
+
 def get_elongated_coin_title(url: str) -> str:
     """
     Get the title of a url pointing to a forum entry on elongated-coin.de.
@@ -35,7 +50,7 @@ def get_elongated_coin_title(url: str) -> str:
         The title of the forum entry.
     """
 
-    mhtml = requests.get(url).content
+    mhtml = http_client.get(url).content
     unicode_str = mhtml.decode("utf8")
     encoded_str = unicode_str.encode("ascii", "ignore")
     website = BeautifulSoup(encoded_str, "html.parser")
@@ -54,7 +69,7 @@ def get_elongated_coin_comments(url: str) -> List[str]:
     Returns:
         List of comments.
     """
-    mhtml = requests.get(url).content
+    mhtml = http_client.get(url).content
     unicode_str = mhtml.decode("utf8")
     soup = BeautifulSoup(unicode_str, "html.parser")
 
@@ -87,7 +102,7 @@ def safely_test_link(link: str) -> Union[bool, requests.models.Response]:
         True if the link is valid, False otherwise.
     """
     try:
-        response = requests.get(link)
+        response = http_client.get(link)
         return response
     except requests.exceptions.RequestException as e:
         logger.warning(f"Exception encountered when testing link '{link}': {e}")
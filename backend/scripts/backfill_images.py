@@ -0,0 +1,163 @@
+"""
+Re-runs the current image policy (resizing, re-encoding and coin cropping) of
+`process_uploaded_image` on all existing images and creates their derivatives.
+Every processed image is recorded in a journal, so interrupted runs resume
+where they stopped. The encoder statistics of all images are appended to
+`PATH_ENCODE_STATS`, like those of uploads.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import typer
+
+from pennyme.image_store import (
+    MANIFEST_DIR,
+    PATH_IMAGES,
+    is_image_file,
+    parse_image_name,
+    update_manifest,
+)
+from pennyme.images import PATH_ENCODE_STATS, make_derivatives, process_uploaded_image
+
+app = typer.Typer()
+
+
+def backfill_image(task: Tuple[str, bool]) -> Dict[str, Any]:
+    """
+    Apply the current image policy to one image. The image is processed on a
+    temporary copy and only replaced if the result is smaller.
+
+    Args:
+        task: Tuple of the path to the image and whether this is a dry run.
+
+    Returns:
+        Journal entry with the status and the bytes before and after.
+    """
+    img_path, dry_run = task
+    filename = os.path.basename(img_path)
+    old_bytes = os.path.getsize(img_path)
+    entry = {"file": filename, "old_bytes": old_bytes, "new_bytes": old_bytes}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, filename)
+        shutil.copy2(img_path, tmp_path)
+        try:
+            code, msg, out_path = process_uploaded_image(tmp_path)
+        except Exception as e:
+            return {**entry, "status": "error", "message": f"{type(e).__name__}: {e}"}
+        if code != 200:
+            return {**entry, "status": "rejected", "message": msg}
+
+        final_path = img_path
+        new_bytes = os.path.getsize(out_path)
+        if new_bytes < old_bytes:
+            entry.update(status="reencoded", new_bytes=new_bytes)
+            final_path = os.path.join(
+                os.path.dirname(img_path), os.path.basename(out_path)
+            )
+            if not dry_run:
+                shutil.move(out_path, final_path)
+                if final_path != img_path:
+                    os.remove(img_path)
+            else:
+                final_path = out_path
+        else:
+            entry["status"] = "kept"
+        entry["final_file"] = os.path.basename(final_path)
+
+        if dry_run and final_path == img_path:
+            # Do not write derivatives next to the original in a dry run
+            shutil.copy2(img_path, tmp_path)
+            final_path = tmp_path
+        derivatives = make_derivatives(final_path)
+        entry["derivatives"] = [os.path.basename(p) for p in derivatives]
+        entry["derivative_bytes"] = sum(os.path.getsize(p) for p in derivatives)
+    return entry
+
+
+def load_journal(journal_path: Path) -> Dict[str, Dict[str, Any]]:
+    """
+    Load the entries of images that were already processed.
+
+    Args:
+        journal_path: Path to the journal (one JSON entry per line).
+
+    Returns:
+        Dictionary mapping file names to their journal entry.
+    """
+    done = {}
+    if journal_path.exists():
+        with open(journal_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    done[entry["file"]] = entry
+    return done
+
+
+@app.command()
+def main(
+    images_dir: Path = typer.Option(PATH_IMAGES, help="Folder with the images"),
+    journal: Optional[Path] = typer.Option(
+        None, help="Progress journal, defaults to a file in the images folder"
+    ),
+    manifest_dir: Path = typer.Option(MANIFEST_DIR, help="Folder of the manifest"),
+    workers: int = typer.Option(os.cpu_count(), help="Number of processes"),
+    dry_run: bool = typer.Option(False, help="Only report the expected savings"),
+):
+    if journal is None:
+        name = "backfill_journal_dry.jsonl" if dry_run else "backfill_journal.jsonl"
+        journal = images_dir / name
+    done = load_journal(journal)
+
+    # Derivatives are regenerated from their source image, never processed
+    candidates = []
+    for filename in sorted(os.listdir(images_dir)):
+        parsed = parse_image_name(filename)
+        if not is_image_file(filename) or parsed is None:
+            continue
+        if parsed[1].endswith("_thumb") or filename in done:
+            continue
+        candidates.append((str(images_dir / filename), dry_run))
+    print(f"{len(done)} images already in journal, processing {len(candidates)}")
+
+    # Forking after onnxruntime (rembg) was loaded deadlocks, hence spawn
+    pool = get_context("spawn").Pool(workers)
+    with pool, open(journal, "a") as journal_file:
+        for i, entry in enumerate(pool.imap_unordered(backfill_image, candidates)):
+            journal_file.write(json.dumps(entry) + "\n")
+            journal_file.flush()
+            done[entry["file"]] = entry
+            if not dry_run and entry["status"] in ["reencoded", "kept"]:
+                update_manifest(
+                    [entry["file"], entry["final_file"]] + entry["derivatives"],
+                    images_dir=str(images_dir),
+                    manifest_dir=str(manifest_dir),
+                )
+            if (i + 1) % 100 == 0:
+                print(f"Processed {i + 1}/{len(candidates)} images")
+
+    # Report over the whole journal such that resumed runs report the full effect
+    statuses = Counter(entry["status"] for entry in done.values())
+    old_bytes = sum(entry["old_bytes"] for entry in done.values())
+    new_bytes = sum(entry["new_bytes"] for entry in done.values())
+    derivative_bytes = sum(entry.get("derivative_bytes", 0) for entry in done.values())
+    prefix = "Would save" if dry_run else "Saved"
+    print(f"Image statuses: {dict(statuses)}")
+    print(
+        f"{prefix} {(old_bytes - new_bytes) / 1e6:.2f} MB "
+        f"({old_bytes / 1e6:.2f} MB -> {new_bytes / 1e6:.2f} MB), "
+        f"derivatives take {derivative_bytes / 1e6:.2f} MB"
+    )
+    print(f"Encoder statistics in {os.path.normpath(PATH_ENCODE_STATS)}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,20 @@
+from pathlib import Path
+
+import typer
+
+from pennyme.image_store import MANIFEST_DIR, PATH_IMAGES, build_manifest
+
+app = typer.Typer()
+
+
+@app.command()
+def main(
+    images_dir: Path = typer.Option(PATH_IMAGES, help="Folder with the images"),
+    manifest_dir: Path = typer.Option(MANIFEST_DIR, help="Folder for the manifest"),
+):
+    revision = build_manifest(str(images_dir), str(manifest_dir))
+    print(f"Manifest is up to date at revision {revision}")
+
+
+if __name__ == "__main__":
+    app()
@@ -1,61 +1,20 @@
-import json
+from collections import Counter
+from itertools import chain, count
 
-import numpy as np
-
-# open files
-with open("data/all_locations.json", "r") as f:
-    all_locs = json.load(f)
+from pennyme import io
+from pennyme.geo import jitter_lonlats, spatially_sorted
 
+# Both files are streamed, only ids and new machines are kept in memory
+all_file = "data/all_locations.json"
 server_file = "data/server_locations.json"
 
-with open(server_file, "r") as f:
-    ser_locs = json.load(f)
-
-ls, la = len(ser_locs["features"]), len(all_locs["features"])
-print(f"All locations has {la} entries, server locations {ls}")
-
 
 def get_highest_id():
-    ids = [s["properties"]["id"] for s in ser_locs["features"]] + [
-        s["properties"]["id"] for s in all_locs["features"]
-    ]
-    return max(ids)
-
-
-EARTH_R = 6_371_000.0  # meters
-
-
-def wrap_lon(lon_deg: float) -> float:
-    # wrap to [-180, 180)
-    return ((lon_deg + 180.0) % 360.0) - 180.0
-
-
-def clamp_lat(lat_deg: float) -> float:
-    return float(np.clip(lat_deg, -90.0, 90.0))
-
-
-def jitter_lonlat(lon, lat, radius_m=20.0, rng=None):
-    rng = np.random.default_rng(rng)
-
-    theta = rng.uniform(0.0, 2 * np.pi)
-    r = radius_m * np.sqrt(rng.uniform(0.0, 1.0))
-
-    dx = r * np.cos(theta)  # meters east
-    dy = r * np.sin(theta)  # meters north
-
-    lat_rad = np.deg2rad(lat)
-    dlat = (dy / EARTH_R) * (180.0 / np.pi)
-
-    # Guard against cos(lat)=0 near poles
-    coslat = np.cos(lat_rad)
-    if abs(coslat) < 1e-12:
-        dlon = 0.0
-    else:
-        dlon = (dx / (EARTH_R * coslat)) * (180.0 / np.pi)
-
-    lon2 = wrap_lon(lon + dlon)
-    lat2 = clamp_lat(lat + dlat)
-    return lon2, lat2
+    return max(
+        s["properties"]["id"]
+        for path in [server_file, all_file]
+        for s in io.iter_features(path)
+    )
 
 
 def fix_strings(text):
@@ -91,30 +50,39 @@ def set_coords_in_properties(props, lon, lat):
         props["latitude"] = float(lat)
 
 
-def assert_unique_ids(features, label):
-    ids = [f["properties"]["id"] for f in features]
-    if len(ids) != len(set(ids)):
-        from collections import Counter
-
-        dupes = [k for k, v in Counter(ids).items() if v > 1]
+def assert_unique_ids(features, label, counts):
+    # Passes the features through, the file is only replaced if all ids are unique
+    ids, dupes = set(), {}
+    for f in features:
+        mid = f["properties"]["id"]
+        if mid in ids:
+            dupes[mid] = True
+        ids.add(mid)
+        counts[label] += 1
+        yield f
+    if dupes:
         raise ValueError(
-            f"{label}: duplicate IDs found (showing up to 20): {dupes[:20]}"
+            f"{label}: duplicate IDs found (showing up to 20): {list(dupes)[:20]}"
         )
 
 
 def split_multimachines(
-    features, *, next_id, ids_to_skip, already_split_ids, jitter_radius_m, max_machines
+    features,
+    *,
+    next_ids,
+    ids_to_skip,
+    already_split_ids,
+    jitter_radius_m,
+    max_machines,
+    new_machines,
+    split_ids,
 ):
     """
     - Removes 'multimachine' from the source machine if present.
     - If multimachine > 1 and ID not skipped and not already split in this pass:
-        creates (n-1) new machines with new IDs and jittered coords.
-    Returns: (new_features, new_machines, next_id, split_ids)
+        creates (n-1) new machines with new IDs (from next_ids) and jittered coords.
+    Yields the features, new machines and split IDs are appended to the given lists.
     """
-    new_features = []
-    new_machines = []
-    split_ids = []
-
     for machine in features:
         # Fail fast if schema is off
         props = machine["properties"]
@@ -140,101 +108,102 @@ def split_multimachines(
                 set_coords_in_properties(props, old_coords[0], old_coords[1])
 
                 total = min(machine_num_as_int, max_machines)
-                for k in range(2, total + 1):
+                # jitter coordinates of all new machines at once (deterministic per orig_id)
+                new_lons, new_lats = jitter_lonlats(
+                    old_coords[0],
+                    old_coords[1],
+                    total - 1,
+                    radius_m=jitter_radius_m,
+                    rng=mid,
+                )
+                for k, new_lon, new_lat in zip(
+                    range(2, total + 1), new_lons.tolist(), new_lats.tolist()
+                ):
                     # copy properties dict
                     new_properties = props.copy()
-                    new_properties["id"] = next_id
+                    new_properties["id"] = next(next_ids)
                     new_properties["name"] = name + f" * Machine {k}"
-                    next_id += 1
-
-                    # jitter coordinates (deterministic per (orig_id, machine_index))
-                    new_coords = jitter_lonlat(
-                        old_coords[0],
-                        old_coords[1],
-                        radius_m=jitter_radius_m,
-                        rng=(mid * 1000 + k),
-                    )
-                    set_coords_in_properties(
-                        new_properties, new_coords[0], new_coords[1]
-                    )
+
+                    set_coords_in_properties(new_properties, new_lon, new_lat)
 
                     new_dict = {
                         "type": "Feature",
-                        "geometry": {"type": "Point", "coordinates": list(new_coords)},
+                        "geometry": {
+                            "type": "Point",
+                            "coordinates": [new_lon, new_lat],
+                        },
                         "properties": new_properties,
                     }
                     new_machines.append(new_dict)
 
-        new_features.append(machine)
-
-    return new_features, new_machines, next_id, split_ids
+        yield machine
 
 
-new_multimachines = []
-
-next_id = get_highest_id() + 1
+next_ids = count(get_highest_id() + 1)
+counts = Counter()
 
 MAX_MACHINES = 5
 
 # ---------------------- PASS 1: server locations ----------------------
 # Split multimachines here, but do NOT add new machines to server file (keep server minimal).
-server_before = len(ser_locs["features"])
-server_already_split = set()
-server_ids_to_skip = set()
-
-new_ser_locs, server_new_machines_for_all, next_id, server_split_ids = (
-    split_multimachines(
-        ser_locs["features"],
-        next_id=next_id,
-        ids_to_skip=server_ids_to_skip,
-        already_split_ids=server_already_split,
-        jitter_radius_m=15.0,
-        max_machines=MAX_MACHINES,
-    )
+# Like all locations, the file is written in the order along the Hilbert curve.
+server_new_machines_for_all, server_split_ids = [], []
+
+new_ser_locs = split_multimachines(
+    io.iter_features(server_file),
+    next_ids=next_ids,
+    ids_to_skip=set(),
+    already_split_ids=set(),
+    jitter_radius_m=15.0,
+    max_machines=MAX_MACHINES,
+    new_machines=server_new_machines_for_all,
+    split_ids=server_split_ids,
+)
+io.dump_features(
+    spatially_sorted(assert_unique_ids(new_ser_locs, "server_locations", counts)),
+    server_file.replace(".json", "_new.json"),
 )
-
-ser_locs["features"] = new_ser_locs
-server_after = len(ser_locs["features"])
 
 # Any ID split in server should not be split again in all_locations.
 modified_server_location_ids = set(server_split_ids)
 
 # ---------------------- PASS 2: all locations ----------------------
-all_before = len(all_locs["features"])
-all_already_split = set()
+all_new_machines, all_split_ids = [], []
 
-new_all_locs, all_new_machines, next_id, all_split_ids = split_multimachines(
-    all_locs["features"],
-    next_id=next_id,
+new_all_locs = split_multimachines(
+    io.iter_features(all_file),
+    next_ids=next_ids,
     ids_to_skip=modified_server_location_ids,
-    already_split_ids=all_already_split,
+    already_split_ids=set(),
     jitter_radius_m=15.0,
     max_machines=MAX_MACHINES,
+    new_machines=all_new_machines,
+    split_ids=all_split_ids,
 )
 
-# Add ALL new machines to all_locations (including those originating from server_locations splitting)
-all_locs["features"] = new_all_locs + server_new_machines_for_all + all_new_machines
-all_after = len(all_locs["features"])
-
-# ---------------------- VALIDATION + STATS ----------------------
-assert_unique_ids(ser_locs["features"], "server_locations")
-assert_unique_ids(all_locs["features"], "all_locations")
+# Add ALL new machines to all_locations (including those originating from
+# server_locations splitting). The lists are complete once all locations were streamed.
+# The new machines are placed along the Hilbert curve, the layout of the data files.
+with_new_machines = chain(new_all_locs, server_new_machines_for_all, all_new_machines)
+io.dump_features(
+    spatially_sorted(assert_unique_ids(with_new_machines, "all_locations", counts)),
+    "data/all_locations_new.json",
+)
 
+# ---------------------- STATS ----------------------
 n_split_ids_total = len(set(server_split_ids) | set(all_split_ids))
 n_new_machines_total = len(server_new_machines_for_all) + len(all_new_machines)
+all_before = counts["all_locations"] - n_new_machines_total
 
+print(
+    f"All locations has {all_before} entries, server locations {counts['server_locations']}"
+)
 print(
     f"Split {n_split_ids_total} IDs total ({len(server_split_ids)} from server, {len(all_split_ids)} from all)"
 )
 print(f"Added {n_new_machines_total} new machines total")
-print(f"Server locations: {server_before} -> {server_after} features (kept minimal)")
-print(f"All locations:    {all_before} -> {all_after} features")
-
-# ---------------------- WRITE BACK ----------------------
-with open("data/all_locations_new.json", "w") as f:
-    json.dump(all_locs, f, ensure_ascii=False, indent=4)
-
-with open(server_file.replace(".json", "_new.json"), "w") as f:
-    json.dump(ser_locs, f, ensure_ascii=False, indent=4)
-
+print(
+    f"Server locations: {counts['server_locations']} -> {counts['server_locations']} features (kept minimal)"
+)
+print(f"All locations:    {all_before} -> {counts['all_locations']} features")
 print("Wrote updated files: data/all_locations.json and data/server_locations.json")
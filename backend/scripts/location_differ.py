@@ -8,18 +8,28 @@ This is the main script for retrieving updates from the website. It does:
 """
 
 import argparse
-import json
+import hashlib
 import os
-from collections import Counter, defaultdict
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import pandas as pd
 from googlemaps import Client as GoogleMaps
-from haversine import haversine
 from loguru import logger
-from thefuzz import process as fuzzysearch
 from tqdm import tqdm
 
+from pennyme import http_client, io
+from pennyme.checkpoint import DifferCheckpoint
+from pennyme.differ_state import (
+    DifferState,
+    area_data_fingerprint,
+    area_fingerprint,
+    listing_fingerprint,
+    load_state,
+)
 from pennyme.github_update import load_latest_json
 from pennyme.locations import COUNTRY_TO_CODE
 from pennyme.pennycollector import (
@@ -32,15 +42,17 @@ from pennyme.pennycollector import (
     UNAVAILABLE_MAPPER,
     UNAVAILABLE_STATES,
     YEAR,
-    get_area_list_from_area_website,
     get_coordinates,
-    get_location_list_from_location_website,
     get_prelim_geojson,
     prelim_to_problem_json,
     validate_location_list,
 )
+from pennyme.links import LinkValidator
+from pennyme.matching import MachineMatcher
+from pennyme.page_parser import parse_area_list, parse_location_list
+from pennyme.snapshots import SnapshotGeocoder, SnapshotStore
 from pennyme.utils import verify_remaining_machines
-from pennyme.webconfig import get_website, safely_test_link
+from pennyme.webconfig import get_website_content
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -64,6 +76,141 @@ parser.add_argument(
     help="load the latest server_locations file from the repo",
 )
 parser.add_argument("-a", "--api_key", type=str, help="Google Maps API key")
+parser.add_argument(
+    "--full",
+    action="store_true",
+    help="process all listings, also those that did not change since the last run",
+)
+parser.add_argument(
+    "--replay",
+    type=str,
+    default=None,
+    help="ID of a stored snapshot (or 'latest') to run offline against",
+)
+parser.add_argument(
+    "--snapshot_dir",
+    type=str,
+    default=None,
+    help="Folder of the snapshot store, defaults to a subfolder of the output folder",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="continue a failed run after the last area of its checkpoint",
+)
+parser.add_argument(
+    "--checkpoint_dir",
+    type=str,
+    default=None,
+    help="Working directory of the checkpoint, defaults to the one recorded in "
+    "running.tmp when resuming, otherwise to a subfolder of the output folder",
+)
+
+SKIPPED_AREAS = [" Private Rollers", "_Collector Books_"]
+# Area pages are fetched concurrently (further limited by the HTTP client's host
+# policy) at most this many areas ahead of the area that is being processed
+AREA_FETCH_WORKERS = 4
+AREA_PREFETCH_DEPTH = 8
+
+
+def parse_area(
+    area: str, content: bytes, snapshots: SnapshotStore
+) -> List[Dict[str, Any]]:
+    """
+    Convert the locations of an area page to preliminary geojsons.
+
+    Args:
+        area: Name of the area.
+        content: Raw content of the page.
+        snapshots: Store in which the parsed page is saved.
+
+    Returns:
+        Preliminary geojsons (no ID and no GPS coordinates) of the locations.
+    """
+    # Pages that did not change since they were last parsed are not parsed again
+    raw_locations = snapshots.parsed(content, parse_location_list)
+    return [
+        get_prelim_geojson(raw_location, area, add_date=True)
+        for raw_location in raw_locations
+    ]
+
+
+def fetch_area(
+    area: str, snapshots: SnapshotStore, unchanged: Callable[[str, str], bool]
+) -> Tuple[str, bytes, Optional[List[Dict[str, Any]]], Dict[str, float]]:
+    """
+    Download an area page and convert its locations to preliminary geojsons.
+
+    Args:
+        area: Name of the area.
+        snapshots: Store in which the page is saved (or from which it is replayed).
+        unchanged: Function of the area and the hash of its page, whether the area
+            may be skipped. Such pages are only parsed if our data changed.
+
+    Returns:
+        The sha256 hex digest and raw content of the page, the preliminary
+            geojsons of the locations (None if not parsed) and the time spent on
+            fetching and parsing.
+    """
+    start = time.perf_counter()
+    url = AREA_PREFIX + str(COUNTRY_TO_CODE[area])
+    content = snapshots.fetch_page(url, get_website_content)
+    page = hashlib.sha256(content).hexdigest()
+    fetched = time.perf_counter()
+    prelim_geojsons = None
+    if not unchanged(area, page):
+        prelim_geojsons = parse_area(area, content, snapshots)
+    timing = {"fetch": fetched - start, "parse": time.perf_counter() - fetched}
+    return page, content, prelim_geojsons, timing
+
+
+def prefetch_areas(
+    areas: List[str],
+    snapshots: SnapshotStore,
+    unchanged: Callable[[str, str], bool],
+    timings: Dict[str, float],
+) -> Iterator[Tuple[str, str, bytes, Optional[List[Dict[str, Any]]]]]:
+    """
+    Fetch area pages in the background while the caller processes earlier areas.
+    Areas are yielded in their original order, so the results are deterministic.
+
+    Args:
+        areas: Names of the areas.
+        snapshots: Store in which the pages are saved (or from which they are
+            replayed).
+        unchanged: Function of the area and the hash of its page, whether the area
+            may be skipped, see `fetch_area`.
+        timings: Dictionary to which the time per stage is added.
+
+    Yields:
+        Tuples of area name, hash and content of its page and the preliminary
+            geojsons of its locations (None if not parsed).
+    """
+    with ThreadPoolExecutor(max_workers=AREA_FETCH_WORKERS) as executor:
+        pending = deque()
+        areas_iter = iter(areas)
+        for area in areas_iter:
+            pending.append(
+                (area, executor.submit(fetch_area, area, snapshots, unchanged))
+            )
+            if len(pending) >= AREA_PREFETCH_DEPTH:
+                break
+        while pending:
+            area, future = pending.popleft()
+            start = time.perf_counter()
+            page, content, prelim_geojsons, timing = future.result()
+            timings["wait_for_pages"] += time.perf_counter() - start
+            for stage, seconds in timing.items():
+                timings[stage] += seconds
+            next_area = next(areas_iter, None)
+            if next_area is not None:
+                pending.append(
+                    (
+                        next_area,
+                        executor.submit(fetch_area, next_area, snapshots, unchanged),
+                    )
+                )
+            yield area, page, content, prelim_geojsons
 
 
 def location_differ(
@@ -72,55 +219,101 @@ def location_differ(
     server_json: str,
     api_key: str,
     load_from_github: bool,
-):
+    full: bool = False,
+    replay: Optional[str] = None,
+    snapshot_dir: Optional[str] = None,
+    resume: bool = False,
+    checkpoint_dir: Optional[str] = None,
+    geocoder: Optional[GoogleMaps] = None,
+) -> Dict[str, float]:
     start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     logger.info(f"======Location differ joblog from {start_time}=======")
     os.makedirs(output_folder, exist_ok=True)
 
-    # Create empty file to indicate that the job is running
-    with open(os.path.join(output_folder, "running.tmp"), "w") as _:
-        pass
+    running_path = os.path.join(output_folder, "running.tmp")
+    if resume and checkpoint_dir is None and os.path.exists(running_path):
+        # Continue with the checkpoint of the run that failed
+        with open(running_path, "r") as f:
+            checkpoint_dir = f.read().strip() or None
+    checkpoint = DifferCheckpoint(
+        checkpoint_dir or os.path.join(output_folder, "checkpoint")
+    )
+
+    # Create file to indicate that the job is running, it names the checkpoint
+    with open(running_path, "w") as f:
+        f.write(checkpoint.folder)
 
     today = f"{YEAR}-{MONTH}-{DAY}"
 
-    gmaps = GoogleMaps(api_key)
-
-    # Load existing json data
-    with open(device_json, "r") as f:
-        device_data = json.load(f)
-
-    # load server_locations from github or from data folder
-    if load_from_github:
-        server_data, _ = load_latest_json()
-        # save the file locally to compare it later
-        with open(server_json, "w", encoding="utf8") as f:
-            json.dump(server_data, f, ensure_ascii=False, indent=4)
-        problems_old, _ = load_latest_json(file="/data/problems.json")
-        problems_out_path = os.path.join(output_folder, "old_problems.json")
-        with open(problems_out_path, "w", encoding="utf8") as f:
-            json.dump(problems_old, f, ensure_ascii=False, indent=4)
-        problems_links = [
-            entry["properties"]["external_url"] for entry in problems_old["features"]
-        ]
-        skip_json, _ = load_latest_json(file="/data/skip.json")
-        skip_links = [
-            entry["properties"]["external_url"] for entry in skip_json["features"]
-        ]
+    # All inputs of the run are stored, such that it can be replayed offline
+    snapshots = SnapshotStore(
+        snapshot_dir or os.path.join(output_folder, "snapshots"),
+        replay=replay,
+        reuse_parsed=not full,
+    )
+    if geocoder is None and not replay:
+        geocoder = GoogleMaps(api_key)
+    gmaps = SnapshotGeocoder(snapshots, None if replay else geocoder)
+
+    def load_json(path: str) -> Callable[[], Dict[str, Any]]:
+        def load() -> Dict[str, Any]:
+            return io.load(path)
+
+        return load
 
+    if resume:
+        inputs, state = checkpoint.load()
+        logger.info(
+            f"Resuming after {state['completed_areas']} areas from {checkpoint.folder}"
+        )
+        device_data = inputs["device_data"]
+        server_data = inputs["server_data"]
+        problems_links = inputs["problems_links"]
+        skip_links = inputs["skip_links"]
     else:
-        with open(server_json, "r") as f:
-            server_data = json.load(f)
+        state = None
+        # Load existing json data
+        device_data = snapshots.load_file("device_locations", load_json(device_json))
+
+        # load server_locations from github or from data folder
+        if load_from_github:
+            server_data = snapshots.load_file(
+                "server_locations", lambda: load_latest_json()[0]
+            )
+            # save the file locally to compare it later
+            io.dump(server_data, server_json)
+            problems_old = snapshots.load_file(
+                "problems", lambda: load_latest_json(file="/data/problems.json")[0]
+            )
+            problems_out_path = os.path.join(output_folder, "old_problems.json")
+            io.dump(problems_old, problems_out_path)
+            problems_links = {
+                entry["properties"]["external_url"]
+                for entry in problems_old["features"]
+            }
+            skip_json = snapshots.load_file(
+                "skip", lambda: load_latest_json(file="/data/skip.json")[0]
+            )
+            skip_links = {
+                entry["properties"]["external_url"] for entry in skip_json["features"]
+            }
+
+        else:
+            server_data = snapshots.load_file(
+                "server_locations", load_json(server_json)
+            )
+            problems_links, skip_links = set(), set()
 
     # Saving all machines which have no external link
     external_list = []
 
     # Convert data to have links as keys
     device_dict = {}
-    country_to_titles = defaultdict(list)
+    country_to_titles = defaultdict(set)
     machine_idx = max([x["properties"]["id"] for x in device_data["features"]])
     for i, geojson in enumerate(device_data["features"]):
         url = geojson["properties"]["external_url"]
-        country_to_titles[geojson["properties"]["area"]].append(
+        country_to_titles[geojson["properties"]["area"]].add(
             geojson["properties"]["name"]
         )
         if url == "null" or "locations.pennycollector.com" not in url:
@@ -128,14 +321,14 @@ def location_differ(
             entry["source"] = "Device"
             entry["data_idx"] = i
             external_list.append(entry)
-        elif url not in device_dict.keys():
+        elif url not in device_dict:
             device_dict[url] = [geojson]
         else:
             device_dict[url].append(geojson)
 
     server_dict = {}
     for i, geojson in enumerate(server_data["features"]):
-        country_to_titles[geojson["properties"]["area"]].append(
+        country_to_titles[geojson["properties"]["area"]].add(
             geojson["properties"]["name"]
         )
         url = geojson["properties"]["external_url"]
@@ -146,7 +339,7 @@ def location_differ(
             entry["longitude"] = geojson["geometry"]["coordinates"][0]
             entry["latitude"] = geojson["geometry"]["coordinates"][1]
             external_list.append(entry)
-        elif url not in server_dict.keys():
+        elif url not in server_dict:
             server_dict[url] = [geojson]
         else:
             server_dict[url].append(geojson)
@@ -161,36 +354,182 @@ def location_differ(
     external = external.sort_values(
         by=["id", "source"], ascending=[True, False]
     ).drop_duplicates(subset=["id"], keep="first")
+    # Blocks the machines by area once, new listings are only matched in their area
+    matcher = MachineMatcher(external)
 
     # Extract locations
-    area_website = get_website(AREA_SITE)
-    areas = get_area_list_from_area_website(area_website)
-    valid, diff = validate_location_list(areas)
-    if not valid:
-        raise ValueError(f"It seems there were new locations: {diff}")
+    if resume:
+        areas = inputs["areas"]
+    else:
+        areas = parse_area_list(snapshots.fetch_page(AREA_SITE, get_website_content))
+        valid, diff = validate_location_list(areas)
+        if not valid:
+            raise ValueError(f"It seems there were new locations: {diff}")
+        # Stored before any machine is modified, such that the lookups of a
+        # resumed run are built from the same data
+        checkpoint.save_inputs(
+            {
+                "device_data": device_data,
+                "server_data": server_data,
+                "problems_links": problems_links,
+                "skip_links": skip_links,
+                "areas": areas,
+            }
+        )
 
     total_changes, new, depr = 0, 0, 0
-    validated_links = []
+    validated_links = set()
+    if replay:
+        # Links are not requested but their stored results are used
+        link_validator = LinkValidator(fetch=snapshots.replayed_link)
+    else:
+        link_validator = LinkValidator(
+            cache_path=os.path.join(output_folder, "link_cache.json")
+        )
+    # The state is stored with the inputs, such that a replay skips the same
+    # listings and areas as the replayed run
+    state_path = os.path.join(output_folder, "differ_state.json")
+    previous_state = None
+    if not full:
+        try:
+            previous_state = snapshots.load_file(
+                "differ_state", lambda: load_state(state_path)
+            )
+        except KeyError:
+            logger.warning("The replayed snapshot has no differ state, replaying all")
+            full = True
+    differ_state = DifferState(state_path, full=full, previous=previous_state)
     problem_data = {"type": "FeatureCollection", "features": []}
-    pbar = tqdm(areas)
-    for i, area in enumerate(pbar):
-        if area == " Private Rollers" or area == "_Collector Books_":
-            continue
+    timings = defaultdict(float)
+    areas = [area for area in areas if area not in SKIPPED_AREAS]
+
+    def save_checkpoint(completed_areas: int):
+        # All data of the run is stored, hence only once per interval
+        if not checkpoint.due():
+            return
+        # Pickled together, such that the features in the lookup dictionaries
+        # remain the ones in the data
+        checkpoint.save_state(
+            {
+                "completed_areas": completed_areas,
+                "server_data": server_data,
+                "device_data": device_data,
+                "server_dict": server_dict,
+                "device_dict": device_dict,
+                "problem_data": problem_data,
+                "machine_idx": machine_idx,
+                "validated_links": validated_links,
+                "counts": (total_changes, new, depr),
+                "differ_state": (
+                    differ_state.current,
+                    differ_state.skipped,
+                    differ_state.current_areas,
+                    differ_state.skipped_areas,
+                ),
+                "snapshot_index": snapshots.index,
+            }
+        )
+        # Links checked so far are not requested again when resuming
+        link_validator.save()
+
+    if state is None:
+        completed = 0
+        save_checkpoint(completed)
+    else:
+        completed = state["completed_areas"]
+        server_data = state["server_data"]
+        device_data = state["device_data"]
+        server_dict = state["server_dict"]
+        device_dict = state["device_dict"]
+        problem_data = state["problem_data"]
+        machine_idx = state["machine_idx"]
+        validated_links = state["validated_links"]
+        total_changes, new, depr = state["counts"]
+        (
+            differ_state.current,
+            differ_state.skipped,
+            differ_state.current_areas,
+            differ_state.skipped_areas,
+        ) = state["differ_state"]
+        snapshots.index = state["snapshot_index"]
+
+    pbar = tqdm(
+        prefetch_areas(
+            areas[completed:], snapshots, differ_state.unchanged_page, timings
+        ),
+        total=len(areas),
+        initial=completed,
+    )
+    process_start = time.perf_counter()
+    for i, (area, page, content, prelim_geojsons) in enumerate(pbar, start=completed):
         pbar.set_description(f"Working on area:{i + 1}/{len(areas)}: {area}")
 
-        # Scraping data for that area
-        area_id = COUNTRY_TO_CODE[area]
-        url = AREA_PREFIX + str(area_id)
-        website = get_website(url)
+        area_hash = area_fingerprint(
+            external[external.area == area].to_dict(orient="records")
+        )
 
-        # Extract the machine locations
-        location_raw_list = get_location_list_from_location_website(website)
-        changes = 0
-        length = len(location_raw_list)
-        for j, raw_location in enumerate(location_raw_list):
-            # Convert to preliminary geo-json (no ID and no GPS coordinates)
-            geojson = get_prelim_geojson(raw_location, area, add_date=True)
+        def area_data(links: List[str]) -> str:
+            # Fingerprint of our data for the listings of the area
+            known_entries = {
+                link: server_dict.get(link, []) + device_dict.get(link, [])
+                for link in links
+            }
+            return area_data_fingerprint(
+                links, known_entries, skip_links, area_hash, country_to_titles[area]
+            )
 
+        previous_links = differ_state.lookup_area(area, page, area_data)
+        if previous_links is not None:
+            # Neither the page nor our data changed, reuse all decisions of the
+            # area (which were all reusable) without parsing and matching
+            for link in previous_links:
+                if link in skip_links:
+                    continue
+                previous = differ_state.previous[link]
+                differ_state.skip(link, previous)
+                if previous["decision"] == "match" and previous["state"] == "available":
+                    validated_links.add(link)
+                if previous["decision"] == "problem":
+                    problem_data["features"].append(previous["problem"])
+            differ_state.skip_area(area)
+            save_checkpoint(i + 1)
+            continue
+        if prelim_geojsons is None:
+            # Page unchanged but our data changed
+            start = time.perf_counter()
+            prelim_geojsons = parse_area(area, content, snapshots)
+            timings["parse"] += time.perf_counter() - start
+        links = [geojson["properties"]["external_url"] for geojson in prelim_geojsons]
+        area_data_hash = area_data(links)
+
+        def lookup_previous(geojson: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+            # Decision of the last run if neither the listing nor our data changed
+            link = geojson["properties"]["external_url"]
+            fingerprint = listing_fingerprint(
+                link,
+                server_dict.get(link, []) + device_dict.get(link, []),
+                area_hash,
+                geojson["properties"]["name"] in country_to_titles[area],
+            )
+            previous = differ_state.lookup(
+                link,
+                geojson["properties"]["machine_status"],
+                geojson["temporary"]["website_updated"],
+                fingerprint,
+            )
+            return fingerprint, previous
+
+        # Check the links of available machines concurrently in the background
+        link_validator.prefetch(
+            geojson["properties"]["external_url"]
+            for geojson in prelim_geojsons
+            if geojson["properties"]["machine_status"] == "available"
+            and geojson["properties"]["external_url"] not in skip_links
+            and lookup_previous(geojson)[1] is None
+        )
+        changes = 0
+        length = len(prelim_geojsons)
+        for j, geojson in enumerate(prelim_geojsons):
             this_link = geojson["properties"]["external_url"]
             this_state = geojson["properties"]["machine_status"]
             this_title = geojson["properties"]["name"]
@@ -200,11 +539,37 @@ def location_differ(
             if this_link in skip_links:
                 continue
 
+            this_fingerprint, previous = lookup_previous(geojson)
+            if previous is not None:
+                # Listing and our data are unchanged, reuse the last decision
+                differ_state.skip(this_link, previous)
+                if previous["decision"] == "match" and this_state == "available":
+                    validated_links.add(this_link)
+                if previous["decision"] == "problem":
+                    problem_data["features"].append(previous["problem"])
+                continue
+
+            decisions = []
+
+            def record(decision: str, problem: Optional[Dict[str, Any]] = None):
+                # A listing that needs manual handling must never be skipped
+                decisions.append(decision)
+                if "manual" in decisions:
+                    decision = "manual"
+                differ_state.record(
+                    this_link,
+                    this_state,
+                    this_update,
+                    this_fingerprint,
+                    decision,
+                    problem,
+                )
+
             if this_state == "available":
                 # Check whether weblink is accessible
-                resp = safely_test_link(this_link)
+                resp = link_validator.check(this_link)
                 if not resp:
-                    # Log message already captured in safely_test_link
+                    # Log message already captured in the link validator
                     pass
                 elif resp.reason != "OK":
                     msg = f"Machine {this_title} in {area} shown as available but {this_link} responds {resp.reason} ({resp.status_code})"
@@ -215,12 +580,10 @@ def location_differ(
                     )
                     continue
                 else:
-                    validated_links.append(this_link)
+                    validated_links.add(this_link)
 
             for cur_dict, name in zip([server_dict, device_dict], ["Server", "Device"]):
-                keys = list(cur_dict.keys())
-
-                if this_link in keys:
+                if this_link in cur_dict:
                     cur_states = [
                         cur_dict[this_link][s]["properties"]["machine_status"]
                         for s in range(len(cur_dict[this_link]))
@@ -232,15 +595,18 @@ def location_differ(
                             prelim_to_problem_json(geojson, msg)
                         )
                         match = True
+                        record("manual")
                         continue
                     cur_state = cur_states[0]
                     if this_state == cur_state:
                         # Existing machine with no update
                         match = True
+                        record("match")
                         break
                     elif this_state in REMOVED_STATES and cur_state == "retired":
                         # Machine moved/gone before and after
                         match = True
+                        record("match")
                         break
                     elif (
                         this_state in TEMPORARY_UNAVAIALBLE_STATES
@@ -248,6 +614,7 @@ def location_differ(
                     ):
                         # Machine temporarily unavailable before and after
                         match = True
+                        record("match")
                         break
 
                     # The state for an already documented machine has changed.
@@ -262,12 +629,14 @@ def location_differ(
                             prelim_to_problem_json(geojson, msg)
                         )
                         match = True
+                        record("manual")
                         continue
                     cur_updated = cur_updates[0]
 
                     if this_update < cur_updated:
                         # Our machine was updated more recently than the website
                         match = True
+                        record("match")
                         break
 
                     if cur_state == "available" and this_state in UNAVAILABLE_STATES:
@@ -484,6 +853,7 @@ def location_differ(
             ### This is a new machine since the key was not found in both dicts
             if this_state in UNAVAILABLE_STATES:
                 # Untracked machine that is not available, hence we can skip
+                record("untracked")
                 continue
 
             # Check whether machine is not a duplication of an existing, sane machine
@@ -491,11 +861,12 @@ def location_differ(
                 logger.debug(
                     f"Machine {this_title} in {area}, fetched from {this_link} seems to be a duplicate"
                 )
+                record("duplicate")
                 continue
 
             # Check whether we can indeed add/change this machine
-            resp = safely_test_link(this_link)
-            if isinstance(resp, bool) and not resp:
+            resp = link_validator.check(this_link)
+            if resp is None:
                 msg = f"To-be-added-machine {this_title} in {area} seems unavailable: {this_link}"
                 if this_link not in problems_links:
                     logger.info(msg)
@@ -508,79 +879,47 @@ def location_differ(
                 problem_data["features"].append(prelim_to_problem_json(geojson, msg))
                 continue
 
-            tdf = external[external.area == geojson["properties"]["area"]]
-            if len(tdf) > 0:
+            block = matcher.block(area)
+            if block is not None:
                 # Verify that machine is indeed new through fuzzy search
-                query = this_title
-                result = fuzzysearch.extract(query, list(tdf["name"]), limit=2)
-                if len(result) == 1 or result[1][1] <= 92:
-                    # regular case
-                    match, score = result[0]
-                else:
-                    logger.info(
-                        f"Edge case, potentially multiple matches for {this_title}"
-                    )
-                    query = this_title + this_address
-                    result = fuzzysearch.extract(
-                        query,
-                        [n + a for n, a in zip(tdf["name"], tdf["address"])],
-                        limit=2,
-                    )
-                    if result[1][1] > 92:
-                        logger.info(
-                            f"After comparing title ({this_title}) and address ({this_address}) there are still multiple matches, taking first one"
-                        )
-                    match, score = result[0]
-
-                if query == this_title + this_address:
-                    tdf["name_address"] = [
-                        n + a for n, a in zip(tdf["name"], tdf["address"])
-                    ]
-                    m_idx = list(tdf.name_address).index(match)
-                elif score > 92:
-                    # There is a match, we have to update the link
-                    # Extract the entry from original data
-                    m_idx = list(tdf["name"]).index(match)
-
-                if query == this_title + this_address or score > 92:
-                    if tdf.iloc[m_idx]["source"] == "Device":
+                name_match = matcher.match_name(block, this_title, this_address)
+                if name_match is not None:
+                    m_idx, match, _ = name_match
+                    if block.sources[m_idx] == "Device":
                         cur_data = device_data
                     else:
                         cur_data = server_data
 
-                    e_entry = cur_data["features"][tdf.iloc[m_idx]["data_idx"]]
+                    e_entry = cur_data["features"][block.data_idxs[m_idx]]
                     logger.info(
                         f"Seems that machine {this_title} already exists as: {match}"
                     )
                     # Update machine and save in dict
                     assert e_entry["properties"]["external_url"] == "null"
-                    if tdf.iloc[m_idx]["source"] == "Device":
+                    if block.sources[m_idx] == "Device":
                         e_entry["properties"]["external_url"] = this_link
                         e_entry["properties"]["last_updated"] = today
                         server_data["features"].append(e_entry)
                     else:
                         # Machine is already in server_dict, just update content
-                        i = tdf.iloc[m_idx]["data_idx"]
+                        i = block.data_idxs[m_idx]
                         server_data["features"][i]["properties"]["external_url"] = (
                             this_link
                         )
                         server_data["features"][i]["properties"]["last_updated"] = today
                     continue
 
-                match, score = fuzzysearch.extract(
-                    this_address, list(tdf["address"]), limit=1
-                )[0]
-
-                if score >= 92:
+                address_match = matcher.match_address(block, this_address)
+                if address_match is not None:
                     # There is a match, we have to update the link
                     # Extract the entry from original data
-                    m_idx = list(tdf["address"]).index(match)
-                    if tdf.iloc[m_idx]["source"] == "Device":
+                    m_idx, match, _ = address_match
+                    if block.sources[m_idx] == "Device":
                         cur_data = device_data
                     else:
                         cur_data = server_data
 
-                    e_entry = cur_data["features"][tdf.iloc[m_idx]["data_idx"]]
+                    e_entry = cur_data["features"][block.data_idxs[m_idx]]
                     logger.info(
                         f"Seeems that machine {this_title} at {this_address} already exists as: {match}"
                     )
@@ -591,15 +930,16 @@ def location_differ(
                         problem_data["features"].append(
                             prelim_to_problem_json(geojson, msg)
                         )
+                        record("problem", problem_data["features"][-1])
                         continue
 
-                    if tdf.iloc[m_idx]["source"] == "Device":
+                    if block.sources[m_idx] == "Device":
                         e_entry["properties"]["external_url"] = this_link
                         e_entry["properties"]["last_updated"] = today
                         server_data["features"].append(e_entry)
                     else:
                         # Machine is already in server_dict, just update content
-                        i = tdf.iloc[m_idx]["data_idx"]
+                        i = block.data_idxs[m_idx]
                         server_data["features"][i]["properties"]["external_url"] = (
                             this_link
                         )
@@ -613,36 +953,29 @@ def location_differ(
                     api=gmaps,
                 )
 
-                dists = [
-                    haversine(
-                        (lat, lng),
-                        (float(e["latitude"]), float(e["longitude"])),
-                        unit="m",
-                    )
-                    for _, e in tdf.iterrows()
-                ]
-                if min(dists) < 100:
+                distance_match = matcher.match_distance(block, lat, lng)
+                if distance_match is not None:
                     # There is a match, we have to update the link
                     # Extract the entry from original data
-                    m_idx = dists.index(min(dists))
-                    if tdf.iloc[m_idx]["source"] == "Device":
+                    m_idx = distance_match.row
+                    if block.sources[m_idx] == "Device":
                         cur_data = device_data
                     else:
                         cur_data = server_data
 
-                    e_entry = cur_data["features"][tdf.iloc[m_idx]["data_idx"]]
+                    e_entry = cur_data["features"][block.data_idxs[m_idx]]
                     msg = f"Distance match - Seeems that machine {this_title} at {this_address} already exists as: {e_entry['properties']['name']}"
                     if "elongated-coin" in e_entry["properties"]["external_url"]:
                         msg += f"\n Overwriting link {e_entry['properties']['external_url']}"
                     logger.info(msg)
                     # Update machine and save in dict
-                    if tdf.iloc[m_idx]["source"] == "Device":
+                    if block.sources[m_idx] == "Device":
                         e_entry["properties"]["external_url"] = this_link
                         e_entry["properties"]["last_updated"] = today
                         server_data["features"].append(e_entry)
                     else:
                         # Machine is already in server_dict, just update content
-                        i = tdf.iloc[m_idx]["data_idx"]
+                        i = block.data_idxs[m_idx]
                         server_data["features"][i]["properties"]["external_url"] = (
                             this_link
                         )
@@ -665,6 +998,7 @@ def location_differ(
             if (lat, lng) == (0, 0):
                 msg = f"{geojson['properties']['name']} could not find coordinates for {geojson['properties']['address']}"
                 problem_data["features"].append(prelim_to_problem_json(geojson, msg))
+                record("problem", problem_data["features"][-1])
             else:
                 logger.info(
                     f"{j}/{length}: Found machine to be added: {geojson['properties']['name']} in {area}"
@@ -674,6 +1008,8 @@ def location_differ(
                 machine_idx += 1
                 server_data["features"].append(geojson)
         total_changes += changes
+        differ_state.record_area(area, page, area_data_hash, links, skip_links)
+        save_checkpoint(i + 1)
 
     logger.info(
         f"\n Result: {total_changes} changes, {new} new machines found"
@@ -686,24 +1022,55 @@ def location_differ(
         dups = [(v, c) for v, c in counts.items() if c > 1]
         raise ValueError(f"Identified duplicate machines: {dups}")
 
-    server_data = verify_remaining_machines(server_data, device_data, validated_links)
+    timings["process_areas"] = (
+        time.perf_counter() - process_start - timings["wait_for_pages"]
+    )
+
+    verify_start = time.perf_counter()
+    server_data = verify_remaining_machines(
+        server_data, device_data, validated_links, link_validator
+    )
+    timings["verify_links"] = time.perf_counter() - verify_start
+    link_validator.save()
+    link_results = link_validator.results()
+    snapshots.record_links(link_results)
+    logger.info(
+        f"Checked {len(link_results)} links, {link_validator.cache_hits} from the cache"
+    )
+    logger.info(
+        f"Skipped {differ_state.skipped} unchanged listings, "
+        f"{differ_state.skipped_areas} areas without parsing"
+    )
+    logger.info(
+        f"{snapshots.unchanged_pages} unchanged pages, "
+        f"reused {snapshots.parses_reused} parsed pages"
+    )
 
-    fn = "server_locations.json"
-    with open(os.path.join(output_folder, fn), "w", encoding="utf8") as f:
-        json.dump(server_data, f, ensure_ascii=False, indent=4)
+    io.dump(server_data, os.path.join(output_folder, "server_locations.json"))
 
     if len(problem_data["features"]) > 0:
         logger.error(
             f"Found {len(problem_data['features'])} problems that require manual intervention"
         )
-        with open(
-            os.path.join(output_folder, "problems.json"), "w", encoding="utf8"
-        ) as f:
-            json.dump(problem_data, f, ensure_ascii=False, indent=4)
+        io.dump(problem_data, os.path.join(output_folder, "problems.json"))
+    # Only a completed run may be used to skip listings in the next run
+    if not replay:
+        differ_state.save()
+    snapshots.save()
+    checkpoint.clear()
+    with open(running_path, "w") as _:
+        pass
 
+    # Fetch and parse run in the background, so they overlap with the processing
+    logger.info(
+        "Stage timings: "
+        + ", ".join(f"{stage}={seconds:.1f}s" for stage, seconds in timings.items())
+    )
+    http_client.CLIENT.log_stats()
     end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     logger.info(f"======Location differ completed at {end_time}=======")
+    return timings
 
 
 if __name__ == "__main__":
@@ -714,4 +1081,9 @@ if __name__ == "__main__":
         args.server_json,
         args.api_key,
         args.load_from_github,
+        args.full,
+        args.replay,
+        args.snapshot_dir,
+        args.resume,
+        args.checkpoint_dir,
     )
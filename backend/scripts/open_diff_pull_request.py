@@ -1,16 +1,21 @@
 import argparse
 import json
 import os
+from typing import Any, Dict, Optional, Tuple
 
 from loguru import logger
 
+from pennyme import io
+from pennyme.feature_diff import FeatureDiff, HashCache, diff_features, git_blob_sha
 from pennyme.github_update import (
     DATA_BRANCH,
     HEADER_LOCATION_DIFF,
     TOKEN_TO_REVIEWER,
     commit_json_file,
+    decode_json_content,
+    encode_json_file,
     get_pr_id,
-    load_latest_json,
+    load_latest_file_info,
     post_comment_to_pr,
 )
 
@@ -26,62 +31,122 @@ parser.add_argument(
 )
 
 
+def diff_to_latest(
+    path: str, file: str, key: str, cache: HashCache
+) -> Tuple[Optional[FeatureDiff], Dict[str, Any], str]:
+    """
+    Compare a local json file to its latest version on github. The committed
+    version is only downloaded if its hash is not cached.
+
+    Args:
+        path: Path to the local file.
+        file: Path to the file in the repository, e.g., `/data/problems.json`.
+        key: Property identifying a feature across versions.
+        cache: Hashes of recently committed versions.
+
+    Returns:
+        The diff (None if nothing changed), the content of the local file and the
+            blob sha of the latest version.
+    """
+    new = io.load(path)
+    new_hash = io.canonical_hash(new)
+    info = load_latest_file_info(file=file)
+    if cache.get(info["sha"]) == new_hash:
+        return None, new, info["sha"]
+    old = decode_json_content(info)
+    old_hash = io.canonical_hash(old)
+    cache.set(info["sha"], old_hash)
+    if old_hash == new_hash:
+        return None, new, info["sha"]
+    diff = diff_features(old, new, key=key)
+
+    # Keep the diff next to the file for debugging
+    stem = os.path.splitext(path)[0]
+    with open(stem + ".patch.json", "w", encoding="utf8") as f:
+        json.dump(diff.patch, f, ensure_ascii=False, separators=(",", ":"))
+    with open(stem + ".diff.md", "w", encoding="utf8") as f:
+        f.write(diff.to_markdown(os.path.basename(file)))
+    return diff, new, info["sha"]
+
+
+def commit_diff(
+    diff: FeatureDiff,
+    content: Dict[str, Any],
+    file: str,
+    latest_commit_sha: str,
+    commit_message: str,
+    cache: HashCache,
+):
+    """
+    Commit a changed file with its diff as PR body (or comment).
+
+    Args:
+        diff: The diff to the latest version.
+        content: The new content of the file.
+        file: Path to the file in the repository.
+        latest_commit_sha: The blob sha of the latest version.
+        commit_message: The commit message.
+        cache: Hashes of recently committed versions.
+    """
+    logger.info(f"Detected change in {file} ({diff.summary()}) - push to github")
+    committed = commit_json_file(
+        content,
+        branch_name=DATA_BRANCH,
+        commit_message=commit_message,
+        latest_commit_sha=latest_commit_sha,
+        headers=HEADER_LOCATION_DIFF,
+        file_path=file,
+        body=diff.to_markdown(os.path.basename(file)),
+        reviewer=TOKEN_TO_REVIEWER[HEADER_LOCATION_DIFF["Authorization"]],
+    )
+    if committed:
+        # The next run detects that nothing changed without a download
+        cache.set(git_blob_sha(encode_json_file(content)), io.canonical_hash(content))
+
+
 def open_differ_pr(locations_path: str, problems_path: str):
     # general commit message
     commit_message = "Updates from website "
+    cache = HashCache(
+        os.path.join(os.path.dirname(locations_path), "committed_hashes.json")
+    )
 
     # 1) server_locations.json
-    # load new server location
-    with open(locations_path, "r") as infile:
-        server_locations = json.load(infile)
-
-    # get latest_commit_sha
-    old_server_locations, latest_commit_sha = load_latest_json()
-    if old_server_locations != server_locations:
-        logger.info("Detected change in server_locations.json - push to github")
-        joblog = open("/root/PennyMe/new_data/cron.log", "r").read()
-        commit_json_file(
+    locations_file = "/data/server_locations.json"
+    locations_diff, server_locations, latest_commit_sha = diff_to_latest(
+        locations_path, locations_file, "id", cache
+    )
+    if locations_diff:
+        commit_diff(
+            locations_diff,
             server_locations,
-            branch_name=DATA_BRANCH,
-            commit_message=commit_message + "(server_locations)",
-            latest_commit_sha=latest_commit_sha,
-            headers=HEADER_LOCATION_DIFF,
-            body=joblog,
-            reviewer=TOKEN_TO_REVIEWER[HEADER_LOCATION_DIFF["Authorization"]],
+            locations_file,
+            latest_commit_sha,
+            commit_message + "(server_locations)",
+            cache,
         )
     else:
         logger.info("No change between server locations")
 
     # 2) Problems.json
-    # load new problems json
-    with open(problems_path, "r") as infile:
-        problems_json = json.load(infile)
-    # get latest_commit_sha
-    old_problems_json, latest_commit_sha = load_latest_json(file="/data/problems.json")
-
-    if old_problems_json != problems_json:
-        logger.info("Detected change in problems.json - push to github")
-
-        # Load the last logfile from the cronjob
-        joblog = open("/root/PennyMe/new_data/cron.log", "r").read()
-        commit_json_file(
+    # Problems have no id, they are identified by their link
+    problems_file = "/data/problems.json"
+    problems_diff, problems_json, latest_commit_sha = diff_to_latest(
+        problems_path, problems_file, "external_url", cache
+    )
+    if problems_diff:
+        commit_diff(
+            problems_diff,
             problems_json,
-            branch_name=DATA_BRANCH,
-            commit_message=commit_message + "(problems json)",
-            latest_commit_sha=latest_commit_sha,
-            headers=HEADER_LOCATION_DIFF,
-            file_path="/data/problems.json",
-            reviewer=TOKEN_TO_REVIEWER[HEADER_LOCATION_DIFF["Authorization"]],
-            body=(
-                joblog
-                if old_server_locations == server_locations
-                else "New problems require attention."
-            ),
+            problems_file,
+            latest_commit_sha,
+            commit_message + "(problems json)",
+            cache,
         )
     else:
         logger.info("No change between problem jsons")
 
-    if old_server_locations == server_locations and old_problems_json == problems_json:
+    if not locations_diff and not problems_diff:
         pr_id = get_pr_id(branch_name=DATA_BRANCH)
         if pr_id:
             post_comment_to_pr(
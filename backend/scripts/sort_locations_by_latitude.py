@@ -1,26 +1,37 @@
 import argparse
-import json
+
+from pennyme import io
+from pennyme.geo import feature_key
+
+# Sort keys of a feature. The Hilbert curve keeps neighbouring machines close in
+# the file, which is the layout of the data files
+ORDERINGS = {
+    "hilbert": feature_key,
+    "latitude": lambda x: x["geometry"]["coordinates"][1],
+}
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "-i", "--input_filepath", type=str, help="Input geojson-file for sorting"
 )
 parser.add_argument("-o", "--output_filepath", type=str, help="Output file for sorting")
+parser.add_argument(
+    "--order",
+    type=str,
+    choices=sorted(ORDERINGS),
+    default="hilbert",
+    help="Order of the features",
+)
 
 
-def main(input_filepath: str, output_filepath: str):
-    with open(input_filepath, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    sorted_by_lat = sorted(
-        data["features"], key=lambda x: x["geometry"]["coordinates"][1]
+def main(input_filepath: str, output_filepath: str, order: str = "hilbert"):
+    # Only a batch of features is in memory at once, see io.sort_features
+    sorted_features = io.sort_features(
+        io.iter_features(input_filepath), key=ORDERINGS[order]
     )
-    data["features"] = sorted_by_lat
-
-    with open(output_filepath, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    io.dump_features(sorted_features, output_filepath)
 
 
 if __name__ == "__main__":
     args = parser.parse_args()
-    main(args.input_filepath, args.output_filepath)
+    main(args.input_filepath, args.output_filepath, args.order)
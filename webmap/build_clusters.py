@@ -0,0 +1,22 @@
+import argparse
+
+from pennyme import io
+from pennyme.clusters import ClusterIndex
+
+parser = argparse.ArgumentParser(description="Build the cluster tiles of the maps")
+parser.add_argument(
+    "input_path", nargs="?", default="all.json", help="Combined locations"
+)
+parser.add_argument(
+    "output_folder", nargs="?", default="clusters", help="Cluster tile folder"
+)
+parser.add_argument(
+    "--full", action="store_true", help="Rewrite all tiles, not only changed ones"
+)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    index = ClusterIndex(io.iter_features(args.input_path))
+    changed = index.write_tiles(args.output_folder, full=args.full)
+    print(f"{len(index)} machines, wrote or removed {changed} cluster tiles")
@@ -0,0 +1,24 @@
+import argparse
+
+from pennyme import io
+from pennyme.tiles import build_tiles
+
+parser = argparse.ArgumentParser(description="Build the tiles of the web map")
+parser.add_argument(
+    "input_path", nargs="?", default="all.json", help="Combined locations"
+)
+parser.add_argument("output_folder", nargs="?", default="tiles", help="Tile folder")
+parser.add_argument(
+    "--full", action="store_true", help="Rewrite all tiles, not only changed ones"
+)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    build = build_tiles(
+        io.iter_features(args.input_path), args.output_folder, full=args.full
+    )
+    print(
+        f"{build.features} machines, {build.changed} changed: wrote {build.written} "
+        f"tiles, removed {build.removed}, {build.unchanged} tiles unchanged"
+    )
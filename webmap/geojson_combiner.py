@@ -1,34 +1,25 @@
-import json
+import argparse
 
+from pennyme import io
+from pennyme.geo import spatially_sorted
+from pennyme.merge import REPLACE_IN_PLACE, merge_features
 
-def combine_geojson_files(file1_path, file2_path, output_path):
-    # Load the first GeoJSON file
-    with open(file1_path, "r") as file:
-        geojson1 = json.load(file)
+parser = argparse.ArgumentParser()
+parser.add_argument("file1_path", nargs="?", default="../data/all_locations.json")
+parser.add_argument("file2_path", nargs="?", default="../data/server_locations.json")
+parser.add_argument("output_path", nargs="?", default="all.json")
 
-    # Load the second GeoJSON file
-    with open(file2_path, "r") as file:
-        geojson2 = json.load(file)
 
-    # Combine the features, preferring features from the second file
-    combined_features = {
-        feature["properties"]["id"]: feature for feature in geojson1["features"]
-    }
-    combined_features.update(
-        {feature["properties"]["id"]: feature for feature in geojson2["features"]}
+def combine_geojson_files(file1_path, file2_path, output_path):
+    # Combine the features, preferring features from the second (smaller) file
+    combined_features = merge_features(
+        io.iter_features(file1_path), io.iter_features(file2_path), REPLACE_IN_PLACE
     )
-
-    # Create a new GeoJSON structure with combined features
-    combined_geojson = {
-        "type": "FeatureCollection",
-        "features": list(combined_features.values()),
-    }
-
-    # Save the combined GeoJSON to the specified output path
-    with open(output_path, "w") as file:
-        json.dump(combined_geojson, file, indent=4)
+    # Save the combined GeoJSON to the specified output path, in the layout of the
+    # data files
+    io.dump_features(spatially_sorted(combined_features), output_path)
 
 
-combine_geojson_files(
-    "../data/all_locations.json", "../data/server_locations.json", "all.json"
-)
+if __name__ == "__main__":
+    args = parser.parse_args()
+    combine_geojson_files(args.file1_path, args.file2_path, args.output_path)